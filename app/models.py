@@ -103,7 +103,7 @@ class Property(db.Model):
 
 class Photo(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
-	property_id = db.Column(db.Integer, db.ForeignKey("property.id"), nullable=False)
+	property_id = db.Column(db.Integer, db.ForeignKey("property.id"), nullable=False, index=True)
 	file_path = db.Column(db.String(255), nullable=False)
 	created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
@@ -1,5 +1,7 @@
 from datetime import datetime
+import mimetypes
 import os
+import re
 import uuid
 
 from flask import flash, redirect, render_template, request, url_for, send_from_directory, abort, send_file
@@ -19,6 +21,7 @@ def change_inquiry_status(inquiry_id):
 		db.session.commit()
 		flash("Статус заявки обновлен!", "success")
 	return redirect(url_for("all_inquiries"))
+from sqlalchemy.orm import selectinload
 from werkzeug.utils import secure_filename
 
 from . import app, db
@@ -72,7 +75,9 @@ def all_inquiries():
 def index():
 	if current_user.is_authenticated:
 		# Домашняя страница: список объектов недвижимости
-		properties = Property.query.order_by(Property.created_at.desc()).all()
+		# Фото всех объектов одним запросом, а не по запросу на объект
+		properties = (Property.query.options(selectinload(Property.photos))
+					  .order_by(Property.created_at.desc()).all())
 		return render_template("properties.html", properties=properties)
 	return render_template("index.html", tasks=[])  # гостевая страница
 
@@ -83,21 +88,44 @@ def allowed_file(filename):
 	return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
 
 
+# Загрузки сохраняются как <uuid4>_<имя> и не перезаписываются: URL однозначно задает содержимое
+IMMUTABLE_UPLOAD = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_")
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+# Имя файла -> (абсолютный путь, MIME-тип) уже найденных загрузок
+_UPLOAD_LOOKUP = {}
+
+
+def lookup_upload(filename):
+	"""Путь и MIME-тип загрузки; кэшируются только найденные файлы"""
+	found = _UPLOAD_LOOKUP.get(filename)
+	if found is None:
+		file_path = os.path.join(os.path.abspath(app.config['UPLOAD_FOLDER']), filename)
+		if not os.path.isfile(file_path):
+			return None
+		found = (file_path, mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+		_UPLOAD_LOOKUP[filename] = found
+	return found
+
+
 @app.route("/uploads/<filename>")
 def uploaded_file(filename):
-	import mimetypes
-	
-	# Определяем абсолютный путь к папке uploads
-	upload_folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
-	file_path = os.path.join(upload_folder, filename)
-	
-	# Проверяем, существует ли файл
-	if os.path.exists(file_path):
-		mime = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
-		return send_file(file_path, mimetype=mime)
-	else:
-		# Если файл не найден, возвращаем 404
+	found = lookup_upload(filename)
+	if found is None:
+		abort(404)
+	file_path, mime = found
+	immutable = IMMUTABLE_UPLOAD.match(filename) is not None
+	try:
+		# conditional=True: Range/If-Range, If-None-Match и 304 обрабатывает werkzeug
+		response = send_file(file_path, mimetype=mime, conditional=True,
+							 etag=filename if immutable else True,
+							 max_age=UPLOAD_MAX_AGE if immutable else None)
+	except FileNotFoundError:
+		# Файл удален после того, как путь попал в кэш
+		_UPLOAD_LOOKUP.pop(filename, None)
 		abort(404)
+	if immutable:
+		response.cache_control.immutable = True
+	return response
 
 
 @app.route("/properties/new", methods=["GET", "POST"])
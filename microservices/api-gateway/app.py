@@ -1,7 +1,13 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
 from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session, send_file
+from flask import Response, abort, has_request_context, copy_current_request_context, stream_with_context
 from werkzeug.utils import secure_filename
+from requests.adapters import HTTPAdapter
 import requests
 import os
+import threading
+import time
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
@@ -20,6 +26,292 @@ PAYMENT_SERVICE_URL = os.environ.get("PAYMENT_SERVICE_URL", "http://localhost:50
 MEDIA_SERVICE_URL = os.environ.get("MEDIA_SERVICE_URL", "http://localhost:5010")
 LOGGING_SERVICE_URL = os.environ.get("LOGGING_SERVICE_URL", "http://localhost:5011")
 
+# Upper bound for a page that fans out to several services (seconds)
+PAGE_DEADLINE = float(os.environ.get("PAGE_DEADLINE", 5))
+# Number of listings rendered per catalog page
+PROPERTY_PAGE_SIZE = int(os.environ.get("PROPERTY_PAGE_SIZE", 24))
+# Newest listings offered in the appointment form (property-service caps pages at 100)
+APPOINTMENT_PROPERTY_CHOICES = int(os.environ.get("APPOINTMENT_PROPERTY_CHOICES", 100))
+# Most ids property-service resolves in one GET /properties?ids=
+PROPERTY_IDS_PER_REQUEST = 100
+# Files are relayed in chunks of this size, so memory per transfer stays bounded
+STREAM_CHUNK_SIZE = 64 * 1024
+# Headers relayed to the service when proxying a file download, and back to the browser
+PROXY_REQUEST_HEADERS = ("Accept", "Range", "If-Range", "If-None-Match", "If-Modified-Since")
+PROXY_RESPONSE_HEADERS = (
+    "Content-Type", "Content-Length", "Content-Encoding", "Content-Range", "Accept-Ranges",
+    "ETag", "Last-Modified", "Cache-Control", "Expires", "Vary",
+)
+# Downstream list bodies kept with their ETag/Last-Modified for revalidation, total bytes (0 disables)
+VALIDATOR_CACHE_BYTES = int(os.environ.get("VALIDATOR_CACHE_BYTES", 32 * 1024 * 1024))
+# Bodies above this size are not kept, so one huge list cannot flush the cache
+VALIDATOR_CACHE_MAX_ENTRY = int(os.environ.get("VALIDATOR_CACHE_MAX_ENTRY", 1024 * 1024))
+# Response headers stored with a cached body
+VALIDATOR_CACHE_HEADERS = ("Content-Type", "ETag", "Last-Modified", "X-Next-Cursor")
+
+
+# Page deadline of the fan_out call running on this thread; it caps the timeout of its downstream calls
+_CALL_DEADLINE = threading.local()
+# Shortest timeout given to a call near its deadline (seconds)
+MIN_CALL_TIMEOUT = 0.1
+
+
+# Upstream latency counters: {route: {service: {count, errors, total_ms, max_ms}}}
+_UPSTREAM_STATS = {}
+_UPSTREAM_STATS_LOCK = threading.Lock()
+
+
+def record_upstream_latency(route: str, service: str, elapsed_ms: float, failed: bool = False):
+    """Accumulate latency of one downstream call under the gateway route that made it"""
+    with _UPSTREAM_STATS_LOCK:
+        stats = _UPSTREAM_STATS.setdefault(route, {}).setdefault(
+            service, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        )
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if failed:
+            stats["errors"] += 1
+
+
+class ServiceClient:
+    """Keep-alive HTTP client for one downstream service.
+
+    Wraps a requests.Session with a dedicated connection pool so that
+    gateway handlers reuse TCP connections instead of opening a new one
+    per call. Every request is timed and recorded per gateway route.
+    """
+
+    def __init__(self, name: str, base_url: str, pool_size: int = 10, timeout: float = 5):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, path: str, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        expires = getattr(_CALL_DEADLINE, "at", None)
+        if expires is not None:
+            kwargs["timeout"] = max(min(kwargs["timeout"], expires - time.monotonic()), MIN_CALL_TIMEOUT)
+        route = (request.endpoint or request.path) if has_request_context() else "background"
+        start = time.perf_counter()
+        failed = False
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            failed = response.status_code >= 500
+            return response
+        except requests.exceptions.RequestException:
+            failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            record_upstream_latency(route, self.name, elapsed_ms, failed)
+
+    def get(self, path: str, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path: str, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+
+# Per-service clients: pool size follows expected concurrency, timeout the slowest normal call
+auth_client = ServiceClient("auth-service", AUTH_SERVICE_URL, pool_size=10, timeout=5)
+property_client = ServiceClient("property-service", PROPERTY_SERVICE_URL, pool_size=20, timeout=5)
+inquiry_client = ServiceClient("inquiry-service", INQUIRY_SERVICE_URL, pool_size=10, timeout=5)
+project_client = ServiceClient("project-service", PROJECT_SERVICE_URL, pool_size=10, timeout=5)
+search_client = ServiceClient("search-service", SEARCH_SERVICE_URL, pool_size=10, timeout=5)
+notification_client = ServiceClient("notification-service", NOTIFICATION_SERVICE_URL, pool_size=5, timeout=5)
+analytics_client = ServiceClient("analytics-service", ANALYTICS_SERVICE_URL, pool_size=10, timeout=5)
+reporting_client = ServiceClient("reporting-service", REPORTING_SERVICE_URL, pool_size=4, timeout=10)
+payment_client = ServiceClient("payment-service", PAYMENT_SERVICE_URL, pool_size=5, timeout=5)
+media_client = ServiceClient("media-service", MEDIA_SERVICE_URL, pool_size=5, timeout=30)
+logging_client = ServiceClient("logging-service", LOGGING_SERVICE_URL, pool_size=4, timeout=5)
+
+# Shared worker pool for concurrent downstream calls
+_FANOUT_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="fanout")
+
+
+# Last 200 body per (user, service, path, params) that carried validators, LRU order. Requests
+# without credentials get the same answer for everyone, so they share one entry (user None).
+CachedBody = namedtuple("CachedBody", "content headers")
+_VALIDATOR_CACHE = OrderedDict()
+_VALIDATOR_CACHE_LOCK = threading.Lock()
+_VALIDATOR_CACHE_STATE = {"bytes": 0}
+_REVALIDATION_STATS = {"not_modified": 0, "modified": 0, "first_fetch": 0, "evictions": 0}
+
+
+def cached_response(entry: CachedBody) -> requests.Response:
+    """A fresh 200 response built from a cached body"""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = entry.content
+    response.headers.update(entry.headers)
+    return response
+
+
+def forget_validated(key):
+    entry = _VALIDATOR_CACHE.pop(key, None)
+    if entry is not None:
+        _VALIDATOR_CACHE_STATE["bytes"] -= len(entry.content)
+
+
+def revalidated_get(client: ServiceClient, path: str, params: dict = None, headers: dict = None, **kwargs):
+    """GET that revalidates the last copy received instead of downloading it again.
+
+    A 304 from the service returns the stored body, so callers always see a
+    200 with a body. Only the body and a few headers are kept, bounded by
+    VALIDATOR_CACHE_BYTES in total.
+    """
+    headers = dict(headers or {})
+    owner = None
+    if "Authorization" in headers:
+        user = (session.get("user") or {}) if has_request_context() else {}
+        owner = user.get("id") or user.get("email") or headers["Authorization"]
+    key = (owner, client.name, path, tuple(sorted((params or {}).items())))
+    with _VALIDATOR_CACHE_LOCK:
+        cached = _VALIDATOR_CACHE.get(key)
+    if cached is not None:
+        if cached.headers.get("ETag"):
+            headers["If-None-Match"] = cached.headers["ETag"]
+        if cached.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+    
+    response = client.get(path, params=params, headers=headers, **kwargs)
+    if response.status_code == 304 and cached is not None:
+        with _VALIDATOR_CACHE_LOCK:
+            _REVALIDATION_STATS["not_modified"] += 1
+            if key in _VALIDATOR_CACHE:
+                _VALIDATOR_CACHE.move_to_end(key)
+        return cached_response(cached)
+    
+    cacheable = (
+        response.status_code == 200 and VALIDATOR_CACHE_BYTES > 0
+        and (response.headers.get("ETag") or response.headers.get("Last-Modified"))
+        and "no-store" not in response.headers.get("Cache-Control", "")
+        and len(response.content) <= min(VALIDATOR_CACHE_MAX_ENTRY, VALIDATOR_CACHE_BYTES)
+    )
+    with _VALIDATOR_CACHE_LOCK:
+        forget_validated(key)
+        if cacheable:
+            _REVALIDATION_STATS["modified" if cached is not None else "first_fetch"] += 1
+            entry = CachedBody(response.content, {
+                name: response.headers[name] for name in VALIDATOR_CACHE_HEADERS if name in response.headers
+            })
+            _VALIDATOR_CACHE[key] = entry
+            _VALIDATOR_CACHE_STATE["bytes"] += len(entry.content)
+            while _VALIDATOR_CACHE_STATE["bytes"] > VALIDATOR_CACHE_BYTES:
+                forget_validated(next(iter(_VALIDATOR_CACHE)))
+                _REVALIDATION_STATS["evictions"] += 1
+    return response
+
+
+class UploadStream:
+    """The incoming request body, re-sent unparsed to a service.
+
+    requests reads it block by block while sending; ``__len__`` makes it
+    send the original Content-Length instead of chunked encoding.
+    """
+
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+
+def forward_upload(client: ServiceClient, path: str, method: str = "POST", **kwargs):
+    """Send the current request body to a service without parsing or buffering it"""
+    headers = dict(kwargs.pop("headers", None) or {}, **{"Content-Type": request.content_type})
+    if request.content_length is None:
+        body = iter(lambda: request.stream.read(STREAM_CHUNK_SIZE), b"")  # sent chunked
+    else:
+        body = UploadStream(request.stream, request.content_length)
+    return client.request(method, path, data=body, headers=headers, **kwargs)
+
+
+def stream_download(client: ServiceClient, path: str, params: dict = None):
+    """Relay a file from a service chunk by chunk, with range and cache headers"""
+    headers = {name: request.headers[name] for name in PROXY_REQUEST_HEADERS if name in request.headers}
+    upstream = client.get(path, params=params, headers=headers, stream=True)
+    if upstream.status_code >= 500:
+        upstream.close()
+        app.logger.warning("download %s: upstream answered %s", path, upstream.status_code)
+        abort(502)
+    if upstream.status_code not in (200, 206, 304, 416):
+        # 404, 400 for an unknown ?size= and other client errors reach the browser as the service sent them
+        body = upstream.content
+        upstream.close()
+        return Response(body, status=upstream.status_code, content_type=upstream.headers.get("Content-Type"))
+    relayed = {name: upstream.headers[name] for name in PROXY_RESPONSE_HEADERS if name in upstream.headers}
+    # Raw bytes, so Content-Length and Content-Encoding stay true
+    body = upstream.raw.stream(STREAM_CHUNK_SIZE, decode_content=False)
+    response = Response(stream_with_context(body), status=upstream.status_code, headers=relayed)
+    response.call_on_close(upstream.close)
+    return response
+
+
+def fetch_json(client: ServiceClient, path: str, **kwargs):
+    """GET a JSON document from a service, None on a non-200 answer"""
+    response = revalidated_get(client, path, **kwargs)
+    if response.status_code == 200:
+        return response.json()
+    return None
+
+
+def fan_out(calls: dict, deadline: float = None) -> dict:
+    """Run independent downstream calls concurrently under one page deadline.
+
+    ``calls`` maps a name to a zero-argument callable. The result maps each
+    name to its return value; calls that raised or did not finish before the
+    deadline are left out, so the page can render with partial data.
+    """
+    deadline = PAGE_DEADLINE if deadline is None else deadline
+    expires = time.monotonic() + deadline
+    futures = {}
+    for name, call in calls.items():
+        if has_request_context():
+            call = copy_current_request_context(call)
+        futures[_FANOUT_EXECUTOR.submit(run_until, call, expires)] = name
+
+    done, not_done = wait(futures, timeout=deadline)
+    for future in not_done:
+        # A running call cannot be interrupted; its request timeout ends it at the deadline.
+        # Only calls still queued behind a busy pool are dropped here.
+        if future.cancel():
+            app.logger.warning("fan_out: %s not started before the %ss deadline", futures[future], deadline)
+        else:
+            app.logger.warning("fan_out: %s missed the %ss deadline", futures[future], deadline)
+
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            app.logger.warning("fan_out: %s failed: %s", futures[future], e)
+    return results
+
+
+def run_until(call, expires: float):
+    """Run a fan_out call on a pool thread with its downstream timeouts capped at expires"""
+    _CALL_DEADLINE.at = expires
+    try:
+        return call()
+    finally:
+        _CALL_DEADLINE.at = None
+
 
 # User class wrapper
 class CurrentUser:
@@ -78,36 +370,33 @@ def index():
     if not session.get("user"):
         return render_template("index.html")
     
-    # Получаем параметры поиска
-    city = request.args.get("city", "").strip()
-    property_type = request.args.get("property_type", "").strip()
+    # Фильтры, сортировка и курсор страницы уходят в property-service
+    params = {"limit": PROPERTY_PAGE_SIZE}
+    for key in ("city", "property_type", "sort", "after"):
+        value = request.args.get(key, "").strip()
+        if value:
+            params[key] = value
+    
     max_price = request.args.get("max_price", "").strip()
+    if max_price:
+        try:
+            params["max_price"] = float(max_price)
+        except ValueError:
+            pass
     
-    # Get all properties
+    properties = []
+    next_url = None
     try:
-        response = requests.get(f"{PROPERTY_SERVICE_URL}/properties", timeout=5)
+        response = revalidated_get(property_client, "/properties", params=params)
         if response.status_code == 200:
             properties = response.json()
-        else:
-            properties = []
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if next_cursor:
+                next_url = url_for("index", **{**request.args.to_dict(), "after": next_cursor})
     except:
-        properties = []
-    
-    # Фильтрация на стороне клиента
-    if city:
-        properties = [p for p in properties if city.lower() in p.get("city", "").lower()]
-    
-    if property_type:
-        properties = [p for p in properties if p.get("property_type") == property_type]
-    
-    if max_price:
-        try:
-            max_price_num = float(max_price)
-            properties = [p for p in properties if p.get("price_eur", 0) <= max_price_num]
-        except ValueError:
-            pass
+        pass
     
-    return render_template("properties.html", properties=properties)
+    return render_template("properties.html", properties=properties, next_url=next_url)
 
 
 # Auth routes
@@ -118,10 +407,9 @@ def register():
         password = request.form.get("password", "")
         
         try:
-            response = requests.post(
-                f"{AUTH_SERVICE_URL}/register",
-                json={"email": email, "password": password},
-                timeout=5
+            response = auth_client.post(
+                "/register",
+                json={"email": email, "password": password}
             )
             
             if response.status_code == 201:
@@ -144,10 +432,9 @@ def login():
         password = request.form.get("password", "")
         
         try:
-            response = requests.post(
-                f"{AUTH_SERVICE_URL}/login",
-                json={"email": email, "password": password},
-                timeout=5
+            response = auth_client.post(
+                "/login",
+                json={"email": email, "password": password}
             )
             
             if response.status_code == 200:
@@ -165,6 +452,12 @@ def login():
 
 @app.route("/logout")
 def logout():
+    token = session.get("token")
+    if token:
+        try:
+            auth_client.post("/revoke", json={"token": token}, timeout=2)
+        except:
+            pass  # Token still expires on its own
     session.clear()
     return redirect(url_for("index"))
 
@@ -178,39 +471,9 @@ def new_property():
         return redirect(url_for("index"))
     
     if request.method == "POST":
-        # Prepare multipart form data
-        files = {}
-        if 'photos' in request.files:
-            files['photos'] = request.files.getlist('photos')
-        
-        data = {
-            'title': request.form.get('title'),
-            'description': request.form.get('description'),
-            'city': request.form.get('city'),
-            'address': request.form.get('address'),
-            'price_eur': request.form.get('price_eur'),
-            'property_type': request.form.get('property_type'),
-            'rooms': request.form.get('rooms'),
-            'area_m2': request.form.get('area_m2'),
-            'is_for_sale': 'true' if request.form.get('is_for_sale') == 'on' else 'false',
-            'is_for_rent': 'true' if request.form.get('is_for_rent') == 'on' else 'false'
-        }
-        
         try:
-            # Prepare files for upload
-            files_data = []
-            if 'photos' in request.files:
-                for file in request.files.getlist('photos'):
-                    if file and file.filename:
-                        files_data.append(('photos', (file.filename, file.stream, file.content_type)))
-            
-            response = requests.post(
-                f"{PROPERTY_SERVICE_URL}/properties",
-                data=data,
-                files=files_data if files_data else None,
-                headers=get_auth_headers(),
-                timeout=10
-            )
+            # The multipart body goes to property-service as is; photos are never buffered here
+            response = forward_upload(property_client, "/properties", headers=get_auth_headers(), timeout=10)
             
             if response.status_code == 201:
                 flash("Property created!", "success")
@@ -226,9 +489,8 @@ def new_property():
 @app.route("/properties/<int:property_id>")
 def property_detail(property_id: int):
     try:
-        response = requests.get(
-            f"{PROPERTY_SERVICE_URL}/properties/{property_id}",
-            timeout=5
+        response = property_client.get(
+            f"/properties/{property_id}"
         )
         
         if response.status_code == 200:
@@ -238,8 +500,8 @@ def property_detail(property_id: int):
             user = get_current_user()
             if user.is_authenticated:
                 try:
-                    requests.post(
-                        f"{ANALYTICS_SERVICE_URL}/events",
+                    analytics_client.post(
+                        "/events",
                         json={
                             "event_type": "property_view",
                             "resource_id": property_id,
@@ -282,11 +544,10 @@ def edit_property(property_id: int):
         }
         
         try:
-            response = requests.put(
-                f"{PROPERTY_SERVICE_URL}/properties/{property_id}",
+            response = property_client.put(
+                f"/properties/{property_id}",
                 json=data,
-                headers=get_auth_headers(),
-                timeout=5
+                headers=get_auth_headers()
             )
             
             if response.status_code == 200:
@@ -299,9 +560,8 @@ def edit_property(property_id: int):
     
     # Get property data
     try:
-        response = requests.get(
-            f"{PROPERTY_SERVICE_URL}/properties/{property_id}",
-            timeout=5
+        response = property_client.get(
+            f"/properties/{property_id}"
         )
         if response.status_code == 200:
             prop = response.json()
@@ -321,10 +581,9 @@ def property_delete(property_id: int):
         return redirect(url_for("index"))
     
     try:
-        response = requests.delete(
-            f"{PROPERTY_SERVICE_URL}/properties/{property_id}",
-            headers=get_auth_headers(),
-            timeout=5
+        response = property_client.delete(
+            f"/properties/{property_id}",
+            headers=get_auth_headers()
         )
         
         if response.status_code == 200:
@@ -339,25 +598,12 @@ def property_delete(property_id: int):
 
 @app.route("/uploads/<filename>")
 def uploaded_file(filename):
-    """Proxy file serving to property service"""
+    """Proxy file serving to property service (?size= picks a thumbnail variant)"""
+    params = {"size": request.args["size"]} if "size" in request.args else None
     try:
-        response = requests.get(
-            f"{PROPERTY_SERVICE_URL}/uploads/{filename}",
-            timeout=5,
-            stream=True
-        )
-        
-        if response.status_code == 200:
-            from io import BytesIO
-            return send_file(
-                BytesIO(response.content),
-                mimetype=response.headers.get('Content-Type', 'application/octet-stream')
-            )
-    except:
-        pass
-    
-    from flask import abort
-    abort(404)
+        return stream_download(property_client, f"/uploads/{filename}", params)
+    except requests.exceptions.RequestException:
+        abort(502)
 
 
 # --- Search integration ---
@@ -372,8 +618,8 @@ def search():
     if user.is_authenticated and (q or city or property_type):
         try:
             search_query = f"q={q}, city={city}, type={property_type}".strip(", ")
-            requests.post(
-                f"{ANALYTICS_SERVICE_URL}/events",
+            analytics_client.post(
+                "/events",
                 json={
                     "event_type": "search",
                     "user_id": user.id,
@@ -384,27 +630,30 @@ def search():
         except:
             pass
 
+    params = {"q": q, "city": city, "property_type": property_type, "limit": PROPERTY_PAGE_SIZE, "facets": 1}
+    for key in ("min_price", "max_price", "min_area", "max_area", "rooms"):
+        if request.args.get(key):
+            params[key] = request.args[key]
+
+    facets = None
     try:
-        resp = requests.get(
-            f"{SEARCH_SERVICE_URL}/search",
-            params={"q": q, "city": city, "property_type": property_type},
-            timeout=5,
-        )
+        resp = search_client.get("/search", params=params)
         if resp.status_code == 200:
-            properties = resp.json()
+            data = resp.json()
+            properties, facets = data["results"], data["facets"]
         else:
             properties = []
     except Exception as e:
         flash(f"Search service error: {str(e)}", "error")
         properties = []
 
-    return render_template("properties.html", properties=properties)
+    return render_template("properties.html", properties=properties, facets=facets)
 
 
 @app.route("/search/index", methods=["POST"])
 def rebuild_index():
     try:
-        resp = requests.post(f"{SEARCH_SERVICE_URL}/index", timeout=10)
+        resp = search_client.post("/index", timeout=10)
         if resp.status_code in (200, 201):
             flash("Search index rebuilt", "success")
         else:
@@ -425,11 +674,10 @@ def create_notification():
     }
     headers = get_auth_headers() if user.is_authenticated else {}
     try:
-        resp = requests.post(
-            f"{NOTIFICATION_SERVICE_URL}/notifications",
+        resp = notification_client.post(
+            "/notifications",
             json=data,
             headers=headers,
-            timeout=5,
         )
         if resp.status_code == 201:
             flash("Notification sent!", "success")
@@ -457,7 +705,7 @@ def list_notifications():
     
     try:
         print(f"[DEBUG] Calling {NOTIFICATION_SERVICE_URL}/notifications")
-        resp = requests.get(f"{NOTIFICATION_SERVICE_URL}/notifications", headers=headers, timeout=5)
+        resp = revalidated_get(notification_client, "/notifications", headers=headers)
         print(f"[DEBUG] Notification response status: {resp.status_code}")
         print(f"[DEBUG] User: {user.email}, Role: {user.role}")
         
@@ -507,11 +755,10 @@ def create_inquiry(property_id: int):
     try:
         # Send token if user is authenticated
         headers = get_auth_headers() if user.is_authenticated else {}
-        response = requests.post(
-            f"{INQUIRY_SERVICE_URL}/inquiries",
+        response = inquiry_client.post(
+            "/inquiries",
             json=data,
-            headers=headers,
-            timeout=5
+            headers=headers
         )
         
         if response.status_code == 201:
@@ -520,8 +767,8 @@ def create_inquiry(property_id: int):
             # Track inquiry creation event
             if user.is_authenticated:
                 try:
-                    requests.post(
-                        f"{ANALYTICS_SERVICE_URL}/events",
+                    analytics_client.post(
+                        "/events",
                         json={
                             "event_type": "inquiry_create",
                             "resource_id": property_id,
@@ -554,10 +801,10 @@ def my_inquiries():
         # inquiry-service уже фильтрует заявки:
         # - агенты видят все
         # - пользователи видят только свои (по email через Client)
-        response = requests.get(
-            f"{INQUIRY_SERVICE_URL}/inquiries",
-            headers=get_auth_headers(),
-            timeout=5
+        response = revalidated_get(
+            inquiry_client,
+            "/inquiries",
+            headers=get_auth_headers()
         )
         
         if response.status_code == 200:
@@ -578,10 +825,9 @@ def delete_inquiry(inquiry_id: int):
         return redirect(url_for("index"))
     
     try:
-        response = requests.delete(
-            f"{INQUIRY_SERVICE_URL}/inquiries/{inquiry_id}",
-            headers=get_auth_headers(),
-            timeout=5
+        response = inquiry_client.delete(
+            f"/inquiries/{inquiry_id}",
+            headers=get_auth_headers()
         )
         
         if response.status_code == 200:
@@ -607,10 +853,10 @@ def all_inquiries():
         return redirect(url_for("index"))
     
     try:
-        response = requests.get(
-            f"{INQUIRY_SERVICE_URL}/inquiries",
-            headers=get_auth_headers(),
-            timeout=5
+        response = revalidated_get(
+            inquiry_client,
+            "/inquiries",
+            headers=get_auth_headers()
         )
         
         if response.status_code == 200:
@@ -632,11 +878,10 @@ def change_inquiry_status(inquiry_id: int):
     new_status = request.form.get("status")
     
     try:
-        response = requests.put(
-            f"{INQUIRY_SERVICE_URL}/inquiries/{inquiry_id}/status",
+        response = inquiry_client.put(
+            f"/inquiries/{inquiry_id}/status",
             json={"status": new_status},
-            headers=get_auth_headers(),
-            timeout=5
+            headers=get_auth_headers()
         )
         
         if response.status_code == 200:
@@ -667,11 +912,10 @@ def appointments():
         }
         
         try:
-            response = requests.post(
-                f"{INQUIRY_SERVICE_URL}/appointments",
+            response = inquiry_client.post(
+                "/appointments",
                 json=data,
-                headers=get_auth_headers(),
-                timeout=5
+                headers=get_auth_headers()
             )
             
             if response.status_code == 201:
@@ -681,27 +925,33 @@ def appointments():
         except Exception as e:
             flash(f"Service error: {str(e)}", "error")
     
-    # Get appointments and properties
-    appointments_list = []
-    properties = []
-    
-    try:
-        response = requests.get(
-            f"{INQUIRY_SERVICE_URL}/appointments",
-            headers=get_auth_headers(),
-            timeout=5
-        )
-        if response.status_code == 200:
-            appointments_list = response.json()
-    except:
-        pass
-    
-    try:
-        response = requests.get(f"{PROPERTY_SERVICE_URL}/properties", timeout=5)
-        if response.status_code == 200:
-            properties = response.json()
-    except:
-        pass
+    # Get appointments and one page of properties for the form concurrently
+    headers = get_auth_headers()
+    expires = time.monotonic() + PAGE_DEADLINE
+    results = fan_out({
+        "appointments": lambda: fetch_json(inquiry_client, "/appointments", headers=headers),
+        "properties": lambda: fetch_json(property_client, "/properties",
+                                         params={"limit": APPOINTMENT_PROPERTY_CHOICES}),
+    })
+    appointments_list = results.get("appointments") or []
+    properties = results.get("properties") or []
+    
+    # Titles of scheduled properties: fetch only the ids the appointments reference, in parallel
+    # batches under what is left of the page deadline; titles that miss it render as not found
+    by_id = {prop["id"]: prop for prop in properties}
+    missing = sorted({apt["property_id"] for apt in appointments_list} - by_id.keys())
+    batches = {}
+    for start in range(0, len(missing), PROPERTY_IDS_PER_REQUEST):
+        ids = ",".join(str(i) for i in missing[start:start + PROPERTY_IDS_PER_REQUEST])
+        batches[f"properties {ids}"] = lambda ids=ids: fetch_json(property_client, "/properties",
+                                                                  params={"ids": ids})
+    remaining = expires - time.monotonic()
+    if batches and remaining > 0:
+        for found in fan_out(batches, deadline=remaining).values():
+            for prop in found or []:
+                by_id[prop["id"]] = prop
+    for apt in appointments_list:
+        apt["property"] = by_id.get(apt["property_id"])
     
     return render_template("appointments.html", appointments=appointments_list, properties=properties)
 
@@ -716,11 +966,10 @@ def create_project():
     name = request.form.get("name", "").strip()
     
     try:
-        response = requests.post(
-            f"{PROJECT_SERVICE_URL}/projects",
+        response = project_client.post(
+            "/projects",
             json={"name": name},
-            headers=get_auth_headers(),
-            timeout=5
+            headers=get_auth_headers()
         )
         
         if response.status_code == 201:
@@ -740,10 +989,9 @@ def view_project(project_id: int):
         return redirect(url_for("login"))
     
     try:
-        response = requests.get(
-            f"{PROJECT_SERVICE_URL}/projects/{project_id}",
-            headers=get_auth_headers(),
-            timeout=5
+        response = project_client.get(
+            f"/projects/{project_id}",
+            headers=get_auth_headers()
         )
         
         if response.status_code == 200:
@@ -773,11 +1021,10 @@ def create_task(project_id: int):
     }
     
     try:
-        response = requests.post(
-            f"{PROJECT_SERVICE_URL}/projects/{project_id}/tasks",
+        response = project_client.post(
+            f"/projects/{project_id}/tasks",
             json=data,
-            headers=get_auth_headers(),
-            timeout=5
+            headers=get_auth_headers()
         )
         
         if response.status_code == 201:
@@ -797,10 +1044,9 @@ def toggle_task(task_id: int):
         return redirect(url_for("login"))
     
     try:
-        response = requests.post(
-            f"{PROJECT_SERVICE_URL}/tasks/{task_id}/toggle",
-            headers=get_auth_headers(),
-            timeout=5
+        response = project_client.post(
+            f"/tasks/{task_id}/toggle",
+            headers=get_auth_headers()
         )
         
         if response.status_code != 200:
@@ -818,10 +1064,9 @@ def delete_task(task_id: int):
         return redirect(url_for("login"))
     
     try:
-        response = requests.delete(
-            f"{PROJECT_SERVICE_URL}/tasks/{task_id}",
-            headers=get_auth_headers(),
-            timeout=5
+        response = project_client.delete(
+            f"/tasks/{task_id}",
+            headers=get_auth_headers()
         )
         
         if response.status_code == 200:
@@ -842,24 +1087,16 @@ def analytics():
         flash("Доступ запрещён", "error")
         return redirect(url_for("index"))
     
-    stats = {}
-    events = []
-    
-    try:
-        # Get statistics
-        resp = requests.get(f"{ANALYTICS_SERVICE_URL}/stats", headers=get_auth_headers(), timeout=5)
-        if resp.status_code == 200:
-            stats = resp.json()
-    except:
+    # Get statistics and recent events concurrently
+    headers = get_auth_headers()
+    results = fan_out({
+        "stats": lambda: fetch_json(analytics_client, "/stats", headers=headers),
+        "events": lambda: fetch_json(analytics_client, "/events", params={"limit": 20}, headers=headers),
+    })
+    if "stats" not in results:
         flash("Analytics service unavailable", "error")
-    
-    try:
-        # Get recent events
-        resp = requests.get(f"{ANALYTICS_SERVICE_URL}/events?limit=20", headers=get_auth_headers(), timeout=5)
-        if resp.status_code == 200:
-            events = resp.json()
-    except:
-        pass
+    stats = results.get("stats") or {}
+    events = results.get("events") or []
     
     return render_template("analytics.html", stats=stats, events=events)
 
@@ -878,11 +1115,10 @@ def track_event():
     }
     
     try:
-        resp = requests.post(
-            f"{ANALYTICS_SERVICE_URL}/events", 
+        resp = analytics_client.post(
+            "/events", 
             json=payload, 
-            headers=get_auth_headers(), 
-            timeout=5
+            headers=get_auth_headers()
         )
         return jsonify({"status": "ok"}), 200
     except Exception as e:
@@ -908,7 +1144,7 @@ def report_properties():
         return jsonify({"error": "Unauthorized"}), 403
     
     try:
-        resp = requests.get(f"{REPORTING_SERVICE_URL}/reports/properties", headers=get_auth_headers(), timeout=10)
+        resp = reporting_client.get("/reports/properties", headers=get_auth_headers())
         if resp.status_code == 200:
             return jsonify(resp.json()), 200
     except Exception as e:
@@ -924,7 +1160,7 @@ def report_inquiries():
         return jsonify({"error": "Unauthorized"}), 403
     
     try:
-        resp = requests.get(f"{REPORTING_SERVICE_URL}/reports/inquiries", headers=get_auth_headers(), timeout=10)
+        resp = reporting_client.get("/reports/inquiries", headers=get_auth_headers())
         if resp.status_code == 200:
             return jsonify(resp.json()), 200
     except Exception as e:
@@ -947,7 +1183,7 @@ def create_payment():
     }
     
     try:
-        resp = requests.post(f"{PAYMENT_SERVICE_URL}/transactions", json=data, headers=get_auth_headers(), timeout=5)
+        resp = payment_client.post("/transactions", json=data, headers=get_auth_headers())
         if resp.status_code == 201:
             flash("Платёж успешно создан!", "success")
             return redirect(url_for("my_payments"))
@@ -968,7 +1204,7 @@ def my_payments():
     
     transactions = []
     try:
-        resp = requests.get(f"{PAYMENT_SERVICE_URL}/transactions", headers=get_auth_headers(), timeout=5)
+        resp = revalidated_get(payment_client, "/transactions", headers=get_auth_headers())
         if resp.status_code == 200:
             transactions = resp.json()
     except:
@@ -984,22 +1220,50 @@ def upload_media():
     if not user.is_authenticated:
         return jsonify({"error": "Unauthorized"}), 401
     
-    if 'file' not in request.files:
-        return jsonify({"error": "No file provided"}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "No file selected"}), 400
+    try:
+        # media-service validates the file; the body is relayed without parsing it here
+        resp = forward_upload(media_client, "/upload", headers=get_auth_headers())
+        return jsonify(resp.json()), resp.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/media/upload/sessions", methods=["POST"])
+def create_upload_session():
+    """Start a resumable upload in media-service"""
+    user = get_current_user()
+    if not user.is_authenticated:
+        return jsonify({"error": "Unauthorized"}), 401
     
     try:
-        files = {'file': (file.filename, file.stream, file.content_type)}
-        resp = requests.post(f"{MEDIA_SERVICE_URL}/upload", files=files, headers=get_auth_headers(), timeout=30)
-        if resp.status_code == 201:
-            return jsonify(resp.json()), 201
+        resp = media_client.post("/upload/sessions", json=request.get_json(silent=True) or {},
+                                 headers=get_auth_headers())
+        return jsonify(resp.json()), resp.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+@app.route("/media/upload/sessions/<upload_id>", methods=["GET", "PUT", "DELETE"])
+@app.route("/media/upload/sessions/<upload_id>/complete", methods=["POST"])
+def upload_session(upload_id):
+    """Status, chunks, completion and cancel of a resumable upload; chunks are streamed through"""
+    user = get_current_user()
+    if not user.is_authenticated:
+        return jsonify({"error": "Unauthorized"}), 401
     
-    return jsonify({"error": "Upload failed"}), 500
+    path = f"/upload/sessions/{upload_id}"
+    try:
+        if request.method == "PUT":
+            resp = forward_upload(media_client, path, method="PUT", params=request.args.to_dict(),
+                                  headers=get_auth_headers())
+        elif request.method == "POST":
+            resp = media_client.post(f"{path}/complete", json=request.get_json(silent=True) or {},
+                                     headers=get_auth_headers())
+        else:
+            resp = media_client.request(request.method, path, headers=get_auth_headers())
+        return jsonify(resp.json()), resp.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 # --- Logging Service routes ---
@@ -1012,7 +1276,7 @@ def view_logs():
     
     logs = []
     try:
-        resp = requests.get(f"{LOGGING_SERVICE_URL}/logs?limit=100", headers=get_auth_headers(), timeout=5)
+        resp = logging_client.get("/logs?limit=100", headers=get_auth_headers())
         if resp.status_code == 200:
             logs = resp.json()
     except:
@@ -1021,6 +1285,30 @@ def view_logs():
     return render_template("logs.html", logs=logs)
 
 
+# --- Gateway metrics ---
+@app.route("/metrics/upstream")
+def upstream_metrics():
+    """Latency of downstream calls grouped by gateway route and service"""
+    with _UPSTREAM_STATS_LOCK:
+        snapshot = {
+            route: {
+                service: dict(stats, avg_ms=round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0.0)
+                for service, stats in services.items()
+            }
+            for route, services in _UPSTREAM_STATS.items()
+        }
+    return jsonify(snapshot), 200
+
+
+@app.route("/metrics/revalidation")
+def revalidation_metrics():
+    """Conditional GETs answered 304 versus full downloads"""
+    with _VALIDATOR_CACHE_LOCK:
+        stats = dict(_REVALIDATION_STATS, size=len(_VALIDATOR_CACHE),
+                     bytes=_VALIDATOR_CACHE_STATE["bytes"], capacity_bytes=VALIDATOR_CACHE_BYTES)
+    return jsonify(stats), 200
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=True)
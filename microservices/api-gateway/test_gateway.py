@@ -1,5 +1,9 @@
+import json
+import requests
+import time
 import unittest
-from app import app
+from unittest import mock
+from app import app, property_client, search_client, payment_client, media_client, inquiry_client, ServiceClient, fan_out
 
 class TestAPIGateway(unittest.TestCase):
     def setUp(self):
@@ -38,6 +42,295 @@ class TestAPIGateway(unittest.TestCase):
         """Тест несуществующей страницы"""
         response = self.client.get('/nonexistent-page')
         self.assertEqual(response.status_code, 404)
+    def test_service_client_pool(self):
+        """Тест пула соединений клиента сервиса"""
+        client = ServiceClient("test-service", "http://test-service:9000/", pool_size=7, timeout=3)
+        adapter = client.session.get_adapter("http://test-service:9000/health")
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(client.base_url, "http://test-service:9000")
+        self.assertEqual(client.timeout, 3)
+    
+    def test_upstream_metrics(self):
+        """Тест счётчиков задержки по маршрутам"""
+        fake_response = mock.Mock(status_code=200)
+        with mock.patch.object(property_client.session, "request", return_value=fake_response) as fake_request:
+            with app.test_request_context('/'):
+                property_client.get("/properties")
+        
+        fake_request.assert_called_once_with("GET", f"{property_client.base_url}/properties", timeout=5)
+        response = self.client.get('/metrics/upstream')
+        self.assertEqual(response.status_code, 200)
+        stats = response.get_json()["index"]["property-service"]
+        self.assertGreaterEqual(stats["count"], 1)
+        self.assertIn("avg_ms", stats)
+
+    def test_fan_out_runs_calls_concurrently(self):
+        """Тест параллельного выполнения запросов"""
+        def slow(value):
+            time.sleep(0.2)
+            return value
+        
+        start = time.perf_counter()
+        results = fan_out({"a": lambda: slow(1), "b": lambda: slow(2), "c": lambda: slow(3)}, deadline=2)
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual(results, {"a": 1, "b": 2, "c": 3})
+        self.assertLess(elapsed, 0.5)
+    
+    def test_fan_out_partial_results(self):
+        """Тест частичного результата при медленном или упавшем сервисе"""
+        def too_slow():
+            time.sleep(1)
+            return "late"
+        
+        def broken():
+            raise RuntimeError("service down")
+        
+        start = time.perf_counter()
+        results = fan_out({"fast": lambda: "ok", "slow": too_slow, "broken": broken}, deadline=0.2)
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual(results, {"fast": "ok"})
+        self.assertLess(elapsed, 0.9)
+
+    def test_fan_out_caps_request_timeout(self):
+        """Тест ограничения таймаута запросов внутри fan_out оставшимся временем страницы"""
+        fake_response = mock.Mock(status_code=200)
+        with mock.patch.object(property_client.session, "request", return_value=fake_response) as fake_request:
+            fan_out({"list": lambda: property_client.get("/properties")}, deadline=0.5)
+            property_client.get("/properties")
+        
+        timeouts = [call.kwargs["timeout"] for call in fake_request.call_args_list]
+        self.assertLessEqual(timeouts[0], 0.5)
+        self.assertEqual(timeouts[1], property_client.timeout)
+    
+    def test_index_forwards_filters(self):
+        """Тест передачи фильтров и курсора в property-service"""
+        with self.client.session_transaction() as sess:
+            sess['user'] = {'id': 1, 'email': 'agent@test.com', 'role': 'agent'}
+            sess['token'] = 'token'
+        
+        fake_response = mock.Mock(status_code=200, headers={'X-Next-Cursor': 'next-page'})
+        fake_response.json.return_value = []
+        with mock.patch.object(property_client.session, "request", return_value=fake_response) as fake_request:
+            response = self.client.get('/?city=Кишинев&property_type=house&max_price=90000&sort=-price')
+        
+        self.assertEqual(response.status_code, 200)
+        params = fake_request.call_args.kwargs['params']
+        self.assertEqual(params['city'], 'Кишинев')
+        self.assertEqual(params['property_type'], 'house')
+        self.assertEqual(params['max_price'], 90000.0)
+        self.assertEqual(params['sort'], '-price')
+        self.assertIn('limit', params)
+    
+    def test_search_renders_facets(self):
+        """Тест вывода фасетов на странице поиска"""
+        fake_response = mock.Mock(status_code=200)
+        fake_response.json.return_value = {
+            'results': [], 'total': 0,
+            'facets': {'city': {'Бельцы': 3}, 'property_type': {'house': 3}, 'price': {'50000-100000': 3}},
+        }
+        with mock.patch.object(search_client.session, "request", return_value=fake_response) as fake_request:
+            response = self.client.get('/search?q=дом&max_price=90000')
+        
+        self.assertEqual(response.status_code, 200)
+        params = fake_request.call_args.kwargs['params']
+        self.assertEqual(params['facets'], 1)
+        self.assertEqual(params['max_price'], '90000')
+        self.assertIn('Бельцы', response.get_data(as_text=True))
+
+    def test_appointments_fetch_bounded_properties(self):
+        """Тест календаря: одна страница объектов для формы и названия только нужных объектов"""
+        with self.client.session_transaction() as sess:
+            sess['user'] = {'id': 1, 'email': 'agent@test.com', 'role': 'agent'}
+            sess['token'] = 'token'
+        appointments = mock.Mock(status_code=200, headers={})
+        appointments.json.return_value = [
+            {'id': 1, 'property_id': 7, 'scheduled_at': '2025-01-01T10:00:00', 'client_name': 'A'},
+            {'id': 2, 'property_id': 2, 'scheduled_at': '2025-01-02T10:00:00', 'client_name': 'B'},
+        ]
+        page = mock.Mock(status_code=200, headers={})
+        page.json.return_value = [{'id': 2, 'title': 'Дом у озера', 'city': 'C'}]
+        by_ids = mock.Mock(status_code=200, headers={})
+        by_ids.json.return_value = [{'id': 7, 'title': 'Старая квартира', 'city': 'C'}]
+        
+        def fake_property_request(method, url, params=None, **kwargs):
+            return by_ids if 'ids' in params else page
+        
+        with mock.patch.object(inquiry_client.session, "request", return_value=appointments), \
+                mock.patch.object(property_client.session, "request", side_effect=fake_property_request) as fake_request:
+            response = self.client.get('/appointments')
+        
+        params = [call.kwargs['params'] for call in fake_request.call_args_list]
+        self.assertIn({'limit': 100}, params)
+        self.assertIn({'ids': '7'}, params)
+        self.assertEqual(len(params), 2)
+        html = response.get_data(as_text=True)
+        self.assertIn('Старая квартира', html)
+        self.assertIn('Дом у озера', html)
+        
+        # Past the page deadline the ids lookup is not made and the page renders without the title
+        with mock.patch("app.PAGE_DEADLINE", 0.2), \
+                mock.patch.object(inquiry_client.session, "request", return_value=appointments), \
+                mock.patch.object(property_client.session, "request",
+                                  side_effect=lambda *a, **kw: time.sleep(0.3) or page):
+            started = time.monotonic()
+            response = self.client.get('/appointments')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Объект не найден', response.get_data(as_text=True))
+    
+    def test_revalidates_per_user(self):
+        """Тест повторной проверки списка по ETag отдельно для каждого пользователя"""
+        transactions = [{'transaction_id': 'txn-cached', 'user_id': 1, 'amount': 10.0,
+                         'currency': 'EUR', 'status': 'success', 'property_id': None,
+                         'created_at': '2025-01-01T00:00:00'}]
+        full = mock.Mock(status_code=200, headers={'ETag': '"v1"'}, content=json.dumps(transactions).encode())
+        full.json.return_value = transactions
+        not_modified = mock.Mock(status_code=304, headers={'ETag': '"v1"'})
+        
+        def login(user_id):
+            with self.client.session_transaction() as sess:
+                sess['user'] = {'id': user_id, 'email': f'user{user_id}@test.com', 'role': 'user'}
+                sess['token'] = f'token-{user_id}'
+        
+        with mock.patch.object(payment_client.session, "request", side_effect=[full, not_modified, full]) as fake_request:
+            login(101)
+            self.client.get('/payments')
+            response = self.client.get('/payments')
+            login(102)
+            self.client.get('/payments')
+        
+        self.assertIn('txn-cached', response.get_data(as_text=True))
+        sent = [call.kwargs['headers'] for call in fake_request.call_args_list]
+        self.assertNotIn('If-None-Match', sent[0])
+        self.assertEqual(sent[1]['If-None-Match'], '"v1"')
+        self.assertNotIn('If-None-Match', sent[2])
+        self.assertGreaterEqual(self.client.get('/metrics/revalidation').get_json()['not_modified'], 1)
+
+    def test_public_lists_shared_and_bounded_by_bytes(self):
+        """Тест общего для пользователей кэша публичных списков с ограничением по байтам"""
+        import app as gateway
+        
+        def page(body, etag):
+            response = mock.Mock(status_code=200, content=body, headers={'ETag': etag, 'Content-Type': 'application/json'})
+            response.json.return_value = []
+            return response
+        
+        not_modified = mock.Mock(status_code=304, headers={})
+        with mock.patch.object(property_client.session, "request",
+                               side_effect=[page(b'[]', '"p1"'), not_modified, page(b'[1]' * 50, '"p2"')]) as fake_request:
+            for user_id in (201, 202):
+                with self.client.session_transaction() as sess:
+                    sess['user'] = {'id': user_id, 'email': f'user{user_id}@test.com', 'role': 'user'}
+                    sess['token'] = f'token-{user_id}'
+                self.client.get('/?city=Оргеев')
+            with mock.patch.object(gateway, 'VALIDATOR_CACHE_MAX_ENTRY', 100):
+                self.client.get('/?city=Сороки')
+        
+        sent = [call.kwargs['headers'] for call in fake_request.call_args_list]
+        self.assertNotIn('If-None-Match', sent[0])
+        self.assertEqual(sent[1]['If-None-Match'], '"p1"')
+        keys = [key for key in gateway._VALIDATOR_CACHE if key[1] == 'property-service']
+        self.assertTrue(all(key[0] is None for key in keys))
+        self.assertFalse(any(('city', 'Сороки') in key[3] for key in keys))
+        stats = self.client.get('/metrics/revalidation').get_json()
+        self.assertEqual(stats['bytes'], sum(len(e.content) for e in gateway._VALIDATOR_CACHE.values()))
+    
+    def test_photo_streamed_with_range_headers(self):
+        """Тест потоковой отдачи фото с передачей Range и заголовков кэширования"""
+        upstream = mock.Mock(status_code=206, headers={
+            'Content-Type': 'image/jpeg', 'Content-Length': '4', 'Content-Range': 'bytes 0-3/10',
+            'ETag': '"abc"', 'Cache-Control': 'public, max-age=60', 'Set-Cookie': 'x=1',
+        })
+        upstream.raw.stream.return_value = iter([b'ab', b'cd'])
+        with mock.patch.object(property_client.session, "request", return_value=upstream) as fake_request:
+            response = self.client.get('/uploads/photo.jpg', headers={'Range': 'bytes=0-3'})
+            body = response.get_data()
+            response.close()
+        
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'abcd')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-3/10')
+        self.assertEqual(response.headers['ETag'], '"abc"')
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(fake_request.call_args.kwargs['headers'], {'Range': 'bytes=0-3'})
+        self.assertTrue(fake_request.call_args.kwargs['stream'])
+        upstream.close.assert_called()
+    
+    def test_download_errors_relayed(self):
+        """Тест передачи ошибок property-service: 4xx как есть, 5xx и обрыв связи как 502"""
+        cases = ((404, b'{"error": "File not found"}', 404), (400, b'{"error": "Unknown size: huge"}', 400),
+                 (503, b'unavailable', 502))
+        for upstream_status, upstream_body, expected in cases:
+            upstream = mock.Mock(status_code=upstream_status, headers={'Content-Type': 'application/json'},
+                                 content=upstream_body)
+            with mock.patch.object(property_client.session, "request", return_value=upstream):
+                response = self.client.get('/uploads/photo.jpg?size=huge')
+            self.assertEqual(response.status_code, expected)
+            if expected < 500:
+                self.assertEqual(response.data, upstream_body)
+            upstream.close.assert_called()
+        
+        with mock.patch.object(property_client.session, "request", side_effect=requests.ConnectionError):
+            self.assertEqual(self.client.get('/uploads/photo.jpg').status_code, 502)
+    
+    def test_photo_size_forwarded(self):
+        """Тест передачи ?size= и Accept в property-service для выбора варианта"""
+        upstream = mock.Mock(status_code=200, headers={'Content-Type': 'image/webp', 'Vary': 'Accept'})
+        upstream.raw.stream.return_value = iter([b'webp'])
+        with mock.patch.object(property_client.session, "request", return_value=upstream) as fake_request:
+            response = self.client.get('/uploads/photo.jpg?size=thumb', headers={'Accept': 'image/webp'})
+            response.close()
+        
+        self.assertEqual(response.headers['Vary'], 'Accept')
+        self.assertEqual(fake_request.call_args.kwargs['params'], {'size': 'thumb'})
+        self.assertEqual(fake_request.call_args.kwargs['headers'], {'Accept': 'image/webp'})
+    
+    def test_upload_relayed_without_parsing(self):
+        """Тест передачи загружаемого файла в media-service без разбора формы"""
+        with self.client.session_transaction() as sess:
+            sess['user'] = {'id': 1, 'email': 'user@test.com', 'role': 'user'}
+            sess['token'] = 'token'
+        body = b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.jpg"\r\n\r\nJPEG\r\n--b--\r\n'
+        sent = {}
+        
+        def fake_request(method, url, data=None, headers=None, **kwargs):
+            sent.update(length=len(data), body=data.read(), headers=headers)
+            response = mock.Mock(status_code=201)
+            response.json.return_value = {'filename': 'a.jpg'}
+            return response
+        
+        with mock.patch.object(media_client.session, "request", side_effect=fake_request):
+            response = self.client.post('/media/upload', data=body, content_type='multipart/form-data; boundary=b')
+        
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((sent['length'], sent['body']), (len(body), body))
+        self.assertEqual(sent['headers']['Content-Type'], 'multipart/form-data; boundary=b')
+        self.assertEqual(sent['headers']['Authorization'], 'Bearer token')
+    
+    def test_upload_chunk_streamed(self):
+        """Тест передачи части возобновляемой загрузки в media-service потоком"""
+        with self.client.session_transaction() as sess:
+            sess['user'] = {'id': 1, 'email': 'user@test.com', 'role': 'user'}
+            sess['token'] = 'token'
+        sent = {}
+        
+        def fake_request(method, url, data=None, params=None, **kwargs):
+            sent.update(method=method, url=url, params=params, length=len(data), body=data.read())
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {'offset': 4}
+            return response
+        
+        with mock.patch.object(media_client.session, "request", side_effect=fake_request):
+            response = self.client.put('/media/upload/sessions/abc?offset=0', data=b'JPEG',
+                                       content_type='application/octet-stream')
+        
+        self.assertEqual(response.get_json(), {'offset': 4})
+        self.assertEqual((sent['method'], sent['params']), ('PUT', {'offset': '0'}))
+        self.assertTrue(sent['url'].endswith('/upload/sessions/abc'))
+        self.assertEqual((sent['length'], sent['body']), (4, b'JPEG'))
+
 
 if __name__ == '__main__':
     unittest.main()
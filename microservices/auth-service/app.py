@@ -1,10 +1,11 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from background import start_on_first_request
+from outbox import Outbox, OutboxMessageMixin
 import jwt
 import hashlib
 import os
-import requests
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
@@ -12,6 +13,13 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:/
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 NOTIFICATION_SERVICE_URL = os.environ.get("NOTIFICATION_SERVICE_URL", "http://localhost:5006")
 
+# Notification outbox dispatcher: poll interval (seconds, 0 disables), rows per batch,
+# request timeout and the cap of the retry backoff (seconds)
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_TIMEOUT = float(os.environ.get("OUTBOX_TIMEOUT", 10))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("OUTBOX_MAX_BACKOFF", 300))
+
 db = SQLAlchemy(app)
 
 
@@ -32,6 +40,18 @@ class User(db.Model):
         }
 
 
+class RevokedToken(db.Model):
+    """Token revoked before its exp (logout); other services poll /revocations"""
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class OutboxMessage(OutboxMessageMixin, db.Model):
+    """Notification written with the change it announces, removed once notification-service stored it"""
+
+
 # Helper functions
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -47,14 +67,32 @@ def create_token(user_id: int, email: str, role: str) -> str:
     return jwt.encode(payload, app.config["SECRET_KEY"], algorithm="HS256")
 
 
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def latest_revocation_id() -> int:
+    return db.session.query(db.func.max(RevokedToken.id)).scalar() or 0
+
+
 def verify_token(token: str):
     try:
         payload = jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    if RevokedToken.query.filter_by(token_hash=token_hash(token)).first():
+        return None
+    return payload
+
+
+# Notifications are queued with the change they announce and delivered in batches (see outbox.py)
+_OUTBOX = Outbox(app, db, OutboxMessage, NOTIFICATION_SERVICE_URL, OUTBOX_POLL_INTERVAL,
+                 OUTBOX_BATCH_SIZE, OUTBOX_TIMEOUT, OUTBOX_MAX_BACKOFF)
+enqueue_notification = _OUTBOX.enqueue
+dispatch_outbox = _OUTBOX.dispatch
+start_on_first_request(app, _OUTBOX.start)
 
 
 # Routes
@@ -79,27 +117,16 @@ def register():
     password_hash = hash_password(password)
     user = User(email=email, password_hash=password_hash, role=role)
     db.session.add(user)
-    db.session.commit()
     
-    # Send welcome notification
-    try:
-        role_names = {
-            "user": "пользователь",
-            "agent": "агент",
-            "admin": "администратор"
-        }
-        welcome_message = f"👋 Добро пожаловать в агентство недвижимости! Вы зарегистрированы как {role_names.get(role, role)}"
-        requests.post(
-            f"{NOTIFICATION_SERVICE_URL}/notifications",
-            json={
-                "recipient": email,
-                "channel": "push",
-                "message": welcome_message
-            },
-            timeout=3
-        )
-    except Exception as e:
-        print(f"Failed to send welcome notification: {e}")
+    # Welcome notification, delivered by the outbox dispatcher once the user is committed
+    role_names = {
+        "user": "пользователь",
+        "agent": "агент",
+        "admin": "администратор"
+    }
+    welcome_message = f"👋 Добро пожаловать в агентство недвижимости! Вы зарегистрированы как {role_names.get(role, role)}"
+    enqueue_notification(email, "push", welcome_message)
+    db.session.commit()
     
     token = create_token(user.id, user.email, user.role)
     return jsonify({"user": user.to_dict(), "token": token}), 201
@@ -137,6 +164,49 @@ def verify():
     return jsonify(payload), 200
 
 
+@app.route("/revoke", methods=["POST"])
+def revoke():
+    """Revoke a token before it expires (logout)"""
+    data = request.get_json() or {}
+    token = data.get("token", "")
+    
+    if not token:
+        return jsonify({"error": "Token required"}), 400
+    
+    payload = verify_token(token)
+    if not payload:
+        # Already invalid, expired or revoked - nothing to do
+        return jsonify({"revoked": False}), 200
+    
+    revoked = RevokedToken(
+        token_hash=token_hash(token),
+        expires_at=datetime.utcfromtimestamp(payload["exp"])
+    )
+    db.session.add(revoked)
+    db.session.commit()
+    return jsonify({"revoked": True}), 200
+
+
+@app.route("/revocations", methods=["GET"])
+def revocations():
+    """Hashes of revoked, not yet expired tokens with id greater than ?since, with their exp"""
+    since = request.args.get("since", 0, type=int)
+    # Read the high-water mark first and cap the rows at it: a token revoked
+    # after this point gets a larger id and is returned by the next poll
+    latest = latest_revocation_id()
+    rows = (RevokedToken.query
+            .filter(RevokedToken.id > since, RevokedToken.id <= latest,
+                    RevokedToken.expires_at > datetime.utcnow())
+            .order_by(RevokedToken.id)
+            .all())
+    return jsonify({
+        "seq": max(latest, since),
+        "revoked": [row.token_hash for row in rows],
+        # Unix time the token expires anyway; consumers drop the hash after it
+        "expires_at": {row.token_hash: row.expires_at.replace(tzinfo=timezone.utc).timestamp() for row in rows}
+    }), 200
+
+
 @app.route("/users/<int:user_id>", methods=["GET"])
 def get_user(user_id: int):
     """Get user by ID (for inter-service communication)"""
@@ -1,5 +1,8 @@
 import unittest
 import json
+import jwt
+from unittest import mock
+import app as auth_app
 from app import app, db, User, hash_password
 
 
@@ -134,6 +137,72 @@ class AuthServiceTestCase(unittest.TestCase):
         response = self.client.post('/verify', json={})
         self.assertEqual(response.status_code, 400)
     
+    def test_revoke_token(self):
+        """Test that a revoked token fails /verify and shows up in /revocations"""
+        response = self.client.post('/register', json={
+            'email': 'revoke@example.com',
+            'password': 'pass'
+        })
+        token = json.loads(response.data)['token']
+        
+        response = self.client.post('/revoke', json={'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['revoked'])
+        
+        response = self.client.post('/verify', json={'token': token})
+        self.assertEqual(response.status_code, 401)
+        
+        response = self.client.get('/revocations?since=0')
+        data = json.loads(response.data)
+        self.assertEqual(len(data['revoked']), 1)
+        exp = jwt.decode(token, options={"verify_signature": False})['exp']
+        self.assertEqual(data['expires_at'], {data['revoked'][0]: exp})
+        seq = data['seq']
+        
+        response = self.client.get(f'/revocations?since={seq}')
+        self.assertEqual(json.loads(response.data)['revoked'], [])
+    
+    def test_revocation_during_poll_not_lost(self):
+        """Test that a token revoked while /revocations runs shows up in exactly one poll"""
+        read_latest = auth_app.latest_revocation_id
+        seq, seen, expected = 0, [], []
+        for n, revoke_first in enumerate((True, False)):
+            response = self.client.post('/register', json={'email': f'race{n}@example.com', 'password': 'pass'})
+            token = json.loads(response.data)['token']
+            expected.append(auth_app.token_hash(token))
+            
+            def revoke_concurrently():
+                if revoke_first:
+                    self.client.post('/revoke', json={'token': token})
+                    return read_latest()
+                latest = read_latest()
+                self.client.post('/revoke', json={'token': token})
+                return latest
+            
+            with mock.patch('app.latest_revocation_id', side_effect=revoke_concurrently):
+                data = json.loads(self.client.get(f'/revocations?since={seq}').data)
+            seen += data['revoked']
+            data = json.loads(self.client.get(f'/revocations?since={data["seq"]}').data)
+            seen += data['revoked']
+            seq = data['seq']
+        
+        self.assertEqual(seen, expected)
+    
+    def test_outbox_dispatcher_started_by_first_request(self):
+        """Test that the outbox dispatcher starts once, with the first request, under any server"""
+        app.config['TESTING'] = False
+        try:
+            with mock.patch('outbox.threading.Thread') as thread:
+                self.client.get('/health')
+                self.client.get('/health')
+        finally:
+            app.config['TESTING'] = True
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+        
+        stats = json.loads(self.client.get('/metrics/outbox').data)
+        self.assertEqual((stats['pending'], stats['oldest_pending']), (0, None))
+    
     def test_get_users(self):
         """Test getting all users"""
         # Create some users
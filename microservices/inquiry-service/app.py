@@ -1,8 +1,16 @@
+from collections import OrderedDict
 from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from background import start_on_first_request
+from list_validators import conditional_list
+from outbox import Outbox, OutboxMessageMixin
+import hashlib
+import jwt
 import os
 import requests
+import threading
+import time
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
@@ -13,6 +21,22 @@ AUTH_SERVICE_URL = os.environ.get("AUTH_SERVICE_URL", "http://localhost:5001")
 PROPERTY_SERVICE_URL = os.environ.get("PROPERTY_SERVICE_URL", "http://localhost:5002")
 NOTIFICATION_SERVICE_URL = os.environ.get("NOTIFICATION_SERVICE_URL", "http://localhost:5006")
 
+# Tokens are signed by auth-service with the shared SECRET_KEY and verified locally
+JWT_SECRET = os.environ.get("JWT_SECRET", app.config["SECRET_KEY"])
+# How often revoked tokens are pulled from auth-service (seconds, 0 disables)
+REVOCATION_POLL_INTERVAL = float(os.environ.get("REVOCATION_POLL_INTERVAL", 30))
+# Verification cache: max entries, TTL for valid tokens (capped at exp) and for invalid ones
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 300))
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", 30))
+
+# Notification outbox dispatcher: poll interval (seconds, 0 disables), rows per batch,
+# request timeout and the cap of the retry backoff (seconds)
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_TIMEOUT = float(os.environ.get("OUTBOX_TIMEOUT", 10))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("OUTBOX_MAX_BACKOFF", 300))
+
 db = SQLAlchemy(app)
 
 
@@ -47,6 +71,8 @@ class Inquiry(db.Model):
     message = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(50), default='new', nullable=False)  # new|in_progress|done|rejected
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Bumped on status changes; drives list ETags and Last-Modified
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
     def to_dict(self):
         return {
@@ -58,7 +84,8 @@ class Inquiry(db.Model):
             "phone": self.phone,
             "message": self.message,
             "status": self.status,
-            "created_at": self.created_at.isoformat()
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
 
 
@@ -82,20 +109,139 @@ class Appointment(db.Model):
         }
 
 
+class OutboxMessage(OutboxMessageMixin, db.Model):
+    """Notification written with the change it announces, removed once notification-service stored it"""
+
+
 # Helper functions
+# Token verification counters, exposed on /metrics/auth
+_AUTH_STATS = {
+    "verified": 0, "rejected": 0, "cache_hits": 0, "cache_misses": 0,
+    "revocation_polls": 0, "total_ms": 0.0, "max_ms": 0.0,
+}
+_AUTH_STATS_LOCK = threading.Lock()
+
+# Verification results by token hash: {hash: (expires_at, payload or None)}, LRU order
+_TOKEN_CACHE = OrderedDict()
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+# Revoked token hashes mirrored from auth-service /revocations: {hash: token exp (unix time)}.
+# Written only by the revocation poller thread; a hash is dropped once its token has expired.
+_REVOKED_TOKENS = {}
+_REVOCATION_STATE = {"seq": 0}
+
+
+def record_verification(elapsed_ms: float, verified: bool, cache_hit: bool):
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["verified" if verified else "rejected"] += 1
+        _AUTH_STATS["cache_hits" if cache_hit else "cache_misses"] += 1
+        _AUTH_STATS["total_ms"] += elapsed_ms
+        _AUTH_STATS["max_ms"] = max(_AUTH_STATS["max_ms"], elapsed_ms)
+
+
+def poll_revocations():
+    """Pull new revocations from auth-service and forget those whose token has expired"""
+    response = requests.get(
+        f"{AUTH_SERVICE_URL}/revocations",
+        params={"since": _REVOCATION_STATE["seq"]},
+        timeout=2
+    )
+    response.raise_for_status()
+    data = response.json()
+    revoked = data.get("revoked", [])
+    # An auth-service without expires_at keeps its hashes until restart, as before
+    expires_at = data.get("expires_at", {})
+    for token_hash in revoked:
+        _REVOKED_TOKENS[token_hash] = expires_at.get(token_hash, float("inf"))
+    now = time.time()
+    for token_hash in [h for h, exp in _REVOKED_TOKENS.items() if exp <= now]:
+        del _REVOKED_TOKENS[token_hash]
+    _REVOCATION_STATE["seq"] = data.get("seq", _REVOCATION_STATE["seq"])
+    with _TOKEN_CACHE_LOCK:
+        for token_hash in revoked:
+            _TOKEN_CACHE.pop(token_hash, None)
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["revocation_polls"] += 1
+
+
+def run_revocation_poller():
+    while True:
+        try:
+            poll_revocations()
+        except Exception as e:
+            # Signatures are still checked locally, auth-service being down must not lock users out
+            print(f"Failed to poll revocations: {e}")
+        time.sleep(REVOCATION_POLL_INTERVAL)
+
+
+def start_revocation_poller():
+    if REVOCATION_POLL_INTERVAL > 0:
+        threading.Thread(target=run_revocation_poller, name="revocation-poller", daemon=True).start()
+
+
+def cached_verification(token_hash: str):
+    """Return (hit, payload) from the verification cache"""
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(token_hash)
+        if entry is None:
+            return False, None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del _TOKEN_CACHE[token_hash]
+            return False, None
+        _TOKEN_CACHE.move_to_end(token_hash)
+        return True, payload
+
+
+def cache_verification(token_hash: str, payload):
+    """Remember a result; valid tokens never outlive their exp, invalid ones get a short TTL"""
+    now = time.time()
+    if payload:
+        expires_at = min(now + TOKEN_CACHE_TTL, payload.get("exp", now))
+    else:
+        expires_at = now + NEGATIVE_CACHE_TTL
+    if expires_at <= now:
+        return
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[token_hash] = (expires_at, payload)
+        _TOKEN_CACHE.move_to_end(token_hash)
+        while len(_TOKEN_CACHE) > TOKEN_CACHE_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+
+
 def verify_token(token: str):
-    """Verify token with auth service"""
-    try:
-        response = requests.post(
-            f"{AUTH_SERVICE_URL}/verify",
-            json={"token": token},
-            timeout=5
-        )
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except:
-        return None
+    """Verify JWT signature and expiry locally with the shared secret"""
+    start = time.perf_counter()
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    hit, payload = cached_verification(token_hash)
+    if not hit:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            payload = None
+        cache_verification(token_hash, payload)
+    if token_hash in _REVOKED_TOKENS:
+        payload = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_verification(elapsed_ms, payload is not None, hit)
+    return payload
+
+
+def add_missing_columns():
+    """create_all() does not alter existing tables, so columns added later are created here"""
+    columns = {column["name"] for column in db.inspect(db.engine).get_columns("inquiry")}
+    if "updated_at" not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE inquiry ADD COLUMN updated_at DATETIME"))
+            conn.execute(db.text("UPDATE inquiry SET updated_at = created_at"))
+
+
+# Notifications are queued with the change they announce and delivered in batches (see outbox.py)
+_OUTBOX = Outbox(app, db, OutboxMessage, NOTIFICATION_SERVICE_URL, OUTBOX_POLL_INTERVAL,
+                 OUTBOX_BATCH_SIZE, OUTBOX_TIMEOUT, OUTBOX_MAX_BACKOFF)
+enqueue_notification = _OUTBOX.enqueue
+dispatch_outbox = _OUTBOX.dispatch
+start_on_first_request(app, _OUTBOX.start, start_revocation_poller)
 
 
 # Routes
@@ -104,6 +250,16 @@ def health():
     return jsonify({"status": "healthy", "service": "inquiry-service"}), 200
 
 
+@app.route("/metrics/auth", methods=["GET"])
+def auth_metrics():
+    """Token verification counters and latency"""
+    with _AUTH_STATS_LOCK:
+        stats = dict(_AUTH_STATS)
+    checks = stats["verified"] + stats["rejected"]
+    stats["avg_ms"] = round(stats["total_ms"] / checks, 3) if checks else 0.0
+    return jsonify(stats), 200
+
+
 # Client routes
 @app.route("/clients", methods=["GET"])
 def get_clients():
@@ -179,22 +335,12 @@ def create_inquiry():
         message=message or None
     )
     db.session.add(inquiry)
-    db.session.commit()
+    db.session.flush()
     
-    # Send notification to agents
-    try:
-        notification_message = f"Новая заявка #{inquiry.id} от {name} ({email or phone}) на объект #{property_id}"
-        requests.post(
-            f"{NOTIFICATION_SERVICE_URL}/notifications",
-            json={
-                "recipient": "agents@agency.com",  # В реальности можно получить email всех агентов
-                "channel": "email",
-                "message": notification_message
-            },
-            timeout=3
-        )
-    except Exception as e:
-        print(f"Failed to send notification: {e}")
+    # Notify agents; the outbox row commits with the inquiry and is sent in the background
+    notification_message = f"Новая заявка #{inquiry.id} от {name} ({email or phone}) на объект #{property_id}"
+    enqueue_notification("agents@agency.com", "email", notification_message)  # В реальности можно получить email всех агентов
+    db.session.commit()
     
     return jsonify(inquiry.to_dict()), 201
 
@@ -210,15 +356,15 @@ def get_inquiries():
     
     if user.get("role") == "agent":
         # Agent sees all inquiries
-        inquiries = Inquiry.query.order_by(Inquiry.created_at.desc()).all()
+        inquiries = Inquiry.query.order_by(Inquiry.created_at.desc())
     else:
         # User sees only their own inquiries
         client = Client.query.filter_by(email=user.get("email")).first()
         if not client:
             return jsonify([]), 200
-        inquiries = client.inquiries
+        inquiries = Inquiry.query.filter_by(client_id=client.id).order_by(Inquiry.id)
     
-    return jsonify([inquiry.to_dict() for inquiry in inquiries]), 200
+    return conditional_list(inquiries, Inquiry, Inquiry.updated_at, f"{user.get('role')}:{user.get('email')}")
 
 
 @app.route("/inquiries/<int:inquiry_id>", methods=["GET"])
@@ -251,29 +397,18 @@ def update_inquiry_status(inquiry_id: int):
     
     old_status = inquiry.status
     inquiry.status = new_status
-    db.session.commit()
     
-    # Send notification to user about status change
+    # Tell the user about the status change
     if inquiry.email and old_status != new_status:
-        try:
-            status_names = {
-                "new": "новая",
-                "in_progress": "в обработке",
-                "done": "выполнена",
-                "rejected": "отклонена"
-            }
-            notification_message = f"📋 Статус вашей заявки #{inquiry_id} изменён: {status_names.get(old_status, old_status)} → {status_names.get(new_status, new_status)}"
-            requests.post(
-                f"{NOTIFICATION_SERVICE_URL}/notifications",
-                json={
-                    "recipient": inquiry.email,
-                    "channel": "push",
-                    "message": notification_message
-                },
-                timeout=3
-            )
-        except Exception as e:
-            print(f"Failed to send status notification: {e}")
+        status_names = {
+            "new": "новая",
+            "in_progress": "в обработке",
+            "done": "выполнена",
+            "rejected": "отклонена"
+        }
+        notification_message = f"📋 Статус вашей заявки #{inquiry_id} изменён: {status_names.get(old_status, old_status)} → {status_names.get(new_status, new_status)}"
+        enqueue_notification(inquiry.email, "push", notification_message)
+    db.session.commit()
     
     return jsonify(inquiry.to_dict()), 200
 
@@ -297,67 +432,23 @@ def delete_inquiry(inquiry_id: int):
         if inquiry.email != user.get("email"):
             return jsonify({"error": "You can only delete your own inquiries"}), 403
     
-    # Save inquiry data before deletion for notifications
-    inquiry_email = inquiry.email
-    inquiry_id_str = inquiry_id
-    
     db.session.delete(inquiry)
-    db.session.commit()
     
-    # Send notifications about deletion
-    try:
-        actor_email = user.get("email")
-        if user.get("role") == "agent":
-            # Notify the inquiry owner (if present)
-            if inquiry_email:
-                user_message = f"🗑️ Ваша заявка #{inquiry_id_str} была удалена сотрудником агентства ({actor_email})."
-                requests.post(
-                    f"{NOTIFICATION_SERVICE_URL}/notifications",
-                    json={
-                        "recipient": inquiry_email,
-                        "channel": "push",
-                        "message": user_message
-                    },
-                    timeout=3
-                )
-
-            # Notify agents about the deletion
-            agent_message = f"🗑️ Заявка #{inquiry_id_str} удалена агентом {actor_email}."
-            requests.post(
-                f"{NOTIFICATION_SERVICE_URL}/notifications",
-                json={
-                    "recipient": "agents@agency.com",
-                    "channel": "push",
-                    "message": agent_message
-                },
-                timeout=3
-            )
-        else:
-            # User deleted their own inquiry — confirm to user and notify agents
-            if inquiry_email:
-                confirm_message = f"✅ Ваша заявка #{inquiry_id_str} успешно удалена."
-                requests.post(
-                    f"{NOTIFICATION_SERVICE_URL}/notifications",
-                    json={
-                        "recipient": inquiry_email,
-                        "channel": "push",
-                        "message": confirm_message
-                    },
-                    timeout=3
-                )
-
-            agent_message = f"🗑️ Пользователь {actor_email} удалил свою заявку #{inquiry_id_str}."
-            requests.post(
-                f"{NOTIFICATION_SERVICE_URL}/notifications",
-                json={
-                    "recipient": "agents@agency.com",
-                    "channel": "push",
-                    "message": agent_message
-                },
-                timeout=3
-            )
-    except Exception as e:
-        print(f"Failed to send deletion notification: {e}")
+    # Deletion notifications commit together with the deletion
+    actor_email = user.get("email")
+    if user.get("role") == "agent":
+        # Notify the inquiry owner (if present) and the agents
+        if inquiry.email:
+            enqueue_notification(inquiry.email, "push",
+                                 f"🗑️ Ваша заявка #{inquiry_id} была удалена сотрудником агентства ({actor_email}).")
+        enqueue_notification("agents@agency.com", "push", f"🗑️ Заявка #{inquiry_id} удалена агентом {actor_email}.")
+    else:
+        # User deleted their own inquiry — confirm to user and notify agents
+        if inquiry.email:
+            enqueue_notification(inquiry.email, "push", f"✅ Ваша заявка #{inquiry_id} успешно удалена.")
+        enqueue_notification("agents@agency.com", "push",
+                             f"🗑️ Пользователь {actor_email} удалил свою заявку #{inquiry_id}.")
+    db.session.commit()
 
     return jsonify({"message": "Inquiry deleted successfully"}), 200
 
@@ -411,38 +502,14 @@ def create_appointment():
         note=note or None
     )
     db.session.add(appointment)
-    db.session.commit()
     
-    # Send notifications
-    try:
-        date_str = scheduled_at.strftime('%d.%m.%Y %H:%M')
-        
-        # Notification to client
-        if client_email:
-            client_message = f"📅 Встреча подтверждена! Объект #{property_id}, дата: {date_str}"
-            requests.post(
-                f"{NOTIFICATION_SERVICE_URL}/notifications",
-                json={
-                    "recipient": client_email,
-                    "channel": "push",
-                    "message": client_message
-                },
-                timeout=3
-            )
-        
-        # Notification to agents
-        agent_message = f"📅 Новая встреча: {client_name} ({client_email or client_phone}), объект #{property_id}, {date_str}"
-        requests.post(
-            f"{NOTIFICATION_SERVICE_URL}/notifications",
-            json={
-                "recipient": "agents@agency.com",
-                "channel": "push",
-                "message": agent_message
-            },
-            timeout=3
-        )
-    except Exception as e:
-        print(f"Failed to send appointment notifications: {e}")
+    # Notify the client and the agents once the appointment is committed
+    date_str = scheduled_at.strftime('%d.%m.%Y %H:%M')
+    if client_email:
+        enqueue_notification(client_email, "push", f"📅 Встреча подтверждена! Объект #{property_id}, дата: {date_str}")
+    agent_message = f"📅 Новая встреча: {client_name} ({client_email or client_phone}), объект #{property_id}, {date_str}"
+    enqueue_notification("agents@agency.com", "push", agent_message)
+    db.session.commit()
     
     return jsonify(appointment.to_dict()), 201
 
@@ -456,8 +523,9 @@ def get_appointments():
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
     
-    appointments = Appointment.query.order_by(Appointment.scheduled_at).all()
-    return jsonify([appointment.to_dict() for appointment in appointments]), 200
+    # Appointments are never edited, so creation time is their version
+    appointments = Appointment.query.order_by(Appointment.scheduled_at)
+    return conditional_list(appointments, Appointment, Appointment.created_at)
 
 
 @app.route("/appointments/<int:appointment_id>", methods=["GET"])
@@ -472,5 +540,6 @@ def get_appointment(appointment_id: int):
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
+        add_missing_columns()
     port = int(os.environ.get("PORT", 5003))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -1,6 +1,10 @@
 import unittest
 import json
-from app import app, db, Inquiry, Appointment
+from datetime import datetime, timedelta
+from unittest import mock
+import jwt
+import requests
+from app import app, db, Inquiry, Appointment, OutboxMessage, JWT_SECRET, dispatch_outbox
 
 class TestInquiryService(unittest.TestCase):
     def setUp(self):
@@ -99,6 +103,58 @@ class TestInquiryService(unittest.TestCase):
         
         response = self.client.delete(f'/inquiries/{inquiry_id}')
         self.assertIn(response.status_code, [200, 401, 404])
+    
+    def test_inquiries_conditional_get(self):
+        """Тест ETag списка обращений: 304 до изменения статуса"""
+        with app.app_context():
+            inquiry = Inquiry(property_id=1, name='Test User', email='test@test.com')
+            db.session.add(inquiry)
+            db.session.commit()
+            inquiry_id = inquiry.id
+        token = jwt.encode({'user_id': 1, 'email': 'agent@test.com', 'role': 'agent',
+                            'exp': datetime.utcnow() + timedelta(hours=1)}, JWT_SECRET, algorithm='HS256')
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        etag = self.client.get('/inquiries', headers=headers).headers['ETag']
+        response = self.client.get('/inquiries', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        
+        self.client.put(f'/inquiries/{inquiry_id}/status', json={'status': 'done'}, headers=headers)
+        response = self.client.get('/inquiries', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)[0]['status'], 'done')
+    
+    def test_status_notification_goes_through_outbox(self):
+        """Тест outbox: уведомление пишется в той же транзакции и отправляется диспетчером пачкой"""
+        with app.app_context():
+            inquiry = Inquiry(property_id=1, name='Test User', email='owner@test.com')
+            db.session.add(inquiry)
+            db.session.commit()
+            inquiry_id = inquiry.id
+        token = jwt.encode({'user_id': 1, 'email': 'agent@test.com', 'role': 'agent',
+                            'exp': datetime.utcnow() + timedelta(hours=1)}, JWT_SECRET, algorithm='HS256')
+        
+        with mock.patch('app.requests.post') as post:
+            self.client.put(f'/inquiries/{inquiry_id}/status', json={'status': 'done'},
+                            headers={'Authorization': f'Bearer {token}'})
+            post.assert_not_called()
+        
+        with app.app_context():
+            self.assertEqual(OutboxMessage.query.one().recipient, 'owner@test.com')
+            with mock.patch('app.requests.post', side_effect=requests.ConnectionError('down')):
+                self.assertEqual(dispatch_outbox(), 0)
+            message = OutboxMessage.query.one()
+            self.assertEqual(message.attempts, 1)
+            self.assertGreater(message.next_attempt_at, datetime.utcnow())
+            
+            message.next_attempt_at = datetime.utcnow()
+            db.session.commit()
+            with mock.patch('app.requests.post') as post:
+                post.return_value.json.return_value = {'created': 1, 'duplicates': 0, 'rejected': []}
+                self.assertEqual(dispatch_outbox(), 1)
+            sent = post.call_args.kwargs['json']['notifications']
+            self.assertEqual([n['key'] for n in sent], [message.key])
+            self.assertEqual(OutboxMessage.query.count(), 0)
 
 if __name__ == '__main__':
     unittest.main()
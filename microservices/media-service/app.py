@@ -1,18 +1,98 @@
 from flask import Flask, request, jsonify, send_file
-from werkzeug.utils import secure_filename
+from hot_cache import HotFileCache
+from media_store import INDEX_FILE, MEDIA_EXTENSIONS, MediaIndex, relative_path
+from thumbnails import VARIANT_SIZES, VariantPipeline
+from upload_sessions import UploadError, UploadSessions
+import hashlib
+import io
 import os
+import re
 import uuid
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
 app.config["UPLOAD_FOLDER"] = os.environ.get("UPLOAD_FOLDER", "/app/media")
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB
+# Worker processes rendering thumbnails and variants (0 serves originals only)
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 2))
+# Browser cache lifetime of media with unique names (seconds)
+MEDIA_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", 365 * 24 * 3600))
+# Let a fronting Apache/lighttpd send file bodies (X-Sendfile) instead of this process
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "false").lower() == "true"
+# In-memory cache of hot small media: total bytes (0 disables), largest file, reads before admission
+HOT_CACHE_BYTES = int(os.environ.get("HOT_CACHE_BYTES", 64 * 1024 * 1024))
+HOT_CACHE_MAX_FILE = int(os.environ.get("HOT_CACHE_MAX_FILE", 256 * 1024))
+HOT_CACHE_ADMIT_AFTER = int(os.environ.get("HOT_CACHE_ADMIT_AFTER", 2))
+
+# Media is saved as <sha256>.<ext> (older files as <uuid4>_<name>) and never rewritten,
+# so its URL identifies the bytes
+IMMUTABLE_MEDIA = re.compile(r"[0-9a-f]{64}\.|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_")
+# Read size while an upload is hashed and written
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# SQLite metadata index behind GET /media
+MEDIA_INDEX = os.environ.get("MEDIA_INDEX", os.path.join(app.config["UPLOAD_FOLDER"], INDEX_FILE))
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Resumable uploads: largest file, and how long an unfinished session is kept (seconds).
+# Every chunk is a request of its own and stays under MAX_CONTENT_LENGTH.
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 512 * 1024 * 1024))
+UPLOAD_SESSION_TTL = float(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
 
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
+# Files sit in hash-prefix shard directories (see media_store); listings come from the index
+_INDEX = MediaIndex(MEDIA_INDEX)
+# Downscaled WebP/JPEG copies of uploads, served for ?size=
+_VARIANTS = VariantPipeline(app.config["UPLOAD_FOLDER"], THUMBNAIL_WORKERS)
+_SESSIONS = UploadSessions(app.config["UPLOAD_FOLDER"], MAX_UPLOAD_SIZE, UPLOAD_SESSION_TTL)
+# Frequently read covers and thumbnails, keyed by (filename, size, webp)
+_HOT_FILES = HotFileCache(HOT_CACHE_BYTES, HOT_CACHE_MAX_FILE, HOT_CACHE_ADMIT_AFTER)
+
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in MEDIA_EXTENSIONS
+
+
+def store_content_addressed(tmp_path, content_hash, original_name):
+    """Move a fully written file to <sha256>.<ext>; returns (file name, whether it is new).
+
+    A file already stored keeps its copy and the temp file is dropped.
+    """
+    ext = original_name.rsplit('.', 1)[1].lower()
+    filename = f"{content_hash}.{'jpg' if ext == 'jpeg' else ext}"
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], relative_path(filename))
+    if os.path.exists(filepath):
+        os.remove(tmp_path)
+        return filename, False
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    os.replace(tmp_path, filepath)
+    return filename, True
+
+
+def save_content_addressed(file):
+    """Write an upload to a temp file, hashing it while it is written, and store it"""
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(app.config["UPLOAD_FOLDER"], f".{uuid.uuid4().hex}.upload")
+    with open(tmp_path, "wb") as out:
+        while chunk := file.stream.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            out.write(chunk)
+    return store_content_addressed(tmp_path, digest.hexdigest(), file.filename)
+
+
+def publish_media(filename, new):
+    """Index a stored file, queue its variants and describe it for the upload response"""
+    file_size = os.path.getsize(os.path.join(app.config["UPLOAD_FOLDER"], relative_path(filename)))
+    _INDEX.add(filename, file_size)
+    if new:
+        # Thumbnails are rendered in the background; ?size= serves the original until then
+        _VARIANTS.submit(relative_path(filename))
+    return {
+        "filename": filename,
+        "size": file_size,
+        "url": f"/media/{filename}",
+        "variants": {size: f"/media/{filename}?size={size}" for size in VARIANT_SIZES},
+    }
 
 
 @app.route("/health", methods=["GET"])
@@ -31,41 +111,141 @@ def upload_media():
         return jsonify({"error": "Empty filename"}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(app.config["UPLOAD_FOLDER"], unique_filename)
-        file.save(filepath)
-        
-        # Mock optimization (in real app: resize, compress, convert format)
-        file_size = os.path.getsize(filepath)
-        
-        return jsonify({
-            "filename": unique_filename,
-            "size": file_size,
-            "url": f"/media/{unique_filename}"
-        }), 201
+        return jsonify(publish_media(*save_content_addressed(file))), 201
     
     return jsonify({"error": "Invalid file type"}), 400
 
 
+@app.errorhandler(UploadError)
+def upload_error(e):
+    body = {"error": str(e)}
+    if e.offset is not None:
+        body["offset"] = e.offset
+    return jsonify(body), e.status
+
+
+@app.route("/upload/sessions", methods=["POST"])
+def create_upload_session():
+    """Start a resumable upload: {"filename": ..., "size": total bytes}"""
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get("filename", ""))
+    if not allowed_file(filename):
+        return jsonify({"error": "Invalid file type"}), 400
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "size is required"}), 400
+    return jsonify(_SESSIONS.create(filename, size)), 201
+
+
+@app.route("/upload/sessions/<upload_id>", methods=["GET"])
+def upload_session_status(upload_id):
+    """Offset to resume from"""
+    return jsonify(_SESSIONS.status(upload_id)), 200
+
+
+@app.route("/upload/sessions/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """Append the raw request body at ?offset=; ?sha256= optionally checks the chunk"""
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"error": "offset is required"}), 400
+    # request.stream is read block by block; the chunk is never buffered whole
+    state = _SESSIONS.append(upload_id, offset, request.stream, request.args.get("sha256"))
+    return jsonify(state), 200
+
+
+@app.route("/upload/sessions/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    """Store the assembled file; {"sha256": ...} optionally checks the whole file"""
+    expected = (request.get_json(silent=True) or {}).get("sha256")
+    filename = _SESSIONS.status(upload_id)["filename"]
+    stored = _SESSIONS.complete(
+        upload_id, lambda path, content_hash: store_content_addressed(path, content_hash, filename), expected,
+    )
+    return jsonify(publish_media(*stored)), 201
+
+
+@app.route("/upload/sessions/<upload_id>", methods=["DELETE"])
+def cancel_upload(upload_id):
+    _SESSIONS.status(upload_id)
+    _SESSIONS.discard(upload_id)
+    return jsonify({"message": "Upload cancelled"}), 200
+
+
+def send_media(path, immutable=True):
+    """send_file with Range support; unique names are cached as immutable under a strong ETag"""
+    name = os.path.basename(path)
+    if immutable and IMMUTABLE_MEDIA.match(name):
+        response = send_file(path, conditional=True, etag=name, max_age=MEDIA_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+    return send_file(path, conditional=True)
+
+
+def send_cached(entry):
+    """Answer from a hot cache entry with the headers send_media gives the file on disk"""
+    response = send_file(io.BytesIO(entry.data), mimetype=entry.mimetype, conditional=True,
+                         etag=entry.etag, last_modified=entry.last_modified, max_age=MEDIA_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route("/media/<filename>", methods=["GET"])
 def get_media(filename):
-    """Serve media file"""
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    if os.path.exists(filepath):
-        return send_file(filepath)
-    return jsonify({"error": "File not found"}), 404
+    """Serve media file, or with ?size=thumb|medium|large its downscaled variant"""
+    size = request.args.get("size")
+    if size and size not in VARIANT_SIZES:
+        return jsonify({"error": f"Unknown size: {size}"}), 400
+    webp = bool(size) and request.accept_mimetypes["image/webp"] > 0
+    key = (filename, size, webp)
+    entry = _HOT_FILES.get(key)
+    if entry is None:
+        filepath = os.path.join(app.config["UPLOAD_FOLDER"], relative_path(filename))
+        # The original stands in for a pending variant and must stay revalidated
+        variant = _VARIANTS.find(relative_path(filename), size, webp) if size else None
+        path = variant or filepath
+        immutable = (variant is not None or not size) and IMMUTABLE_MEDIA.match(filename) is not None
+        # Directories such as variants/ are not files to serve
+        if not os.path.isfile(path):
+            return jsonify({"error": "File not found"}), 404
+        try:
+            entry = _HOT_FILES.admit(key, path) if immutable else None
+            response = send_cached(entry) if entry else send_media(path, immutable=bool(variant) or not size)
+        except FileNotFoundError:
+            return jsonify({"error": "File not found"}), 404
+    else:
+        response = send_cached(entry)
+    if size:
+        response.vary.add("Accept")
+    return response
+
+
+@app.route("/metrics/file-cache", methods=["GET"])
+def file_cache_metrics():
+    """Hot media cache counters"""
+    return jsonify(_HOT_FILES.stats()), 200
 
 
 @app.route("/media", methods=["GET"])
 def list_media():
-    """List all media files"""
+    """List media files from the metadata index, newest first, paginated by id cursor"""
+    try:
+        limit = min(max(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        after = request.args.get("after", type=int)
+        if after is None and request.args.get("after"):
+            raise ValueError("Invalid cursor")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
-        files = os.listdir(app.config["UPLOAD_FOLDER"])
-        media_files = [{"filename": f, "url": f"/media/{f}"} for f in files if allowed_file(f)]
-        return jsonify(media_files), 200
+        rows = _INDEX.page(limit + 1, after)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    media_files = [dict(row, url=f"/media/{row['filename']}") for row in rows[:limit]]
+    response = jsonify(media_files)
+    if len(rows) > limit:
+        response.headers["X-Next-Cursor"] = str(rows[limit - 1]["id"])
+    return response, 200
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+"""Sharded directory layout and metadata index of stored media.
+
+Files live two levels below the media folder, in directories named after a
+hash prefix: ``<folder>/ab/cd/<name>``. Content-addressed names
+(``<sha256>.<ext>``) use their own first characters, older ``<uuid4>_<name>``
+files the SHA-256 of the name. With 65536 leaf directories none of them grows
+past a few dozen entries per million files, so lookups and creates never scan
+a huge directory.
+
+Listings come from a SQLite table (filename, size, content type, created_at)
+instead of the file system.
+
+Usage (move a flat folder into the sharded layout and index every file):
+    python media_store.py /app/media
+"""
+from datetime import datetime
+import hashlib
+import mimetypes
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from thumbnails import VARIANTS_DIR
+
+MEDIA_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+INDEX_FILE = "media.db"
+CONTENT_NAME = re.compile(r"[0-9a-f]{64}\.")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    created_at TEXT NOT NULL
+)
+"""
+
+
+def is_media(filename: str) -> bool:
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in MEDIA_EXTENSIONS
+
+
+def shard_dir(filename: str) -> str:
+    key = filename if CONTENT_NAME.match(filename) else hashlib.sha256(filename.encode()).hexdigest()
+    return os.path.join(key[:2], key[2:4])
+
+
+def relative_path(filename: str) -> str:
+    """Path of a media file below the media folder"""
+    return os.path.join(shard_dir(filename), filename)
+
+
+def content_type(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+class MediaIndex:
+    """Metadata rows of stored media, newest first; one shared connection behind a lock"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+    def add(self, filename: str, size: int, created_at: datetime = None) -> bool:
+        """Index a stored file, False if it is indexed already"""
+        return self.add_many([(filename, size, created_at or datetime.utcnow())]) == 1
+
+    def add_many(self, files: list) -> int:
+        """Index (filename, size, created_at) tuples in one transaction, returns rows added"""
+        rows = [(name, size, content_type(name), created_at.isoformat()) for name, size, created_at in files]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO media (filename, size, content_type, created_at) VALUES (?, ?, ?, ?)", rows,
+            )
+            return self._conn.total_changes - before
+
+    def page(self, limit: int, after: int = None) -> list:
+        """Up to limit rows with id below the cursor (all when after is None)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, filename, size, content_type, created_at FROM media "
+                "WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (after if after is not None else sys.maxsize, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self._conn.close()
+
+
+def migrate(folder: str) -> tuple:
+    """Move flat files and variants into shard directories, then index every stored file.
+
+    Safe to rerun: moved files are skipped and indexed ones are left alone.
+    Returns (files moved, rows added).
+    """
+    moved = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if is_media(name) and os.path.isfile(path):
+            target = os.path.join(folder, relative_path(name))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            moved += 1
+    variants = os.path.join(folder, VARIANTS_DIR)
+    if os.path.isdir(variants):
+        for name in os.listdir(variants):
+            path = os.path.join(variants, name)
+            if os.path.isfile(path):
+                # <original>.<size>.<ext> goes next to where the original's variants are looked up
+                target = os.path.join(variants, shard_dir(name.rsplit('.', 2)[0]), name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+
+    files = []
+    for root, dirs, names in os.walk(folder):
+        if root == folder:
+            # variants and dot directories (upload sessions) are not stored media
+            dirs[:] = [d for d in dirs if d != VARIANTS_DIR and not d.startswith(".")]
+            continue
+        for name in names:
+            if is_media(name):
+                stat = os.stat(os.path.join(root, name))
+                files.append((name, stat.st_size, datetime.utcfromtimestamp(stat.st_mtime)))
+    # Oldest first, so ids follow upload order as closely as mtimes allow
+    files.sort(key=lambda file: file[2])
+    index = MediaIndex(os.path.join(folder, INDEX_FILE))
+    try:
+        added = index.add_many(files)
+    finally:
+        index.close()
+    return moved, added
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise SystemExit(__doc__)
+    moved, added = migrate(sys.argv[1])
+    print(f"Moved {moved} files into shard directories, indexed {added} new files")
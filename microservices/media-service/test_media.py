@@ -1,12 +1,16 @@
 import unittest
 import json
 import io
+import hashlib
 import os
 import tempfile
 
 # Создаем временную директорию перед импортом app
 os.environ['UPLOAD_FOLDER'] = tempfile.mkdtemp()
 
+import media_store
+import thumbnails
+import app as app_module
 from app import app
 
 class TestMediaService(unittest.TestCase):
@@ -37,6 +41,85 @@ class TestMediaService(unittest.TestCase):
                                    content_type='multipart/form-data')
         self.assertEqual(response.status_code, 400)
     
+    def test_hot_media_served_from_memory(self):
+        """Тест кэша горячих файлов: допуск после повторных чтений, Range из памяти, обход больших"""
+        content = b"0123456789" + os.urandom(6)
+        response = self.client.post('/upload', data={'file': (io.BytesIO(content), 'cover.jpg')},
+                                   content_type='multipart/form-data')
+        filename = json.loads(response.data)['filename']
+        before = self.client.get('/metrics/file-cache').get_json()
+        
+        for _ in range(2):
+            self.client.get(f'/media/{filename}').close()
+        response = self.client.get(f'/media/{filename}', headers={'Range': 'bytes=0-3'})
+        self.assertEqual((response.status_code, response.data), (206, b"0123"))
+        self.assertEqual(response.headers['ETag'], f'"{filename}"')
+        response.close()
+        stats = self.client.get('/metrics/file-cache').get_json()
+        self.assertEqual(stats['admitted'] - before['admitted'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        
+        large = os.urandom(app_module.HOT_CACHE_MAX_FILE + 1)
+        response = self.client.post('/upload', data={'file': (io.BytesIO(large), 'large.png')},
+                                   content_type='multipart/form-data')
+        large_name = json.loads(response.data)['filename']
+        for _ in range(3):
+            response = self.client.get(f'/media/{large_name}')
+            self.assertEqual(len(response.data), len(large))
+            response.close()
+        self.assertEqual(self.client.get('/metrics/file-cache').get_json()['bypassed'] - stats['bypassed'], 2)
+    
+    def test_duplicate_upload_stored_once(self):
+        """Тест дедупликации: одинаковое содержимое сохраняется под одним SHA-256 именем"""
+        content = b"same photo " + os.urandom(8)
+        names = []
+        for name in ('a.jpg', 'b.jpeg'):
+            response = self.client.post('/upload',
+                                       data={'file': (io.BytesIO(content), name)},
+                                       content_type='multipart/form-data')
+            names.append(json.loads(response.data)['filename'])
+        self.assertEqual(names, [hashlib.sha256(content).hexdigest() + '.jpg'] * 2)
+        self.assertFalse([f for f in os.listdir(app.config['UPLOAD_FOLDER']) if f.endswith('.upload')])
+    
+    def test_resumable_upload(self):
+        """Тест загрузки по частям: смещения, контрольные суммы, продолжение после сбоя"""
+        content = os.urandom(1000)
+        response = self.client.post('/upload/sessions', json={'filename': 'big.png', 'size': len(content)})
+        self.assertEqual(response.status_code, 201)
+        session = f"/upload/sessions/{json.loads(response.data)['upload_id']}"
+        
+        response = self.client.put(f'{session}?offset=0', data=content[:400])
+        self.assertEqual(json.loads(response.data)['offset'], 400)
+        response = self.client.put(f'{session}?offset=0', data=content[:400])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['offset'], 400)
+        response = self.client.put(f'{session}?offset=400&sha256=00', data=content[400:800])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(json.loads(self.client.get(session).data)['offset'], 400)
+        self.assertEqual(self.client.post(f'{session}/complete').status_code, 409)
+        
+        # In-memory hash state lost (restart): rebuilt from the part file
+        app_module._SESSIONS._sessions.clear()
+        chunk = content[400:]
+        response = self.client.put(f'{session}?offset=400&sha256={hashlib.sha256(chunk).hexdigest()}', data=chunk)
+        self.assertEqual(json.loads(response.data)['offset'], 1000)
+        response = self.client.post(f'{session}/complete', json={'sha256': hashlib.sha256(content).hexdigest()})
+        self.assertEqual(response.status_code, 201)
+        filename = json.loads(response.data)['filename']
+        self.assertEqual(filename, hashlib.sha256(content).hexdigest() + '.png')
+        self.assertEqual(self.client.get(f'/media/{filename}').data, content)
+        self.assertEqual(self.client.get(session).status_code, 404)
+    
+    def test_resumable_upload_limits(self):
+        """Тест ограничений сессии загрузки"""
+        self.assertEqual(self.client.post('/upload/sessions', json={'filename': 'a.exe', 'size': 1}).status_code, 400)
+        response = self.client.post('/upload/sessions', json={'filename': 'a.png', 'size': 10 ** 12})
+        self.assertEqual(response.status_code, 413)
+        session = f"/upload/sessions/{json.loads(self.client.post('/upload/sessions', json={'filename': 'a.png', 'size': 3}).data)['upload_id']}"
+        self.assertEqual(self.client.put(f'{session}?offset=0', data=b'toolong').status_code, 413)
+        self.assertEqual(self.client.delete(session).status_code, 200)
+        self.assertEqual(self.client.get('/upload/sessions/not-a-session').status_code, 404)
+    
     def test_list_media(self):
         """Тест получения списка медиа"""
         response = self.client.get('/media')
@@ -44,10 +127,102 @@ class TestMediaService(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIsInstance(data, list)
     
+    def test_list_media_paginated(self):
+        """Тест постраничного списка из индекса метаданных"""
+        uploaded = []
+        for i in range(3):
+            response = self.client.post('/upload',
+                                       data={'file': (io.BytesIO(os.urandom(16)), f'{i}.png')},
+                                       content_type='multipart/form-data')
+            uploaded.append(json.loads(response.data)['filename'])
+        path = os.path.join(app.config['UPLOAD_FOLDER'], media_store.relative_path(uploaded[0]))
+        self.assertTrue(os.path.isfile(path))
+        
+        response = self.client.get('/media?limit=2')
+        first = json.loads(response.data)
+        self.assertEqual([m['filename'] for m in first], uploaded[:0:-1])
+        self.assertEqual(first[0]['content_type'], 'image/png')
+        self.assertEqual(first[0]['size'], 16)
+        response = self.client.get(f"/media?limit=1&after={response.headers['X-Next-Cursor']}")
+        self.assertEqual(json.loads(response.data)[0]['filename'], uploaded[0])
+        self.assertEqual(self.client.get('/media?after=x').status_code, 400)
+    
+    def test_migrate_flat_folder(self):
+        """Тест миграции плоской папки в шардированную структуру с индексом"""
+        folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(folder, thumbnails.VARIANTS_DIR))
+        for name in ('old_a.jpg', 'old_b.gif', os.path.join(thumbnails.VARIANTS_DIR, 'old_a.jpg.thumb.webp')):
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(b'data')
+        
+        self.assertEqual(media_store.migrate(folder), (2, 2))
+        self.assertEqual(media_store.migrate(folder), (0, 0))
+        self.assertTrue(os.path.isfile(os.path.join(folder, media_store.relative_path('old_a.jpg'))))
+        pipeline = thumbnails.VariantPipeline(folder, 0)
+        self.assertIsNotNone(pipeline.find(media_store.relative_path('old_a.jpg'), 'thumb', True))
+        index = media_store.MediaIndex(os.path.join(folder, media_store.INDEX_FILE))
+        self.assertEqual(len(index), 2)
+        index.close()
+    
     def test_get_nonexistent_media(self):
         """Тест получения несуществующего файла"""
         response = self.client.get('/media/nonexistent.jpg')
         self.assertEqual(response.status_code, 404)
+        # A directory under the requested name is not served either
+        folder = os.path.join(app.config['UPLOAD_FOLDER'], media_store.relative_path('folder'))
+        os.makedirs(folder)
+        self.addCleanup(os.rmdir, folder)
+        self.assertEqual(self.client.get('/media/folder').status_code, 404)
+    
+    def test_media_size_falls_back_to_original(self):
+        """Тест ?size=: без готового варианта отдается оригинал"""
+        response = self.client.post('/upload',
+                                   data={'file': (io.BytesIO(b"original"), 'photo.jpg')},
+                                   content_type='multipart/form-data')
+        filename = json.loads(response.data)['filename']
+        thumbnails.VariantPipeline(app.config['UPLOAD_FOLDER'], 0).remove(media_store.relative_path(filename))
+        
+        response = self.client.get(f'/media/{filename}?size=thumb')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b"original")
+        self.assertIn('Accept', response.headers['Vary'])
+        response.close()
+        self.assertEqual(self.client.get(f'/media/{filename}?size=huge').status_code, 400)
+    
+    def test_media_cached_with_ranges(self):
+        """Тест immutable-кэширования, сильного ETag и Range-запросов"""
+        response = self.client.post('/upload',
+                                   data={'file': (io.BytesIO(b"0123456789"), 'photo.jpg')},
+                                   content_type='multipart/form-data')
+        filename = json.loads(response.data)['filename']
+        
+        response = self.client.get(f'/media/{filename}', headers={'Range': 'bytes=-3'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b"789")
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.headers['ETag'], f'"{filename}"')
+        response.close()
+        response = self.client.get(f'/media/{filename}', headers={'If-None-Match': f'"{filename}"'})
+        self.assertEqual(response.status_code, 304)
+        response.close()
+    
+    @unittest.skipUnless(thumbnails.Image, "Pillow is not installed")
+    def test_media_variants_rendered(self):
+        """Тест рендеринга вариантов в пуле процессов"""
+        image = io.BytesIO()
+        thumbnails.Image.new('RGB', (2000, 1000), (200, 50, 50)).save(image, 'PNG')
+        filename = 'variant-test.png'
+        path = os.path.join(app.config['UPLOAD_FOLDER'], media_store.relative_path(filename))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(image.getvalue())
+        thumbnails.render_variants(app.config['UPLOAD_FOLDER'], media_store.relative_path(filename))
+        
+        response = self.client.get(f'/media/{filename}?size=thumb', headers={'Accept': 'image/jpeg'})
+        with thumbnails.Image.open(io.BytesIO(response.data)) as thumb:
+            self.assertEqual(thumb.format, 'JPEG')
+            self.assertEqual(thumb.size, (320, 160))
+        response.close()
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,135 @@
+"""Thumbnails and responsive variants of uploaded photos.
+
+Every original gets a downscaled copy per size in WebP and JPEG, written to
+``<upload folder>/variants/<name>.<size>.<format>``. Rendering runs in a
+process pool so a 16 MB upload never holds up a request thread; until the
+variants exist the original is served instead.
+
+Pillow is needed to render; without it the pipeline stays disabled and
+``?size=`` falls back to the original.
+
+Usage (render variants missing for files already on disk):
+    python thumbnails.py /app/media
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+import threading
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = ImageOps = features = None
+
+# Longest side in pixels per variant name
+VARIANT_SIZES = {"thumb": 320, "medium": 800, "large": 1600}
+# Encoders tried in order of preference; browsers that do not accept WebP get JPEG
+VARIANT_FORMATS = (("webp", "WEBP", {"quality": 80, "method": 4}),
+                   ("jpg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}))
+VARIANTS_DIR = "variants"
+
+
+def variant_name(filename: str, size: str, ext: str) -> str:
+    return f"{filename}.{size}.{ext}"
+
+
+def render_variants(folder: str, filename: str) -> list:
+    """Render every size and format of one original (runs in a worker process)"""
+    # filename may lie in a subdirectory; its variants mirror that path below VARIANTS_DIR
+    out_dir = os.path.join(folder, VARIANTS_DIR, os.path.dirname(filename))
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    with Image.open(os.path.join(folder, filename)) as original:
+        original.seek(0)  # first frame of animated GIFs
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "L"):
+            # JPEG has no alpha: flatten transparent images on white
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        for size, pixels in VARIANT_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((pixels, pixels), Image.LANCZOS)
+            for ext, fmt, options in VARIANT_FORMATS:
+                if fmt == "WEBP" and not features.check("webp"):
+                    continue  # Pillow built without libwebp: JPEG only
+                path = os.path.join(out_dir, variant_name(os.path.basename(filename), size, ext))
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                resized.save(tmp_path, fmt, **options)
+                os.replace(tmp_path, path)
+                written.append(os.path.basename(path))
+    return written
+
+
+def report_failure(filename: str, future):
+    error = future.exception()
+    if error is not None:
+        print(f"Thumbnail rendering failed for {filename}: {error}")
+
+
+class VariantPipeline:
+    """Schedules variant rendering and finds the variant to serve for a request"""
+
+    def __init__(self, folder: str, workers: int):
+        self.folder = folder
+        self.workers = workers
+        self.enabled = Image is not None and workers > 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, filename: str):
+        """Queue rendering of a saved original, returns the future (None when disabled)"""
+        if not self.enabled:
+            return None
+        future = self._pool().submit(render_variants, self.folder, filename)
+        future.add_done_callback(lambda done: report_failure(filename, done))
+        return future
+
+    def find(self, filename: str, size: str, accept_webp: bool):
+        """Path of the best ready variant, None if it is not rendered (yet)"""
+        for ext, _, _ in VARIANT_FORMATS:
+            if ext == "webp" and not accept_webp:
+                continue
+            path = os.path.join(self.folder, VARIANTS_DIR, variant_name(filename, size, ext))
+            if os.path.exists(path):
+                return path
+        return None
+
+    def remove(self, filename: str):
+        for size in VARIANT_SIZES:
+            for ext, _, _ in VARIANT_FORMATS:
+                path = os.path.join(self.folder, VARIANTS_DIR, variant_name(filename, size, ext))
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def backfill(folder: str, workers: int = None):
+    """Render variants for every original that has none yet"""
+    pipeline = VariantPipeline(folder, workers or os.cpu_count() or 1)
+    if not pipeline.enabled:
+        raise SystemExit("Pillow is not installed")
+    pending = []
+    for root, dirs, names in os.walk(folder):
+        if root == folder:
+            # originals are sharded below the folder; the top holds the index, temp files and sessions
+            dirs[:] = [d for d in dirs if d != VARIANTS_DIR and not d.startswith(".")]
+            continue
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), folder)
+            if pipeline.find(path, "thumb", False) is None:
+                pending.append(path)
+    futures = [pipeline.submit(name) for name in pending]
+    failed = sum(1 for future in futures if future.exception())
+    print(f"Rendered {len(pending) - failed} of {len(pending)} originals")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise SystemExit(__doc__)
+    backfill(sys.argv[1])
@@ -0,0 +1,172 @@
+"""Resumable chunked uploads.
+
+A session is opened with the file name and total size, the bytes are PUT in
+chunks at increasing offsets, and the session is completed once the offset
+reaches the size. Every chunk is appended straight to
+``<folder>/.sessions/<id>.part`` while it is hashed, so neither a chunk nor
+the file is held in memory. The running SHA-256 of the file is kept per
+session; after a restart or an interrupted chunk it is rebuilt from the part
+file once. A client that lost its connection asks for the offset and goes on
+from there: bytes that reached the disk before the drop are kept.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+SESSIONS_DIR = ".sessions"
+SESSION_ID = re.compile(r"[0-9a-f]{32}")
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A request that does not fit the session; ``status`` is the HTTP code to answer with"""
+
+    def __init__(self, message: str, status: int = 400, offset: int = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class _Session:
+    def __init__(self, meta: dict):
+        self.meta = meta
+        self.lock = threading.Lock()  # one chunk at a time
+        self.digest = hashlib.sha256()
+        self.hashed = 0  # bytes of the part file covered by digest
+
+
+class UploadSessions:
+    """Upload sessions stored next to the media, hash state cached in memory"""
+
+    def __init__(self, folder: str, max_size: int, ttl: float):
+        self.dir = os.path.join(folder, SESSIONS_DIR)
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _paths(self, upload_id: str) -> tuple:
+        if not SESSION_ID.fullmatch(upload_id):
+            raise UploadError("Upload not found", 404)
+        base = os.path.join(self.dir, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    def _load(self, upload_id: str) -> _Session:
+        meta_path, _ = self._paths(upload_id)
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                try:
+                    with open(meta_path) as f:
+                        session = _Session(json.load(f))
+                except FileNotFoundError:
+                    raise UploadError("Upload not found", 404)
+                self._sessions[upload_id] = session
+            return session
+
+    def _digest_at(self, session: _Session, part_path: str, offset: int):
+        """Running hash of the first offset bytes, re-read from disk if the cached state is behind"""
+        if session.hashed != offset:
+            session.digest = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                while block := f.read(READ_SIZE):
+                    session.digest.update(block)
+            session.hashed = offset
+        return session.digest
+
+    def _state(self, session: _Session, offset: int) -> dict:
+        return dict(session.meta, offset=offset)
+
+    def create(self, filename: str, size: int) -> dict:
+        if size <= 0:
+            raise UploadError("Size must be positive")
+        if size > self.max_size:
+            raise UploadError(f"File exceeds {self.max_size} bytes", 413)
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        meta = {"upload_id": upload_id, "filename": filename, "size": size, "created_at": time.time()}
+        open(part_path, "wb").close()
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        return dict(meta, offset=0)
+
+    def status(self, upload_id: str) -> dict:
+        session = self._load(upload_id)
+        _, part_path = self._paths(upload_id)
+        return self._state(session, os.path.getsize(part_path))
+
+    def append(self, upload_id: str, offset: int, stream, chunk_sha256: str = None) -> dict:
+        """Append a chunk read from stream at offset, which must be the current end of the file"""
+        session = self._load(upload_id)
+        _, part_path = self._paths(upload_id)
+        with session.lock:
+            current = os.path.getsize(part_path)
+            if offset != current:
+                raise UploadError("Offset does not match the uploaded size", 409, current)
+            whole = self._digest_at(session, part_path, current).copy()
+            chunk = hashlib.sha256()
+            end = current
+            with open(part_path, "ab") as out:
+                while block := stream.read(READ_SIZE):
+                    end += len(block)
+                    if end > session.meta["size"]:
+                        break
+                    out.write(block)
+                    chunk.update(block)
+                    whole.update(block)
+            if end > session.meta["size"]:
+                os.truncate(part_path, current)
+                raise UploadError("Chunk goes past the declared size", 413, current)
+            if chunk_sha256 and chunk.hexdigest() != chunk_sha256.lower():
+                os.truncate(part_path, current)
+                raise UploadError("Chunk checksum mismatch", 422, current)
+            session.digest, session.hashed = whole, end
+            return self._state(session, end)
+
+    def complete(self, upload_id: str, store, expected_sha256: str = None):
+        """Hand the finished file to store(part path, sha256 hex) and close the session.
+
+        Returns what store returns. A checksum mismatch drops the session, since
+        the bytes on disk cannot be repaired by resending a chunk.
+        """
+        session = self._load(upload_id)
+        _, part_path = self._paths(upload_id)
+        with session.lock:
+            current = os.path.getsize(part_path)
+            if current != session.meta["size"]:
+                raise UploadError("Upload is incomplete", 409, current)
+            content_hash = self._digest_at(session, part_path, current).hexdigest()
+            if expected_sha256 and content_hash != expected_sha256.lower():
+                self.discard(upload_id)
+                raise UploadError("File checksum mismatch", 422)
+            result = store(part_path, content_hash)
+            self.discard(upload_id)
+            return result
+
+    def discard(self, upload_id: str):
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+
+    def expire(self):
+        """Drop sessions older than the TTL"""
+        deadline = time.time() - self.ttl
+        for name in os.listdir(self.dir):
+            upload_id, ext = os.path.splitext(name)
+            if ext != ".json":
+                continue
+            try:
+                with open(os.path.join(self.dir, name)) as f:
+                    created_at = json.load(f)["created_at"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if created_at < deadline:
+                self.discard(upload_id)
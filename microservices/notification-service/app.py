@@ -1,8 +1,15 @@
+from collections import OrderedDict
 from flask import Flask, request, jsonify
 from datetime import datetime
+import hashlib
+import jwt
 import os
 import requests
+import threading
+import time
 from flask_sqlalchemy import SQLAlchemy
+from background import start_on_first_request
+from list_validators import conditional_list
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
@@ -10,6 +17,15 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:/
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 AUTH_SERVICE_URL = os.environ.get("AUTH_SERVICE_URL", "http://localhost:5001")
 
+# Tokens are signed by auth-service with the shared SECRET_KEY and verified locally
+JWT_SECRET = os.environ.get("JWT_SECRET", app.config["SECRET_KEY"])
+# How often revoked tokens are pulled from auth-service (seconds, 0 disables)
+REVOCATION_POLL_INTERVAL = float(os.environ.get("REVOCATION_POLL_INTERVAL", 30))
+# Verification cache: max entries, TTL for valid tokens (capped at exp) and for invalid ones
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 300))
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", 30))
+
 db = SQLAlchemy(app)
 
 class Notification(db.Model):
@@ -18,6 +34,8 @@ class Notification(db.Model):
     channel = db.Column(db.String(50), nullable=False)  # email|sms|push
     message = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Producer's outbox row key; a batch delivered twice after a lost response is stored once
+    outbox_key = db.Column(db.String(64), unique=True)
 
     def to_dict(self):
         return {
@@ -29,19 +47,145 @@ class Notification(db.Model):
         }
 
 
+def add_missing_columns():
+    """create_all() does not alter existing tables, so columns added later are created here"""
+    columns = {column["name"] for column in db.inspect(db.engine).get_columns("notification")}
+    if "outbox_key" not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE notification ADD COLUMN outbox_key VARCHAR(64)"))
+            conn.execute(db.text("CREATE UNIQUE INDEX ix_notification_outbox_key ON notification (outbox_key)"))
+
+
+# Token verification counters, exposed on /metrics/auth
+_AUTH_STATS = {
+    "verified": 0, "rejected": 0, "cache_hits": 0, "cache_misses": 0,
+    "revocation_polls": 0, "total_ms": 0.0, "max_ms": 0.0,
+}
+_AUTH_STATS_LOCK = threading.Lock()
+
+# Verification results by token hash: {hash: (expires_at, payload or None)}, LRU order
+_TOKEN_CACHE = OrderedDict()
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+# Revoked token hashes mirrored from auth-service /revocations: {hash: token exp (unix time)}.
+# Written only by the revocation poller thread; a hash is dropped once its token has expired.
+_REVOKED_TOKENS = {}
+_REVOCATION_STATE = {"seq": 0}
+
+
+def record_verification(elapsed_ms: float, verified: bool, cache_hit: bool):
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["verified" if verified else "rejected"] += 1
+        _AUTH_STATS["cache_hits" if cache_hit else "cache_misses"] += 1
+        _AUTH_STATS["total_ms"] += elapsed_ms
+        _AUTH_STATS["max_ms"] = max(_AUTH_STATS["max_ms"], elapsed_ms)
+
+
+def poll_revocations():
+    """Pull new revocations from auth-service and forget those whose token has expired"""
+    response = requests.get(
+        f"{AUTH_SERVICE_URL}/revocations",
+        params={"since": _REVOCATION_STATE["seq"]},
+        timeout=2
+    )
+    response.raise_for_status()
+    data = response.json()
+    revoked = data.get("revoked", [])
+    # An auth-service without expires_at keeps its hashes until restart, as before
+    expires_at = data.get("expires_at", {})
+    for token_hash in revoked:
+        _REVOKED_TOKENS[token_hash] = expires_at.get(token_hash, float("inf"))
+    now = time.time()
+    for token_hash in [h for h, exp in _REVOKED_TOKENS.items() if exp <= now]:
+        del _REVOKED_TOKENS[token_hash]
+    _REVOCATION_STATE["seq"] = data.get("seq", _REVOCATION_STATE["seq"])
+    with _TOKEN_CACHE_LOCK:
+        for token_hash in revoked:
+            _TOKEN_CACHE.pop(token_hash, None)
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["revocation_polls"] += 1
+
+
+def run_revocation_poller():
+    while True:
+        try:
+            poll_revocations()
+        except Exception as e:
+            # Signatures are still checked locally, auth-service being down must not lock users out
+            print(f"Failed to poll revocations: {e}")
+        time.sleep(REVOCATION_POLL_INTERVAL)
+
+
+def start_revocation_poller():
+    if REVOCATION_POLL_INTERVAL > 0:
+        threading.Thread(target=run_revocation_poller, name="revocation-poller", daemon=True).start()
+
+
+start_on_first_request(app, start_revocation_poller)
+
+
+def cached_verification(token_hash: str):
+    """Return (hit, payload) from the verification cache"""
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(token_hash)
+        if entry is None:
+            return False, None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del _TOKEN_CACHE[token_hash]
+            return False, None
+        _TOKEN_CACHE.move_to_end(token_hash)
+        return True, payload
+
+
+def cache_verification(token_hash: str, payload):
+    """Remember a result; valid tokens never outlive their exp, invalid ones get a short TTL"""
+    now = time.time()
+    if payload:
+        expires_at = min(now + TOKEN_CACHE_TTL, payload.get("exp", now))
+    else:
+        expires_at = now + NEGATIVE_CACHE_TTL
+    if expires_at <= now:
+        return
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[token_hash] = (expires_at, payload)
+        _TOKEN_CACHE.move_to_end(token_hash)
+        while len(_TOKEN_CACHE) > TOKEN_CACHE_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+
+
 def verify_token(token: str):
-    try:
-        response = requests.post(f"{AUTH_SERVICE_URL}/verify", json={"token": token}, timeout=5)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except:
-        return None
+    """Verify JWT signature and expiry locally with the shared secret"""
+    start = time.perf_counter()
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    hit, payload = cached_verification(token_hash)
+    if not hit:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            payload = None
+        cache_verification(token_hash, payload)
+    if token_hash in _REVOKED_TOKENS:
+        payload = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_verification(elapsed_ms, payload is not None, hit)
+    return payload
+
 
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "healthy", "service": "notification-service"}), 200
 
+
+@app.route("/metrics/auth", methods=["GET"])
+def auth_metrics():
+    """Token verification counters and latency"""
+    with _AUTH_STATS_LOCK:
+        stats = dict(_AUTH_STATS)
+    checks = stats["verified"] + stats["rejected"]
+    stats["avg_ms"] = round(stats["total_ms"] / checks, 3) if checks else 0.0
+    return jsonify(stats), 200
+
 @app.route('/notifications', methods=['POST'])
 def create_notification():
     # optional auth (agents can create notifications)
@@ -65,6 +209,41 @@ def create_notification():
 
     return jsonify(notif.to_dict()), 201
 
+@app.route('/notifications/batch', methods=['POST'])
+def create_notifications_batch():
+    """Store a batch from a producer's outbox: {"notifications": [{"key", "recipient", "channel", "message"}]}.
+
+    Keys seen before are skipped, so a retried batch is idempotent. Invalid items
+    are reported and dropped instead of failing the batch, which would otherwise
+    be retried forever.
+    """
+    items = (request.get_json(silent=True) or {}).get('notifications')
+    if not isinstance(items, list):
+        return jsonify({"error": "notifications list required"}), 400
+
+    keys = [item.get('key') for item in items if isinstance(item, dict) and item.get('key')]
+    seen = {row.outbox_key for row in Notification.query.filter(Notification.outbox_key.in_(keys))} if keys else set()
+    created, duplicates, rejected = [], 0, []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('recipient') or not item.get('message'):
+            rejected.append(item.get('key') if isinstance(item, dict) else None)
+            continue
+        key = item.get('key')
+        if key and key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        created.append(Notification(recipient=item['recipient'], channel=item.get('channel', 'email'),
+                                    message=item['message'], outbox_key=key or None))
+    db.session.add_all(created)
+    db.session.commit()
+
+    for notif in created:
+        # Mock send: in real app integrate with SMTP/SMS provider
+        print(f"[notification] send to={notif.recipient} channel={notif.channel} message={notif.message}")
+
+    return jsonify({"created": len(created), "duplicates": duplicates, "rejected": rejected}), 200
+
 @app.route('/notifications', methods=['GET'])
 def list_notifications():
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
@@ -83,19 +262,20 @@ def list_notifications():
     
     # Agents see all notifications, users see only their own
     if user_role == 'agent':
-        items = Notification.query.order_by(Notification.created_at.desc()).all()
+        items = Notification.query.order_by(Notification.created_at.desc())
     else:
         # Show notifications for this user (by email) and broadcast notifications (agents@, all-users@)
         items = Notification.query.filter(
             (Notification.recipient == user_email) | 
             (Notification.recipient.in_(['agents@agency.com', 'all-users@agency.com']))
-        ).order_by(Notification.created_at.desc()).all()
+        ).order_by(Notification.created_at.desc())
     
-    print(f"[DEBUG] Returning {len(items)} notifications")
-    return jsonify([i.to_dict() for i in items]), 200
+    # Notifications are append-only, so creation time is their version
+    return conditional_list(items, Notification, Notification.created_at, f"{user_role}:{user_email}")
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        add_missing_columns()
     port = int(os.environ.get('PORT', 5006))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -1,6 +1,8 @@
 import unittest
 import json
-from app import app, db, Notification
+from datetime import datetime, timedelta
+import jwt
+from app import app, db, Notification, JWT_SECRET
 
 
 class NotificationServiceTestCase(unittest.TestCase):
@@ -63,6 +65,37 @@ class NotificationServiceTestCase(unittest.TestCase):
             data = json.loads(response.data)
             self.assertEqual(data['channel'], channel)
     
+    def test_list_notifications_conditional_get(self):
+        """Test that an unchanged list is answered with 304 Not Modified"""
+        token = jwt.encode({"user_id": 1, "email": "user@test.com", "role": "user",
+                            "exp": datetime.utcnow() + timedelta(hours=1)}, JWT_SECRET, algorithm="HS256")
+        headers = {'Authorization': f'Bearer {token}'}
+        self.client.post('/notifications', json={'recipient': 'user@test.com', 'message': 'Hi'})
+        
+        etag = self.client.get('/notifications', headers=headers).headers['ETag']
+        response = self.client.get('/notifications', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        
+        self.client.post('/notifications', json={'recipient': 'all-users@agency.com', 'message': 'News'})
+        response = self.client.get('/notifications', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)), 2)
+    
+    def test_batch_is_idempotent(self):
+        """Test that a redelivered outbox batch is stored once and bad items are dropped"""
+        batch = {'notifications': [
+            {'key': 'k1', 'recipient': 'a@test.com', 'channel': 'push', 'message': 'One'},
+            {'key': 'k2', 'recipient': 'b@test.com', 'message': 'Two'},
+            {'key': 'k3', 'recipient': 'c@test.com'},
+        ]}
+        response = self.client.post('/notifications/batch', json=batch)
+        self.assertEqual(json.loads(response.data), {'created': 2, 'duplicates': 0, 'rejected': ['k3']})
+        response = self.client.post('/notifications/batch', json=batch)
+        self.assertEqual(json.loads(response.data)['duplicates'], 2)
+        with app.app_context():
+            self.assertEqual(Notification.query.count(), 2)
+        self.assertEqual(self.client.post('/notifications/batch', json={}).status_code, 400)
+    
     def test_notification_model_to_dict(self):
         """Test Notification model to_dict method"""
         with app.app_context():
@@ -0,0 +1,29 @@
+"""Start a service's background threads in the process that serves requests.
+
+Dispatchers and pollers must run once in every serving process: in the dev
+server's child but not in the reloader process that only watches files, and
+in each gunicorn worker rather than in a master whose threads do not survive
+the fork. Neither is known at import time, so the threads start with the
+first request a process handles; the compose healthcheck makes one shortly
+after startup. An app in TESTING mode starts nothing, tests call the work
+functions themselves.
+
+Edit this source in ``microservices/shared`` and copy it with sync_shared.py.
+"""
+import threading
+
+
+def start_on_first_request(app, *starters):
+    """Call each starter once, before the first request this process handles"""
+    lock = threading.Lock()
+    started = []
+
+    @app.before_request
+    def start_background_threads():
+        if started or app.testing:
+            return
+        with lock:
+            if not started:
+                started.append(True)
+                for start in starters:
+                    start()
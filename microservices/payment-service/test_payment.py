@@ -1,6 +1,8 @@
 import unittest
 import json
-from app import app, db, Transaction
+from datetime import datetime, timedelta
+import jwt
+from app import app, db, Transaction, OutboxMessage, JWT_SECRET
 
 class TestPaymentService(unittest.TestCase):
     def setUp(self):
@@ -27,6 +29,42 @@ class TestPaymentService(unittest.TestCase):
         """Тест получения списка транзакций"""
         response = self.client.get('/transactions')
         self.assertIn(response.status_code, [200, 401])
+    
+    def test_create_transaction_with_local_token(self):
+        """Тест создания платежа с локально проверенным токеном"""
+        token = jwt.encode(
+            {"user_id": 7, "email": "user@test.com", "role": "user", "exp": datetime.utcnow() + timedelta(hours=1)},
+            JWT_SECRET, algorithm="HS256"
+        )
+        response = self.client.post('/transactions',
+                                   data=json.dumps({'amount': 100}),
+                                   content_type='application/json',
+                                   headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data)['user_id'], 7)
+        with app.app_context():
+            # Уведомление агентам уходит через outbox, а не прямым запросом
+            self.assertEqual(OutboxMessage.query.count(), 1)
+    
+    def test_transactions_conditional_get(self):
+        """Тест 304 для неизменившегося списка и нового ETag после платежа"""
+        token = jwt.encode(
+            {"user_id": 7, "email": "user@test.com", "role": "user", "exp": datetime.utcnow() + timedelta(hours=1)},
+            JWT_SECRET, algorithm="HS256"
+        )
+        headers = {'Authorization': f'Bearer {token}'}
+        self.client.post('/transactions', json={'amount': 100}, headers=headers)
+        
+        first = self.client.get('/transactions', headers=headers)
+        etag = first.headers['ETag']
+        self.assertNotIn('Last-Modified', first.headers)
+        response = self.client.get('/transactions', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        
+        self.client.post('/transactions', json={'amount': 50}, headers=headers)
+        response = self.client.get('/transactions', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)), 2)
 
 if __name__ == '__main__':
     unittest.main()
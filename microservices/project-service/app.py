@@ -1,8 +1,14 @@
+from collections import OrderedDict
 from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from background import start_on_first_request
+import hashlib
+import jwt
 import os
 import requests
+import threading
+import time
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
@@ -11,6 +17,15 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 AUTH_SERVICE_URL = os.environ.get("AUTH_SERVICE_URL", "http://localhost:5001")
 
+# Tokens are signed by auth-service with the shared SECRET_KEY and verified locally
+JWT_SECRET = os.environ.get("JWT_SECRET", app.config["SECRET_KEY"])
+# How often revoked tokens are pulled from auth-service (seconds, 0 disables)
+REVOCATION_POLL_INTERVAL = float(os.environ.get("REVOCATION_POLL_INTERVAL", 30))
+# Verification cache: max entries, TTL for valid tokens (capped at exp) and for invalid ones
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 300))
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", 30))
+
 db = SQLAlchemy(app)
 
 
@@ -98,19 +113,120 @@ class ProjectMember(db.Model):
 
 
 # Helper functions
+# Token verification counters, exposed on /metrics/auth
+_AUTH_STATS = {
+    "verified": 0, "rejected": 0, "cache_hits": 0, "cache_misses": 0,
+    "revocation_polls": 0, "total_ms": 0.0, "max_ms": 0.0,
+}
+_AUTH_STATS_LOCK = threading.Lock()
+
+# Verification results by token hash: {hash: (expires_at, payload or None)}, LRU order
+_TOKEN_CACHE = OrderedDict()
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+# Revoked token hashes mirrored from auth-service /revocations: {hash: token exp (unix time)}.
+# Written only by the revocation poller thread; a hash is dropped once its token has expired.
+_REVOKED_TOKENS = {}
+_REVOCATION_STATE = {"seq": 0}
+
+
+def record_verification(elapsed_ms: float, verified: bool, cache_hit: bool):
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["verified" if verified else "rejected"] += 1
+        _AUTH_STATS["cache_hits" if cache_hit else "cache_misses"] += 1
+        _AUTH_STATS["total_ms"] += elapsed_ms
+        _AUTH_STATS["max_ms"] = max(_AUTH_STATS["max_ms"], elapsed_ms)
+
+
+def poll_revocations():
+    """Pull new revocations from auth-service and forget those whose token has expired"""
+    response = requests.get(
+        f"{AUTH_SERVICE_URL}/revocations",
+        params={"since": _REVOCATION_STATE["seq"]},
+        timeout=2
+    )
+    response.raise_for_status()
+    data = response.json()
+    revoked = data.get("revoked", [])
+    # An auth-service without expires_at keeps its hashes until restart, as before
+    expires_at = data.get("expires_at", {})
+    for token_hash in revoked:
+        _REVOKED_TOKENS[token_hash] = expires_at.get(token_hash, float("inf"))
+    now = time.time()
+    for token_hash in [h for h, exp in _REVOKED_TOKENS.items() if exp <= now]:
+        del _REVOKED_TOKENS[token_hash]
+    _REVOCATION_STATE["seq"] = data.get("seq", _REVOCATION_STATE["seq"])
+    with _TOKEN_CACHE_LOCK:
+        for token_hash in revoked:
+            _TOKEN_CACHE.pop(token_hash, None)
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["revocation_polls"] += 1
+
+
+def run_revocation_poller():
+    while True:
+        try:
+            poll_revocations()
+        except Exception as e:
+            # Signatures are still checked locally, auth-service being down must not lock users out
+            print(f"Failed to poll revocations: {e}")
+        time.sleep(REVOCATION_POLL_INTERVAL)
+
+
+def start_revocation_poller():
+    if REVOCATION_POLL_INTERVAL > 0:
+        threading.Thread(target=run_revocation_poller, name="revocation-poller", daemon=True).start()
+
+
+start_on_first_request(app, start_revocation_poller)
+
+
+def cached_verification(token_hash: str):
+    """Return (hit, payload) from the verification cache"""
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(token_hash)
+        if entry is None:
+            return False, None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del _TOKEN_CACHE[token_hash]
+            return False, None
+        _TOKEN_CACHE.move_to_end(token_hash)
+        return True, payload
+
+
+def cache_verification(token_hash: str, payload):
+    """Remember a result; valid tokens never outlive their exp, invalid ones get a short TTL"""
+    now = time.time()
+    if payload:
+        expires_at = min(now + TOKEN_CACHE_TTL, payload.get("exp", now))
+    else:
+        expires_at = now + NEGATIVE_CACHE_TTL
+    if expires_at <= now:
+        return
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[token_hash] = (expires_at, payload)
+        _TOKEN_CACHE.move_to_end(token_hash)
+        while len(_TOKEN_CACHE) > TOKEN_CACHE_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+
+
 def verify_token(token: str):
-    """Verify token with auth service"""
-    try:
-        response = requests.post(
-            f"{AUTH_SERVICE_URL}/verify",
-            json={"token": token},
-            timeout=5
-        )
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except:
-        return None
+    """Verify JWT signature and expiry locally with the shared secret"""
+    start = time.perf_counter()
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    hit, payload = cached_verification(token_hash)
+    if not hit:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            payload = None
+        cache_verification(token_hash, payload)
+    if token_hash in _REVOKED_TOKENS:
+        payload = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_verification(elapsed_ms, payload is not None, hit)
+    return payload
 
 
 # Routes
@@ -119,6 +235,16 @@ def health():
     return jsonify({"status": "healthy", "service": "project-service"}), 200
 
 
+@app.route("/metrics/auth", methods=["GET"])
+def auth_metrics():
+    """Token verification counters and latency"""
+    with _AUTH_STATS_LOCK:
+        stats = dict(_AUTH_STATS)
+    checks = stats["verified"] + stats["rejected"]
+    stats["avg_ms"] = round(stats["total_ms"] / checks, 3) if checks else 0.0
+    return jsonify(stats), 200
+
+
 # Project routes
 @app.route("/projects", methods=["POST"])
 def create_project():
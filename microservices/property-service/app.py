@@ -1,10 +1,24 @@
+from collections import OrderedDict
 from datetime import datetime
 from flask import Flask, request, jsonify, send_file
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.utils import secure_filename
+from sqlalchemy import event
+from background import start_on_first_request
+from hot_cache import HotFileCache
+from list_validators import is_not_modified, list_etag
+from outbox import Outbox, OutboxMessageMixin
+from thumbnails import VARIANT_SIZES, VariantPipeline
+import base64
+import io
+import json
+import hashlib
+import jwt
 import os
+import re
 import uuid
 import requests
+import threading
+import time
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
@@ -16,11 +30,51 @@ app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB
 AUTH_SERVICE_URL = os.environ.get("AUTH_SERVICE_URL", "http://localhost:5001")
 NOTIFICATION_SERVICE_URL = os.environ.get("NOTIFICATION_SERVICE_URL", "http://localhost:5006")
 
+# Tokens are signed by auth-service with the shared SECRET_KEY and verified locally
+JWT_SECRET = os.environ.get("JWT_SECRET", app.config["SECRET_KEY"])
+# How often revoked tokens are pulled from auth-service (seconds, 0 disables)
+REVOCATION_POLL_INTERVAL = float(os.environ.get("REVOCATION_POLL_INTERVAL", 30))
+# Verification cache: max entries, TTL for valid tokens (capped at exp) and for invalid ones
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 300))
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", 30))
+# Pre-serialized JSON of single properties and of unfiltered list pages (0 disables)
+PROPERTY_CACHE_SIZE = int(os.environ.get("PROPERTY_CACHE_SIZE", 10000))
+PAGE_CACHE_SIZE = int(os.environ.get("PAGE_CACHE_SIZE", 256))
+# Read size while an upload is hashed and written to the blob store
+BLOB_CHUNK_SIZE = 64 * 1024
+# Worker processes rendering photo thumbnails and variants (0 serves originals only)
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 2))
+# Browser cache lifetime of uploads with unique names (seconds)
+UPLOAD_MAX_AGE = int(os.environ.get("UPLOAD_MAX_AGE", 365 * 24 * 3600))
+# Let a fronting Apache/lighttpd send file bodies (X-Sendfile) instead of this process
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "false").lower() == "true"
+# In-memory cache of hot small photos: total bytes (0 disables), largest file, reads before admission
+HOT_CACHE_BYTES = int(os.environ.get("HOT_CACHE_BYTES", 64 * 1024 * 1024))
+HOT_CACHE_MAX_FILE = int(os.environ.get("HOT_CACHE_MAX_FILE", 256 * 1024))
+HOT_CACHE_ADMIT_AFTER = int(os.environ.get("HOT_CACHE_ADMIT_AFTER", 2))
+
+# Uploads are saved as <sha256>.<ext> (older ones as <uuid4>_<name>) and never rewritten,
+# so their URL identifies the bytes
+IMMUTABLE_UPLOAD = re.compile(r"[0-9a-f]{64}\.|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_")
+
+# Notification outbox dispatcher: poll interval (seconds, 0 disables), rows per batch,
+# request timeout and the cap of the retry backoff (seconds)
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_TIMEOUT = float(os.environ.get("OUTBOX_TIMEOUT", 10))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("OUTBOX_MAX_BACKOFF", 300))
+
 db = SQLAlchemy(app)
 
 # Ensure uploads folder exists
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
+# Downscaled WebP/JPEG copies of uploaded photos, served for ?size=
+_VARIANTS = VariantPipeline(app.config["UPLOAD_FOLDER"], THUMBNAIL_WORKERS)
+# Cover photos and thumbnails read by every list page, keyed by (filename, size, webp)
+_HOT_FILES = HotFileCache(HOT_CACHE_BYTES, HOT_CACHE_MAX_FILE, HOT_CACHE_ADMIT_AFTER)
+
 
 # Models
 class Property(db.Model):
@@ -36,8 +90,19 @@ class Property(db.Model):
     is_for_sale = db.Column(db.Boolean, default=True, nullable=False)
     is_for_rent = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Bumped by any change of the row or its photos; drives list ETags and Last-Modified
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
-    photos = db.relationship("Photo", backref="property", lazy=True, cascade="all, delete-orphan")
+    # selectin: photos for a whole page are fetched with one IN query instead of one query per row
+    photos = db.relationship("Photo", backref="property", lazy="selectin", order_by="Photo.id",
+                             cascade="all, delete-orphan")
+
+    # Keyset pagination walks (sort column, id) - one index per sort key
+    __table_args__ = (
+        db.Index("ix_property_created_at_id", "created_at", "id"),
+        db.Index("ix_property_price_eur_id", "price_eur", "id"),
+        db.Index("ix_property_area_m2_id", "area_m2", "id"),
+    )
 
     def to_dict(self):
         return {
@@ -53,14 +118,17 @@ class Property(db.Model):
             "is_for_sale": self.is_for_sale,
             "is_for_rent": self.is_for_rent,
             "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             "photos": [photo.to_dict() for photo in self.photos]
         }
 
 
 class Photo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    property_id = db.Column(db.Integer, db.ForeignKey("property.id"), nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey("property.id"), nullable=False, index=True)
     file_path = db.Column(db.String(255), nullable=False)
+    # SHA-256 of the file; photos with equal hashes share one blob (NULL for pre-dedup uploads)
+    content_hash = db.Column(db.String(64), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     def to_dict(self):
@@ -72,32 +140,432 @@ class Photo(db.Model):
         }
 
 
+class PropertyChange(db.Model):
+    """Change feed entry; deletions stay in the feed as tombstones"""
+    seq = db.Column(db.Integer, primary_key=True)
+    property_id = db.Column(db.Integer, nullable=False, index=True)
+    op = db.Column(db.String(10), nullable=False)  # upsert|delete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class OutboxMessage(OutboxMessageMixin, db.Model):
+    """Notification written with the change it announces, removed once notification-service stored it"""
+
+
 # Helper functions
+# Token verification counters, exposed on /metrics/auth
+_AUTH_STATS = {
+    "verified": 0, "rejected": 0, "cache_hits": 0, "cache_misses": 0,
+    "revocation_polls": 0, "total_ms": 0.0, "max_ms": 0.0,
+}
+_AUTH_STATS_LOCK = threading.Lock()
+
+# Verification results by token hash: {hash: (expires_at, payload or None)}, LRU order
+_TOKEN_CACHE = OrderedDict()
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+# Revoked token hashes mirrored from auth-service /revocations: {hash: token exp (unix time)}.
+# Written only by the revocation poller thread; a hash is dropped once its token has expired.
+_REVOKED_TOKENS = {}
+_REVOCATION_STATE = {"seq": 0}
+
+
+def record_verification(elapsed_ms: float, verified: bool, cache_hit: bool):
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["verified" if verified else "rejected"] += 1
+        _AUTH_STATS["cache_hits" if cache_hit else "cache_misses"] += 1
+        _AUTH_STATS["total_ms"] += elapsed_ms
+        _AUTH_STATS["max_ms"] = max(_AUTH_STATS["max_ms"], elapsed_ms)
+
+
+def poll_revocations():
+    """Pull new revocations from auth-service and forget those whose token has expired"""
+    response = requests.get(
+        f"{AUTH_SERVICE_URL}/revocations",
+        params={"since": _REVOCATION_STATE["seq"]},
+        timeout=2
+    )
+    response.raise_for_status()
+    data = response.json()
+    revoked = data.get("revoked", [])
+    # An auth-service without expires_at keeps its hashes until restart, as before
+    expires_at = data.get("expires_at", {})
+    for token_hash in revoked:
+        _REVOKED_TOKENS[token_hash] = expires_at.get(token_hash, float("inf"))
+    now = time.time()
+    for token_hash in [h for h, exp in _REVOKED_TOKENS.items() if exp <= now]:
+        del _REVOKED_TOKENS[token_hash]
+    _REVOCATION_STATE["seq"] = data.get("seq", _REVOCATION_STATE["seq"])
+    with _TOKEN_CACHE_LOCK:
+        for token_hash in revoked:
+            _TOKEN_CACHE.pop(token_hash, None)
+    with _AUTH_STATS_LOCK:
+        _AUTH_STATS["revocation_polls"] += 1
+
+
+def run_revocation_poller():
+    while True:
+        try:
+            poll_revocations()
+        except Exception as e:
+            # Signatures are still checked locally, auth-service being down must not lock users out
+            print(f"Failed to poll revocations: {e}")
+        time.sleep(REVOCATION_POLL_INTERVAL)
+
+
+def start_revocation_poller():
+    if REVOCATION_POLL_INTERVAL > 0:
+        threading.Thread(target=run_revocation_poller, name="revocation-poller", daemon=True).start()
+
+
+def cached_verification(token_hash: str):
+    """Return (hit, payload) from the verification cache"""
+    with _TOKEN_CACHE_LOCK:
+        entry = _TOKEN_CACHE.get(token_hash)
+        if entry is None:
+            return False, None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del _TOKEN_CACHE[token_hash]
+            return False, None
+        _TOKEN_CACHE.move_to_end(token_hash)
+        return True, payload
+
+
+def cache_verification(token_hash: str, payload):
+    """Remember a result; valid tokens never outlive their exp, invalid ones get a short TTL"""
+    now = time.time()
+    if payload:
+        expires_at = min(now + TOKEN_CACHE_TTL, payload.get("exp", now))
+    else:
+        expires_at = now + NEGATIVE_CACHE_TTL
+    if expires_at <= now:
+        return
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[token_hash] = (expires_at, payload)
+        _TOKEN_CACHE.move_to_end(token_hash)
+        while len(_TOKEN_CACHE) > TOKEN_CACHE_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+
+
 def verify_token(token: str):
-    """Verify token with auth service"""
-    try:
-        response = requests.post(
-            f"{AUTH_SERVICE_URL}/verify",
-            json={"token": token},
-            timeout=5
-        )
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except:
-        return None
+    """Verify JWT signature and expiry locally with the shared secret"""
+    start = time.perf_counter()
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    hit, payload = cached_verification(token_hash)
+    if not hit:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            payload = None
+        cache_verification(token_hash, payload)
+    if token_hash in _REVOKED_TOKENS:
+        payload = None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record_verification(elapsed_ms, payload is not None, hit)
+    return payload
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
 
 
+# Photos are stored once per content: <sha256>.<ext> in UPLOAD_FOLDER, referenced by every Photo
+# row with that content_hash. The lock orders "reuse a blob + commit" against "last reference
+# gone + unlink" so a blob is never removed under a photo being created.
+_BLOB_LOCK = threading.Lock()
+
+
+def stage_upload(file) -> tuple:
+    """Write an upload to a temp file, hashing it on the way; returns (temp path, sha256, ext)"""
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(app.config["UPLOAD_FOLDER"], f".{uuid.uuid4().hex}.upload")
+    try:
+        with open(tmp_path, "wb") as out:
+            while chunk := file.stream.read(BLOB_CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        # A client that disconnects mid-upload or a full disk must not leave the partial file behind
+        os.remove(tmp_path)
+        raise
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    return tmp_path, digest.hexdigest(), "jpg" if ext == "jpeg" else ext
+
+
+def store_blob(tmp_path: str, content_hash: str, ext: str) -> tuple:
+    """Move a staged upload into the store unless the content is there already (call under _BLOB_LOCK).
+
+    Returns (file name, whether a new blob was written).
+    """
+    existing = db.session.query(Photo.file_path).filter_by(content_hash=content_hash).first()
+    filename = existing.file_path if existing else f"{content_hash}.{ext}"
+    path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        return filename, False
+    os.replace(tmp_path, path)
+    return filename, True
+
+
+def release_blobs(photos: list):
+    """Unlink blobs of deleted photos that no remaining Photo row references (call under _BLOB_LOCK)"""
+    for file_path, content_hash in photos:
+        if content_hash and Photo.query.filter_by(content_hash=content_hash).count():
+            continue
+        path = os.path.join(app.config["UPLOAD_FOLDER"], file_path)
+        if os.path.exists(path):
+            os.remove(path)
+        _VARIANTS.remove(file_path)
+        _HOT_FILES.discard(hot_keys(file_path))
+
+
+def record_change(property_id: int, op: str = "upsert"):
+    """Append a change feed entry in the current transaction"""
+    db.session.add(PropertyChange(property_id=property_id, op=op))
+
+
+def add_missing_columns():
+    """create_all() does not alter existing tables, so columns added later are created here"""
+    columns = {column["name"] for column in db.inspect(db.engine).get_columns("property")}
+    if "updated_at" not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE property ADD COLUMN updated_at DATETIME"))
+            conn.execute(db.text("UPDATE property SET updated_at = created_at"))
+    columns = {column["name"] for column in db.inspect(db.engine).get_columns("photo")}
+    if "content_hash" not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE photo ADD COLUMN content_hash VARCHAR(64)"))
+            conn.execute(db.text("CREATE INDEX ix_photo_content_hash ON photo (content_hash)"))
+
+
+def backfill_changes():
+    """Seed the feed with every existing property the first time it is created"""
+    if PropertyChange.query.first() is not None:
+        return
+    ids = [row.id for row in db.session.query(Property.id).order_by(Property.id)]
+    for property_id in ids:
+        record_change(property_id)
+    db.session.commit()
+
+
+# Sort keys for GET /properties, a leading "-" means descending. Raw columns, so the
+# (column, id) indexes serve both ORDER BY and the cursor seek; NULL areas sort lowest.
+SORT_COLUMNS = {
+    "created_at": Property.created_at,
+    "price": Property.price_eur,
+    "area": Property.area_m2,
+}
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Change feed batch size for GET /changes
+DEFAULT_FEED_BATCH = 500
+MAX_FEED_BATCH = 1000
+
+
+def sort_value(prop: Property, key: str):
+    """Value of the sort column for a row, as compared in SQL"""
+    if key == "created_at":
+        return prop.created_at
+    if key == "price":
+        return prop.price_eur
+    return prop.area_m2
+
+
+def seek_after(column, descending: bool, value, last_id: int):
+    """Filter for rows after (value, id) in sort order.
+
+    NULLs come first ascending and last descending. The range on the column
+    lets SQLite seek the (column, id) index; a non-NULL cursor going down
+    leaves out the trailing NULL rows, which the caller reads separately.
+    """
+    if value is None:
+        if descending:
+            return db.and_(column.is_(None), Property.id < last_id)
+        return db.or_(db.and_(column.is_(None), Property.id > last_id), column.isnot(None))
+    if descending:
+        return db.and_(column <= value, db.or_(column < value, Property.id < last_id))
+    return db.and_(column >= value, db.or_(column > value, Property.id > last_id))
+
+
+def encode_cursor(sort: str, value, row_id: int) -> str:
+    """Opaque keyset cursor pointing just after the given row"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort: str):
+    """Return (sort value, id) from a cursor, ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        cursor_sort, value, row_id = json.loads(raw)
+        if sort.lstrip("-") == "created_at":
+            value = datetime.fromisoformat(value)
+        row_id = int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match sort order")
+    return value, row_id
+
+
+# Serialized responses: {property id: (body, etag)} and {(sort, limit, after): (body, etag, next cursor)},
+# both in LRU order. Committed writes to a property or its photos drop its entry and every list page.
+_PROPERTY_CACHE = OrderedDict()
+_PAGE_CACHE = OrderedDict()
+_RESPONSE_CACHE_LOCK = threading.Lock()
+# Bumped on every invalidation; a read that started before it must not store its result
+_RESPONSE_CACHE_STATE = {"generation": 0}
+_RESPONSE_CACHE_STATS = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+
+def serialize(data) -> tuple:
+    """JSON body as sent by jsonify and its strong ETag"""
+    body = app.json.dumps(data).encode()
+    return body, hashlib.sha1(body).hexdigest()
+
+
+def json_response(body: bytes, etag: str, status: int = 200):
+    """Response for a cached body; answers 304 when If-None-Match matches"""
+    response = app.response_class(body, status=status, mimetype="application/json")
+    response.set_etag(etag)
+    response.make_conditional(request)
+    if response.status_code == 304:
+        with _RESPONSE_CACHE_LOCK:
+            _RESPONSE_CACHE_STATS["not_modified"] += 1
+    return response
+
+
+def page_response(body: bytes, etag: str, next_cursor: str):
+    response = json_response(body, etag)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+def cache_generation() -> int:
+    with _RESPONSE_CACHE_LOCK:
+        return _RESPONSE_CACHE_STATE["generation"]
+
+
+def cache_lookup(cache: OrderedDict, key):
+    with _RESPONSE_CACHE_LOCK:
+        entry = cache.get(key)
+        if entry is None:
+            _RESPONSE_CACHE_STATS["misses"] += 1
+            return None
+        cache.move_to_end(key)
+        _RESPONSE_CACHE_STATS["hits"] += 1
+        return entry
+
+
+def cache_store(cache: OrderedDict, capacity: int, key, entry: tuple, generation: int):
+    """Store unless the cache was invalidated since generation was read"""
+    with _RESPONSE_CACHE_LOCK:
+        if capacity <= 0 or generation != _RESPONSE_CACHE_STATE["generation"]:
+            return
+        cache[key] = entry
+        cache.move_to_end(key)
+        while len(cache) > capacity:
+            cache.popitem(last=False)
+
+
+def invalidate_properties(property_ids):
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE_STATE["generation"] += 1
+        _RESPONSE_CACHE_STATS["invalidations"] += 1
+        for property_id in property_ids:
+            _PROPERTY_CACHE.pop(property_id, None)
+        _PAGE_CACHE.clear()
+
+
+def clear_response_cache():
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE_STATE["generation"] += 1
+        _PROPERTY_CACHE.clear()
+        _PAGE_CACHE.clear()
+
+
+@event.listens_for(db.session, "before_flush")
+def touch_photo_owners(session, flush_context, instances):
+    """Adding or removing a photo counts as a change of its property"""
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.deleted):
+            if isinstance(obj, Photo) and obj.property_id:
+                prop = session.get(Property, obj.property_id)
+                if prop is not None and prop not in session.deleted:
+                    prop.updated_at = datetime.utcnow()
+
+
+@event.listens_for(db.session, "after_flush")
+def collect_changed_properties(session, flush_context):
+    """Remember properties touched by the flush, including through their photos"""
+    changed = session.info.setdefault("changed_properties", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Property):
+            changed.add(obj.id)
+        elif isinstance(obj, Photo):
+            changed.add(obj.property_id)
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_committed_properties(session):
+    changed = session.info.pop("changed_properties", None)
+    if changed:
+        invalidate_properties(changed)
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_changed_properties(session):
+    session.info.pop("changed_properties", None)
+
+
+def cache_property(prop: Property, generation: int = None) -> tuple:
+    """Serialize a property loaded at generation (default: now, after a commit) into the cache"""
+    if generation is None:
+        generation = cache_generation()
+    entry = serialize(prop.to_dict())
+    cache_store(_PROPERTY_CACHE, PROPERTY_CACHE_SIZE, prop.id, entry, generation)
+    return entry
+
+
+# Notifications are queued with the change they announce and delivered in batches (see outbox.py)
+_OUTBOX = Outbox(app, db, OutboxMessage, NOTIFICATION_SERVICE_URL, OUTBOX_POLL_INTERVAL,
+                 OUTBOX_BATCH_SIZE, OUTBOX_TIMEOUT, OUTBOX_MAX_BACKOFF)
+enqueue_notification = _OUTBOX.enqueue
+dispatch_outbox = _OUTBOX.dispatch
+start_on_first_request(app, _OUTBOX.start, start_revocation_poller)
+
+
 # Routes
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "healthy", "service": "property-service"}), 200
 
 
+@app.route("/metrics/auth", methods=["GET"])
+def auth_metrics():
+    """Token verification counters and latency"""
+    with _AUTH_STATS_LOCK:
+        stats = dict(_AUTH_STATS)
+    checks = stats["verified"] + stats["rejected"]
+    stats["avg_ms"] = round(stats["total_ms"] / checks, 3) if checks else 0.0
+    return jsonify(stats), 200
+
+
+@app.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    """Serialized response cache counters"""
+    with _RESPONSE_CACHE_LOCK:
+        stats = dict(_RESPONSE_CACHE_STATS, properties=len(_PROPERTY_CACHE), pages=len(_PAGE_CACHE),
+                     property_capacity=PROPERTY_CACHE_SIZE, page_capacity=PAGE_CACHE_SIZE)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return jsonify(stats), 200
+
+
 @app.route("/properties", methods=["GET"])
 def get_properties():
     """Get all properties with optional filters"""
@@ -105,9 +573,17 @@ def get_properties():
     property_type = request.args.get("property_type")
     min_price = request.args.get("min_price", type=float)
     max_price = request.args.get("max_price", type=float)
+    try:
+        ids = [int(i) for i in request.args.get("ids", "").split(",") if i]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+    if len(ids) > MAX_PAGE_SIZE:
+        return jsonify({"error": f"At most {MAX_PAGE_SIZE} ids per request"}), 400
     
     query = Property.query
     
+    if ids:
+        query = query.filter(Property.id.in_(ids))
     if city:
         query = query.filter(Property.city.ilike(f"%{city}%"))
     if property_type:
@@ -117,17 +593,122 @@ def get_properties():
     if max_price:
         query = query.filter(Property.price_eur <= max_price)
     
-    properties = query.order_by(Property.created_at.desc()).all()
-    return jsonify([prop.to_dict() for prop in properties]), 200
+    sort = request.args.get("sort", "-created_at")
+    key = sort.lstrip("-")
+    if key not in SORT_COLUMNS:
+        return jsonify({"error": f"Unknown sort key: {key}"}), 400
+    column = SORT_COLUMNS[key]
+    descending = sort.startswith("-")
+    
+    limit = request.args.get("limit", type=int)
+    after = request.args.get("after")
+    
+    # Unfiltered pages are the common case and are served from the page cache
+    cache_key = None
+    if not (ids or city or property_type or min_price or max_price):
+        cache_key = (sort, limit, after)
+        entry = cache_lookup(_PAGE_CACHE, cache_key)
+        if entry is not None:
+            return page_response(*entry)
+    else:
+        # Filtered lists are validated from the matching rows' versions before anything is loaded
+        etag = list_etag(query, Property, Property.updated_at, request.full_path)
+        if is_not_modified(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+    generation = cache_generation()
+    
+    unpaged = query
+    value = None
+    if after:
+        try:
+            value, last_id = decode_cursor(after, sort)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        query = query.filter(seek_after(column, descending, value, last_id))
+    
+    if descending:
+        query = query.order_by(column.desc().nulls_last(), Property.id.desc())
+    else:
+        query = query.order_by(column.asc().nulls_first(), Property.id.asc())
+    
+    next_cursor = None
+    # Without limit/after the whole catalog is returned (legacy clients)
+    if limit is None and not after:
+        properties = query.all()
+    else:
+        page_size = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        rows = query.limit(page_size + 1).all()
+        if descending and value is not None and len(rows) <= page_size:
+            # Past the last non-NULL value: go on with the NULL rows
+            rows += (unpaged.filter(column.is_(None))
+                     .order_by(Property.id.desc())
+                     .limit(page_size + 1 - len(rows))
+                     .all())
+        properties = rows[:page_size]
+        if len(rows) > page_size:
+            last = properties[-1]
+            next_cursor = encode_cursor(sort, sort_value(last, key), last.id)
+    
+    if cache_key is None:
+        response = jsonify([prop.to_dict() for prop in properties])
+        response.set_etag(etag)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
+    entry = serialize([prop.to_dict() for prop in properties]) + (next_cursor,)
+    cache_store(_PAGE_CACHE, PAGE_CACHE_SIZE, cache_key, entry, generation)
+    return page_response(*entry)
+
+
+@app.route("/changes", methods=["GET"])
+def get_changes():
+    """Properties created, updated or deleted after the given sequence number"""
+    since = request.args.get("since", 0, type=int)
+    limit = min(max(request.args.get("limit", DEFAULT_FEED_BATCH, type=int), 1), MAX_FEED_BATCH)
+    
+    rows = (PropertyChange.query
+            .filter(PropertyChange.seq > since)
+            .order_by(PropertyChange.seq)
+            .limit(limit + 1)
+            .all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    # Current state of every upserted property in one query
+    ids = {row.property_id for row in rows if row.op == "upsert"}
+    current = {prop.id: prop for prop in Property.query.filter(Property.id.in_(ids))} if ids else {}
+    
+    changes = []
+    for row in rows:
+        prop = current.get(row.property_id) if row.op == "upsert" else None
+        # Upserts of a property deleted later are sent as tombstones too
+        changes.append({
+            "seq": row.seq,
+            "op": "upsert" if prop else "delete",
+            "id": row.property_id,
+            "property": prop.to_dict() if prop else None,
+        })
+    
+    return jsonify({
+        "seq": rows[-1].seq if rows else since,
+        "changes": changes,
+        "has_more": has_more,
+    }), 200
 
 
 @app.route("/properties/<int:property_id>", methods=["GET"])
 def get_property(property_id: int):
     """Get single property by ID"""
-    prop = db.session.get(Property, property_id)
-    if not prop:
-        return jsonify({"error": "Property not found"}), 404
-    return jsonify(prop.to_dict()), 200
+    entry = cache_lookup(_PROPERTY_CACHE, property_id)
+    if entry is None:
+        generation = cache_generation()
+        prop = db.session.get(Property, property_id)
+        if not prop:
+            return jsonify({"error": "Property not found"}), 404
+        entry = cache_property(prop, generation)
+    return json_response(*entry)
 
 
 @app.route("/properties", methods=["POST"])
@@ -148,8 +729,9 @@ def create_property():
     property_type = data.get("property_type", "apartment")
     rooms = int(data.get("rooms", 0) or 0)
     area_m2 = float(data.get("area_m2", 0) or 0)
-    is_for_sale = data.get("is_for_sale") == "true"
-    is_for_rent = data.get("is_for_rent") == "true"
+    # "on" is what an HTML checkbox sends when the gateway relays the form unchanged
+    is_for_sale = data.get("is_for_sale") in ("true", "on")
+    is_for_rent = data.get("is_for_rent") in ("true", "on")
     
     if not title or not city or not address or price_eur <= 0:
         return jsonify({"error": "Missing required fields"}), 400
@@ -166,46 +748,51 @@ def create_property():
         is_for_sale=is_for_sale,
         is_for_rent=is_for_rent
     )
-    db.session.add(prop)
-    db.session.flush()
-    
-    # Handle photo uploads
-    if 'photos' in request.files:
-        files = request.files.getlist('photos')
-        for file in files:
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                filepath = os.path.join(app.config["UPLOAD_FOLDER"], unique_filename)
-                file.save(filepath)
-                
-                photo = Photo(property_id=prop.id, file_path=unique_filename)
-                db.session.add(photo)
-    
-    db.session.commit()
     
-    # Send notification about new property to all users
+    # Handle photo uploads: hashed while written, identical photos share one stored file.
+    # They are staged before the property is flushed, so no write transaction stays open
+    # while photos stream to disk.
+    staged = []
+    saved = []
     try:
-        sale_rent = []
-        if prop.is_for_sale:
-            sale_rent.append("продажа")
-        if prop.is_for_rent:
-            sale_rent.append("аренда")
-        
-        notification_message = f"🏠 Новый объект! {prop.title} в {prop.city}, {prop.price_eur}€ ({', '.join(sale_rent)})"
-        requests.post(
-            f"{NOTIFICATION_SERVICE_URL}/notifications",
-            json={
-                "recipient": "all-users@agency.com",
-                "channel": "push",
-                "message": notification_message
-            },
-            timeout=3
-        )
-    except Exception as e:
-        print(f"Failed to send new property notification: {e}")
+        if 'photos' in request.files:
+            for file in request.files.getlist('photos'):
+                if file and file.filename and allowed_file(file.filename):
+                    staged.append(stage_upload(file))
+        db.session.add(prop)
+        db.session.flush()
+        with _BLOB_LOCK:
+            try:
+                for tmp_path, content_hash, ext in staged:
+                    filename, written = store_blob(tmp_path, content_hash, ext)
+                    db.session.add(Photo(property_id=prop.id, file_path=filename, content_hash=content_hash))
+                    if written:
+                        saved.append(filename)
+                record_change(prop.id)
+                # Announce the property to all users in the same transaction (see OutboxMessage)
+                sale_rent = []
+                if prop.is_for_sale:
+                    sale_rent.append("продажа")
+                if prop.is_for_rent:
+                    sale_rent.append("аренда")
+                notification_message = f"🏠 Новый объект! {prop.title} в {prop.city}, {prop.price_eur}€ ({', '.join(sale_rent)})"
+                enqueue_notification("all-users@agency.com", "push", notification_message)
+                db.session.commit()
+            except Exception:
+                # Blobs written for this request have no Photo row once the transaction is gone
+                db.session.rollback()
+                for filename in saved:
+                    os.remove(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+                raise
+    finally:
+        # store_blob consumed what it got to; the rest is still staged
+        for tmp_path, _, _ in staged:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    for filename in saved:
+        _VARIANTS.submit(filename)
     
-    return jsonify(prop.to_dict()), 201
+    return json_response(*cache_property(prop), status=201)
 
 
 @app.route("/properties/<int:property_id>", methods=["PUT"])
@@ -244,8 +831,9 @@ def update_property(property_id: int):
     if "is_for_rent" in data:
         prop.is_for_rent = data["is_for_rent"]
     
+    record_change(prop.id)
     db.session.commit()
-    return jsonify(prop.to_dict()), 200
+    return json_response(*cache_property(prop))
 
 
 @app.route("/properties/<int:property_id>", methods=["DELETE"])
@@ -261,28 +849,85 @@ def delete_property(property_id: int):
     if not prop:
         return jsonify({"error": "Property not found"}), 404
     
-    # Delete associated photos from filesystem
-    for photo in prop.photos:
-        filepath = os.path.join(app.config["UPLOAD_FOLDER"], photo.file_path)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-    
+    photos = [(photo.file_path, photo.content_hash) for photo in prop.photos]
     db.session.delete(prop)
-    db.session.commit()
+    record_change(property_id, "delete")
+    # Files go only once no other property references the same content
+    with _BLOB_LOCK:
+        db.session.commit()
+        release_blobs(photos)
     return jsonify({"message": "Property deleted"}), 200
 
 
+def send_upload(path: str, immutable: bool = True):
+    """send_file with Range support and caching matching whether the URL can change content.
+
+    Unique names get their name as strong ETag and a year of immutable caching;
+    anything else is revalidated on every use. Under a WSGI server with
+    wsgi.file_wrapper (gunicorn) the body goes out through sendfile.
+    """
+    name = os.path.basename(path)
+    if immutable and IMMUTABLE_UPLOAD.match(name):
+        response = send_file(path, conditional=True, etag=name, max_age=UPLOAD_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+    return send_file(path, conditional=True)
+
+
+def hot_keys(filename: str) -> list:
+    """Every hot cache key a file can be served under"""
+    return [(filename, None, False)] + [(filename, size, webp) for size in VARIANT_SIZES for webp in (True, False)]
+
+
+def send_cached(entry):
+    """Answer from a hot cache entry with the headers send_upload gives the file on disk"""
+    response = send_file(io.BytesIO(entry.data), mimetype=entry.mimetype, conditional=True,
+                         etag=entry.etag, last_modified=entry.last_modified, max_age=UPLOAD_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route("/uploads/<filename>", methods=["GET"])
 def get_upload(filename):
-    """Serve uploaded photo"""
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    if os.path.exists(filepath):
-        return send_file(filepath)
-    return jsonify({"error": "File not found"}), 404
+    """Serve uploaded photo, or with ?size=thumb|medium|large its downscaled variant"""
+    size = request.args.get("size")
+    if size and size not in VARIANT_SIZES:
+        return jsonify({"error": f"Unknown size: {size}"}), 400
+    webp = bool(size) and request.accept_mimetypes["image/webp"] > 0
+    key = (filename, size, webp)
+    entry = _HOT_FILES.get(key)
+    if entry is None:
+        filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+        # WebP for browsers that accept it; the original until the variant is rendered,
+        # which must not be cached for good since the same URL will change
+        variant = _VARIANTS.find(filename, size, webp) if size else None
+        path = variant or filepath
+        immutable = (variant is not None or not size) and IMMUTABLE_UPLOAD.match(filename) is not None
+        # Directories such as variants/ are not files to serve
+        if not os.path.isfile(path):
+            return jsonify({"error": "File not found"}), 404
+        try:
+            entry = _HOT_FILES.admit(key, path) if immutable else None
+            response = send_cached(entry) if entry else send_upload(path, immutable=bool(variant) or not size)
+        except FileNotFoundError:
+            return jsonify({"error": "File not found"}), 404
+    else:
+        response = send_cached(entry)
+    if size:
+        response.vary.add("Accept")
+    return response
+
+
+@app.route("/metrics/file-cache", methods=["GET"])
+def file_cache_metrics():
+    """Hot photo cache counters"""
+    return jsonify(_HOT_FILES.stats()), 200
 
 
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
+        add_missing_columns()
+        backfill_changes()
     port = int(os.environ.get("PORT", 5002))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -1,6 +1,18 @@
 import unittest
 import json
-from app import app, db, Property, Photo
+from datetime import datetime, timedelta
+import jwt
+from sqlalchemy import event
+import hashlib
+import io
+import uuid
+import os
+import tempfile
+import time
+from unittest import mock
+import app as property_app
+import thumbnails
+from app import app, db, Property, Photo, JWT_SECRET
 
 
 class PropertyServiceTestCase(unittest.TestCase):
@@ -20,6 +32,7 @@ class PropertyServiceTestCase(unittest.TestCase):
         with app.app_context():
             db.session.remove()
             db.drop_all()
+        property_app.clear_response_cache()
     
     def test_health_check(self):
         """Test /health endpoint"""
@@ -133,6 +146,453 @@ class PropertyServiceTestCase(unittest.TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['price_eur'], 60000)
     
+    def test_filter_properties_by_ids(self):
+        """Test fetching only the listed properties"""
+        with app.app_context():
+            for i in range(4):
+                db.session.add(Property(title=f"P{i}", city="C", address="A", price_eur=1000, property_type="house"))
+            db.session.commit()
+        
+        response = self.client.get('/properties?ids=3,1,99')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(p['id'] for p in json.loads(response.data)), [1, 3])
+        response = self.client.get('/properties?ids=1,x')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_keyset_pagination(self):
+        """Test walking the catalog page by page with a cursor"""
+        with app.app_context():
+            for i in range(5):
+                db.session.add(Property(title=f"P{i}", city="C", address="A", price_eur=1000 * (5 - i), property_type="apartment"))
+            db.session.commit()
+        
+        seen = []
+        params = {'limit': 2, 'sort': 'price'}
+        while True:
+            response = self.client.get('/properties', query_string=params)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.data)
+            self.assertLessEqual(len(page), 2)
+            seen.extend(p['price_eur'] for p in page)
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+            params['after'] = cursor
+        
+        self.assertEqual(seen, [1000, 2000, 3000, 4000, 5000])
+    
+    def test_pagination_by_area_with_missing_values(self):
+        """Test that properties without area come first ascending and last descending"""
+        areas = [None, 50, None, 120, 80, 50]
+        with app.app_context():
+            for i, area in enumerate(areas):
+                db.session.add(Property(title=f"P{i}", city="C", address="A", price_eur=1000,
+                                        property_type="house", area_m2=area))
+            db.session.commit()
+        
+        for sort, expected in (('area', [1, 3, 2, 6, 5, 4]), ('-area', [4, 5, 6, 2, 3, 1])):
+            seen = []
+            params = {'limit': 2, 'sort': sort}
+            while True:
+                response = self.client.get('/properties', query_string=params)
+                self.assertEqual(response.status_code, 200)
+                seen.extend(p['id'] for p in json.loads(response.data))
+                cursor = response.headers.get('X-Next-Cursor')
+                if not cursor:
+                    break
+                params['after'] = cursor
+            self.assertEqual(seen, expected)
+    
+    def test_pagination_default_order_newest_first(self):
+        """Test that paginated results keep newest-first order by default"""
+        with app.app_context():
+            for i in range(3):
+                db.session.add(Property(title=f"P{i}", city="C", address="A", price_eur=1000, property_type="house"))
+            db.session.commit()
+        
+        response = self.client.get('/properties?limit=2')
+        first_page = json.loads(response.data)
+        cursor = response.headers.get('X-Next-Cursor')
+        self.assertIsNotNone(cursor)
+        response = self.client.get(f'/properties?limit=2&after={cursor}')
+        second_page = json.loads(response.data)
+        self.assertIsNone(response.headers.get('X-Next-Cursor'))
+        ids = [p['id'] for p in first_page + second_page]
+        self.assertEqual(len(set(ids)), 3)
+    
+    def test_pagination_invalid_params(self):
+        """Test invalid sort key and malformed cursor"""
+        response = self.client.get('/properties?sort=rooms')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/properties?limit=5&after=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+    
+    def count_list_queries(self, page_size):
+        """Create page_size properties with two photos each, count SQL statements of one list page"""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            for i in range(page_size):
+                prop = Property(title=f"P{i}", city="C", address="A", price_eur=1000 + i, property_type="apartment")
+                prop.photos = [Photo(file_path=f"p{i}_a.jpg"), Photo(file_path=f"p{i}_b.jpg")]
+                db.session.add(prop)
+            db.session.commit()
+            engine = db.engine
+        
+        statements = []
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            response = self.client.get(f'/properties?limit={page_size}')
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
+        
+        data = json.loads(response.data)
+        self.assertEqual(len(data), page_size)
+        self.assertTrue(all(len(p['photos']) == 2 for p in data))
+        return len(statements)
+    
+    def test_list_photos_loaded_in_bulk(self):
+        """Test that a list page issues a fixed number of queries regardless of page size"""
+        small_page = self.count_list_queries(2)
+        large_page = self.count_list_queries(20)
+        self.assertEqual(small_page, large_page)
+        self.assertLessEqual(large_page, 2)
+    
+    def make_token(self, role="agent", expires_in=timedelta(hours=1)):
+        """Token signed the same way auth-service signs it"""
+        payload = {"user_id": 1, "email": "agent@test.com", "role": role, "exp": datetime.utcnow() + expires_in}
+        return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+    
+    def test_create_property_with_local_token(self):
+        """Test that a valid token is accepted without calling auth-service"""
+        headers = {'Authorization': f'Bearer {self.make_token()}'}
+        data = {'title': 'New', 'city': 'Кишинев', 'address': 'A1', 'price_eur': '1000'}
+        response = self.client.post('/properties', data=data, headers=headers)
+        self.assertEqual(response.status_code, 201)
+    
+    def test_duplicate_photos_share_one_blob(self):
+        """Test content-addressed storage: equal photos stored once, removed with the last reference"""
+        headers = {'Authorization': f'Bearer {self.make_token()}'}
+        content = b'same photo ' + uuid.uuid4().bytes
+        ids = []
+        for name in ('a.jpg', 'b.JPEG'):
+            data = {'title': 'New', 'city': 'C', 'address': 'A1', 'price_eur': '1000',
+                    'photos': (io.BytesIO(content), name)}
+            response = self.client.post('/properties', data=data, headers=headers)
+            ids.append(json.loads(response.data)['id'])
+        
+        with app.app_context():
+            paths = {photo.file_path for photo in Photo.query}
+        self.assertEqual(paths, {hashlib.sha256(content).hexdigest() + '.jpg'})
+        blob = os.path.join(app.config['UPLOAD_FOLDER'], paths.pop())
+        
+        self.client.delete(f'/properties/{ids[0]}', headers=headers)
+        self.assertTrue(os.path.exists(blob))
+        self.client.delete(f'/properties/{ids[1]}', headers=headers)
+        self.assertFalse(os.path.exists(blob))
+    
+    def test_photos_staged_before_transaction_and_cleaned_on_failure(self):
+        """Test that photos are written before the insert and no file outlives a failed upload or commit"""
+        headers = {'Authorization': f'Bearer {self.make_token()}'}
+        folder = app.config['UPLOAD_FOLDER']
+        content = b'unique photo ' + uuid.uuid4().bytes
+        blob = os.path.join(folder, hashlib.sha256(content).hexdigest() + '.jpg')
+        before = set(os.listdir(folder))
+        stage_upload = property_app.stage_upload
+        
+        def staged_outside_transaction(file):
+            self.assertFalse(db.session().in_transaction())
+            return stage_upload(file)
+        
+        data = {'title': 'New', 'city': 'C', 'address': 'A1', 'price_eur': '1000',
+                'photos': (io.BytesIO(content), 'a.jpg')}
+        with mock.patch('app.stage_upload', side_effect=staged_outside_transaction), \
+                mock.patch.object(db.session, 'commit', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/properties', data=data, headers=headers)
+        self.assertFalse(os.path.exists(blob))
+        self.assertEqual(set(os.listdir(folder)), before)
+        with app.app_context():
+            self.assertEqual(Property.query.count(), 0)
+        
+        broken = mock.Mock(filename='b.jpg')
+        broken.stream.read.side_effect = [b'partial', OSError('client disconnected')]
+        with app.test_request_context(), self.assertRaises(OSError):
+            property_app.stage_upload(broken)
+        self.assertEqual(set(os.listdir(folder)), before)
+    
+    def test_rejects_expired_and_forged_tokens(self):
+        """Test that expired tokens and tokens with a wrong signature are rejected"""
+        data = {'title': 'New', 'city': 'C', 'address': 'A1', 'price_eur': '1000'}
+        expired = self.make_token(expires_in=timedelta(seconds=-1))
+        forged = jwt.encode({"user_id": 1, "role": "agent"}, "wrong-secret", algorithm="HS256")
+        for token in (expired, forged, "garbage"):
+            response = self.client.post('/properties', data=data, headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(response.status_code, 403)
+        
+        response = self.client.get('/metrics/auth')
+        stats = json.loads(response.data)
+        self.assertGreaterEqual(stats['rejected'], 3)
+        self.assertIn('avg_ms', stats)
+    
+    def test_token_verification_cache_and_revocation(self):
+        """Test that repeated verification hits the cache and a revoked hash is rejected"""
+        token = self.make_token()
+        property_app._TOKEN_CACHE.clear()
+        self.assertIsNotNone(property_app.verify_token(token))
+        hits_before = property_app._AUTH_STATS['cache_hits']
+        self.assertIsNotNone(property_app.verify_token(token))
+        self.assertEqual(property_app._AUTH_STATS['cache_hits'], hits_before + 1)
+        
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        property_app._REVOKED_TOKENS[token_hash] = float("inf")
+        try:
+            self.assertIsNone(property_app.verify_token(token))
+        finally:
+            property_app._REVOKED_TOKENS.pop(token_hash, None)
+    
+    def test_revocation_poll_drops_expired_hashes(self):
+        """Test that verification never calls auth-service and polls forget hashes past their exp"""
+        token = self.make_token()
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        with mock.patch('app.requests.get', side_effect=AssertionError('request path polled')):
+            self.assertIsNotNone(property_app.verify_token(token))
+        
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {
+            "seq": 2, "revoked": [token_hash, "stale"],
+            "expires_at": {token_hash: now + 3600, "stale": now + 3600}
+        }
+        with mock.patch('app.requests.get', return_value=response):
+            property_app.poll_revocations()
+        try:
+            self.assertIsNone(property_app.verify_token(token))
+            self.assertEqual(property_app._REVOCATION_STATE["seq"], 2)
+            
+            property_app._REVOKED_TOKENS["stale"] = now - 1
+            response.json.return_value = {"seq": 2, "revoked": [], "expires_at": {}}
+            with mock.patch('app.requests.get', return_value=response):
+                property_app.poll_revocations()
+            self.assertNotIn("stale", property_app._REVOKED_TOKENS)
+            self.assertIn(token_hash, property_app._REVOKED_TOKENS)
+        finally:
+            property_app._REVOKED_TOKENS.clear()
+            property_app._REVOCATION_STATE["seq"] = 0
+    
+    def test_background_threads_started_by_first_request(self):
+        """Test that the revocation poller and outbox dispatcher start with the first request, once"""
+        app.config['TESTING'] = False
+        try:
+            with mock.patch('threading.Thread') as thread:
+                self.client.get('/health')
+                self.client.get('/health')
+        finally:
+            app.config['TESTING'] = True
+        names = sorted(call.kwargs['name'] for call in thread.call_args_list)
+        self.assertEqual(names, ['outbox-dispatcher', 'revocation-poller'])
+    
+    def test_change_feed_with_tombstones(self):
+        """Test that creates, updates and deletes appear in the change feed"""
+        headers = {'Authorization': f'Bearer {self.make_token()}'}
+        data = {'title': 'New', 'city': 'C', 'address': 'A1', 'price_eur': '1000'}
+        first = json.loads(self.client.post('/properties', data=data, headers=headers).data)['id']
+        second = json.loads(self.client.post('/properties', data=data, headers=headers).data)['id']
+        self.client.put(f'/properties/{first}', json={'title': 'Updated'}, headers=headers)
+        self.client.delete(f'/properties/{second}', headers=headers)
+        
+        feed = json.loads(self.client.get('/changes?since=0&limit=3').data)
+        self.assertTrue(feed['has_more'])
+        self.assertEqual([c['op'] for c in feed['changes']], ['upsert', 'delete', 'upsert'])
+        self.assertEqual(feed['changes'][0]['property']['title'], 'Updated')
+        self.assertIsNone(feed['changes'][1]['property'])
+        
+        feed = json.loads(self.client.get(f'/changes?since={feed["seq"]}').data)
+        self.assertFalse(feed['has_more'])
+        self.assertEqual([(c['op'], c['id']) for c in feed['changes']], [('delete', second)])
+        
+        feed = json.loads(self.client.get(f'/changes?since={feed["seq"]}').data)
+        self.assertEqual(feed['changes'], [])
+    
+    def test_cached_responses_with_etag(self):
+        """Test that repeat reads are served from the cache and revalidate with 304"""
+        with app.app_context():
+            db.session.add(Property(title="P", city="C", address="A", price_eur=1000, property_type="house"))
+            db.session.commit()
+        
+        for url in ('/properties/1', '/properties?limit=10', '/properties'):
+            first = self.client.get(url)
+            etag = first.headers['ETag']
+            hits_before = property_app._RESPONSE_CACHE_STATS['hits']
+            second = self.client.get(url)
+            self.assertEqual(second.data, first.data)
+            self.assertEqual(property_app._RESPONSE_CACHE_STATS['hits'], hits_before + 1)
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+        
+        stats = json.loads(self.client.get('/metrics/cache').data)
+        self.assertEqual((stats['properties'], stats['pages']), (1, 2))
+    
+    def test_cache_invalidated_on_write(self):
+        """Test write-through on update and invalidation on photo changes and delete"""
+        headers = {'Authorization': f'Bearer {self.make_token()}'}
+        data = {'title': 'New', 'city': 'C', 'address': 'A1', 'price_eur': '1000'}
+        prop_id = json.loads(self.client.post('/properties', data=data, headers=headers).data)['id']
+        etag = self.client.get(f'/properties/{prop_id}').headers['ETag']
+        self.assertEqual(len(json.loads(self.client.get('/properties').data)), 1)
+        
+        self.client.put(f'/properties/{prop_id}', json={'title': 'Updated'}, headers=headers)
+        self.assertIn(prop_id, property_app._PROPERTY_CACHE)
+        response = self.client.get(f'/properties/{prop_id}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['title'], 'Updated')
+        self.assertEqual(json.loads(self.client.get('/properties').data)[0]['title'], 'Updated')
+        
+        with app.app_context():
+            db.session.add(Photo(property_id=prop_id, file_path="new.jpg"))
+            db.session.commit()
+        self.assertEqual(len(json.loads(self.client.get(f'/properties/{prop_id}').data)['photos']), 1)
+        
+        self.client.delete(f'/properties/{prop_id}', headers=headers)
+        self.assertEqual(self.client.get(f'/properties/{prop_id}').status_code, 404)
+        self.assertEqual(json.loads(self.client.get('/properties').data), [])
+    
+    def test_filtered_list_conditional_get(self):
+        """Test the ETag of a filtered list and 304 until a row changes or is deleted"""
+        headers = {'Authorization': f'Bearer {self.make_token()}'}
+        data = {'title': 'New', 'city': 'Кишинев', 'address': 'A1', 'price_eur': '1000'}
+        prop_id = json.loads(self.client.post('/properties', data=data, headers=headers).data)['id']
+        
+        url = '/properties?city=Кишинев&limit=10'
+        first = self.client.get(url)
+        etag = first.headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        # max(updated_at) misses deletes, so lists are revalidated by ETag only
+        self.assertNotIn('Last-Modified', first.headers)
+        since = {'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}
+        self.assertEqual(self.client.get(url, headers=since).status_code, 200)
+        
+        self.client.put(f'/properties/{prop_id}', json={'price_eur': 2000}, headers=headers)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        etag = response.headers['ETag']
+        
+        with app.app_context():
+            db.session.add(Photo(property_id=prop_id, file_path="new.jpg"))
+            db.session.commit()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        
+        other_id = json.loads(self.client.post('/properties', data=data, headers=headers).data)['id']
+        etag = self.client.get(url).headers['ETag']
+        self.client.delete(f'/properties/{prop_id}', headers=headers)
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in json.loads(response.data)], [other_id])
+    
+    def write_upload(self, name, data):
+        path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.addCleanup(os.remove, path)
+        self.addCleanup(property_app._VARIANTS.remove, name)
+    
+    def test_photo_size_falls_back_to_original(self):
+        """Test ?size= validation and serving the original until a variant exists"""
+        self.write_upload('pending_variant.jpg', b'original bytes')
+        response = self.client.get('/uploads/pending_variant.jpg?size=huge')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/uploads/pending_variant.jpg?size=thumb')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'original bytes')
+        self.assertIn('Accept', response.headers['Vary'])
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        response.close()
+    
+    def test_upload_cached_with_ranges(self):
+        """Test immutable caching, strong ETag and Range requests for uploaded photos"""
+        name = f'{uuid.uuid4()}_photo.jpg'
+        self.write_upload(name, b'0123456789')
+        response = self.client.get(f'/uploads/{name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        self.assertEqual(response.headers['ETag'], f'"{name}"')
+        response.close()
+        
+        response = self.client.get(f'/uploads/{name}', headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'2345')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+        response.close()
+        response = self.client.get(f'/uploads/{name}', headers={'If-None-Match': f'"{name}"'})
+        self.assertEqual(response.status_code, 304)
+        response.close()
+        self.assertEqual(self.client.get('/uploads/missing.jpg').status_code, 404)
+        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], thumbnails.VARIANTS_DIR), exist_ok=True)
+        self.assertEqual(self.client.get(f'/uploads/{thumbnails.VARIANTS_DIR}').status_code, 404)
+    
+    def test_hot_photos_served_from_memory(self):
+        """Test frequency-based admission to the hot photo cache, size bypass and drop on delete"""
+        headers = {'Authorization': f'Bearer {self.make_token()}'}
+        cover = b'cover ' + uuid.uuid4().bytes
+        data = {'title': 'New', 'city': 'C', 'address': 'A1', 'price_eur': '1000',
+                'photos': (io.BytesIO(cover), 'cover.jpg')}
+        property_id = json.loads(self.client.post('/properties', data=data, headers=headers).data)['id']
+        with app.app_context():
+            name = Photo.query.filter_by(property_id=property_id).one().file_path
+        before = self.client.get('/metrics/file-cache').get_json()
+        
+        for _ in range(3):
+            response = self.client.get(f'/uploads/{name}')
+            self.assertEqual(response.data, cover)
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            response.close()
+        stats = self.client.get('/metrics/file-cache').get_json()
+        self.assertEqual(stats['admitted'] - before['admitted'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertGreaterEqual(stats['bytes'], len(cover))
+        
+        large = f'{uuid.uuid4()}_large.jpg'
+        self.write_upload(large, b'x' * (property_app.HOT_CACHE_MAX_FILE + 1))
+        for _ in range(3):
+            self.client.get(f'/uploads/{large}').close()
+        self.assertEqual(self.client.get('/metrics/file-cache').get_json()['bypassed'] - stats['bypassed'], 2)
+        
+        self.client.delete(f'/properties/{property_id}', headers=headers)
+        self.assertEqual(self.client.get(f'/uploads/{name}').status_code, 404)
+    
+    @unittest.skipUnless(thumbnails.Image, "Pillow is not installed")
+    def test_photo_variants_rendered(self):
+        """Test that rendered thumbnails are served instead of the original"""
+        original = io.BytesIO()
+        thumbnails.Image.new('RGB', (2400, 1600), (200, 120, 40)).save(original, 'PNG')
+        self.write_upload('rendered_variant.png', original.getvalue())
+        thumbnails.render_variants(app.config['UPLOAD_FOLDER'], 'rendered_variant.png')
+        
+        response = self.client.get('/uploads/rendered_variant.png?size=thumb', headers={'Accept': 'image/webp,*/*'})
+        self.assertLess(len(response.data), len(original.getvalue()))
+        with thumbnails.Image.open(io.BytesIO(response.data)) as thumb:
+            self.assertEqual(max(thumb.size), thumbnails.VARIANT_SIZES['thumb'])
+        response.close()
+        response = self.client.get('/uploads/rendered_variant.png?size=thumb', headers={'Accept': 'image/jpeg'})
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        response.close()
+    
+    def test_backfill_skips_staged_and_foreign_files(self):
+        """Test that backfill only picks up image originals, not temp uploads or other files"""
+        with tempfile.TemporaryDirectory() as folder:
+            for name in ('a.jpg', 'b.PNG', f'.{uuid.uuid4().hex}.upload', 'notes.txt', 'README'):
+                with open(os.path.join(folder, name), 'wb') as f:
+                    f.write(b'x')
+            os.makedirs(os.path.join(folder, thumbnails.VARIANTS_DIR, 'c.gif'))
+            self.assertEqual(thumbnails.originals(folder), ['a.jpg', 'b.PNG'])
+    
     def test_property_model_to_dict(self):
         """Test Property model to_dict method"""
         with app.app_context():
@@ -1,13 +1,202 @@
+from collections import OrderedDict
 from flask import Flask, request, jsonify
+from background import start_on_first_request
+from index_snapshot import load_snapshot, read_header, write_snapshot
+from rwlock import ReadWriteLock
+from search_index import SearchIndex, normalize, tokenize
+from sharded import ShardedIndex
 import os
 import requests
+import threading
+import time
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret-key")
 PROPERTY_SERVICE_URL = os.environ.get("PROPERTY_SERVICE_URL", "http://localhost:5002")
+# How often the property change feed is polled (seconds, 0 disables the poller)
+FEED_POLL_INTERVAL = float(os.environ.get("FEED_POLL_INTERVAL", 2))
+# Changes requested per /changes call
+FEED_BATCH_SIZE = 500
+# Memory-mapped index snapshot shared by workers, rewritten at most every SNAPSHOT_INTERVAL
+# seconds once the feed moved on (0 disables writing, newer snapshots are still loaded)
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "search_index.snap")
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 60))
+# Results per /search response unless ?limit= is given, and its upper bound
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+# Range filter query parameter for each numeric field
+RANGE_PARAMS = {"price_eur": "price", "area_m2": "area", "rooms": "rooms"}
+# Upper bound of ?limit= on /autocomplete (the trie keeps this many per prefix)
+MAX_SUGGESTIONS = 10
+# Ranked /search results kept per normalized query (0 disables the cache)
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1024))
+# Index partitions served by worker processes (1 keeps the index in this process).
+# Sharded indexes live in the workers, so snapshots are neither written nor loaded.
+SEARCH_SHARDS = int(os.environ.get("SEARCH_SHARDS", 1))
+
+
+def make_index():
+    return ShardedIndex(SEARCH_SHARDS) if SEARCH_SHARDS > 1 else SearchIndex()
+
+
+# In-memory inverted index over property documents, kept current from the change feed.
+# Searches hold the read side while they use it; feed updates and swaps hold the write side.
+# Built on first use, so importing the app (the debug reloader's parent) starts no shard workers.
+_INDEX = None
+_INDEX_LOCK = ReadWriteLock()
+_INDEX_INIT_LOCK = threading.Lock()
+_FEED_STATE = {"seq": 0, "polled_at": 0.0, "applied": 0, "errors": 0}
+_SNAPSHOT_STATE = {"seq": -1, "mtime": 0.0, "written_at": 0.0}
+
+# Query results by (index generation, normalized query): (total, page docs, facets), LRU order.
+# Any index change bumps the generation, so stale entries are never hit and age out.
+_QUERY_CACHE = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def current_index():
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_INIT_LOCK:
+            if _INDEX is None:
+                _INDEX = make_index()
+    return _INDEX
+
+
+def fetch_changes(since: int, timeout: float = 5):
+    """One batch of the property-service change feed"""
+    resp = requests.get(
+        f"{PROPERTY_SERVICE_URL}/changes",
+        params={"since": since, "limit": FEED_BATCH_SIZE},
+        timeout=timeout,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def apply_changes(index, changes: list):
+    index.apply_changes(changes)
+
+
+def poll_changes():
+    """Apply every change after the last seen sequence number, returns how many"""
+    applied = 0
+    while True:
+        feed = fetch_changes(_FEED_STATE["seq"])
+        with _INDEX_LOCK.write():
+            apply_changes(current_index(), feed["changes"])
+            _FEED_STATE["seq"] = feed["seq"]
+        applied += len(feed["changes"])
+        if not feed["has_more"]:
+            break
+    _FEED_STATE["applied"] += applied
+    _FEED_STATE["polled_at"] = time.time()
+    return applied
+
+
+def query_key(generation: int, q: str, city: str, property_type: str, ranges: dict, limit: int, offset: int,
+              with_facets: bool) -> tuple:
+    return (
+        generation, tuple(tokenize(q)), tuple(tokenize(city)), normalize(property_type),
+        tuple(sorted(ranges.items())), limit, offset, with_facets,
+    )
+
+
+def cached_query(key: tuple):
+    with _QUERY_CACHE_LOCK:
+        entry = _QUERY_CACHE.get(key)
+        if entry is None:
+            _CACHE_STATS["misses"] += 1
+            return None
+        _QUERY_CACHE.move_to_end(key)
+        _CACHE_STATS["hits"] += 1
+        return entry
+
+
+def cache_query(key: tuple, entry: tuple):
+    if QUERY_CACHE_SIZE <= 0:
+        return
+    with _QUERY_CACHE_LOCK:
+        _QUERY_CACHE[key] = entry
+        _QUERY_CACHE.move_to_end(key)
+        while len(_QUERY_CACHE) > QUERY_CACHE_SIZE:
+            _QUERY_CACHE.popitem(last=False)
+            _CACHE_STATS["evictions"] += 1
+
+
+def reload_snapshot():
+    """Swap in the snapshot on disk if it is newer than the last one loaded or written"""
+    global _INDEX
+    if SEARCH_SHARDS > 1:
+        return False
+    try:
+        mtime = os.stat(SNAPSHOT_PATH).st_mtime
+    except FileNotFoundError:
+        return False
+    if mtime == _SNAPSHOT_STATE["mtime"]:
+        return False
+    _SNAPSHOT_STATE["mtime"] = mtime
+    if read_header(SNAPSHOT_PATH)["seq"] <= _SNAPSHOT_STATE["seq"]:
+        return False
+    index, seq = load_snapshot(SNAPSHOT_PATH)
+    index.warm()
+    with _INDEX_LOCK.write():
+        # The next poll replays the feed from the snapshot position
+        _INDEX = index
+        _FEED_STATE["seq"] = seq
+    _SNAPSHOT_STATE["seq"] = seq
+    return True
+
+
+def save_snapshot():
+    """Write a snapshot once the feed has moved past the last one"""
+    if SEARCH_SHARDS > 1 or SNAPSHOT_INTERVAL <= 0 or time.time() - _SNAPSHOT_STATE["written_at"] < SNAPSHOT_INTERVAL:
+        return False
+    with _INDEX_LOCK.read():
+        index, seq = current_index(), _FEED_STATE["seq"]
+    if seq <= _SNAPSHOT_STATE["seq"]:
+        return False
+    # Only the poller thread mutates the index, so it can be written outside the lock
+    write_snapshot(index, SNAPSHOT_PATH, seq)
+    _SNAPSHOT_STATE.update(seq=seq, mtime=os.stat(SNAPSHOT_PATH).st_mtime, written_at=time.time())
+    return True
+
+
+def run_poller():
+    while True:
+        try:
+            reload_snapshot()
+        except Exception as e:
+            print(f"Snapshot reload failed: {e}")
+        try:
+            poll_changes()
+        except Exception as e:
+            _FEED_STATE["errors"] += 1
+            print(f"Change feed poll failed: {e}")
+        try:
+            save_snapshot()
+        except Exception as e:
+            print(f"Snapshot write failed: {e}")
+        time.sleep(FEED_POLL_INTERVAL)
+
+
+def start_poller():
+    if FEED_POLL_INTERVAL > 0:
+        threading.Thread(target=run_poller, name="change-feed-poller", daemon=True).start()
+
+
+def start_index_updates():
+    """Serve from the snapshot on disk right away, then follow the change feed"""
+    try:
+        reload_snapshot()
+    except Exception as e:
+        print(f"Snapshot load failed: {e}")
+    start_poller()
+
+
+start_on_first_request(app, start_index_updates)
 
-# Simple in-memory index
-_INDEX = []
 
 @app.route("/health", methods=["GET"])
 def health():
@@ -15,46 +204,98 @@ def health():
 
 @app.route("/index", methods=["POST"])
 def rebuild_index():
-    """Rebuild index by fetching properties from property-service"""
+    """Rebuild the index by replaying the change feed from the beginning"""
+    global _INDEX
+    index = None
     try:
-        resp = requests.get(f"{PROPERTY_SERVICE_URL}/properties", timeout=10)
-        if resp.status_code != 200:
-            return jsonify({"error": "Failed to fetch properties"}), 502
-        props = resp.json()
-        global _INDEX
-        _INDEX = props
-        return jsonify({"count": len(_INDEX)}), 201
+        index = make_index()
+        seq, has_more = 0, True
+        while has_more:
+            feed = fetch_changes(seq, timeout=10)
+            apply_changes(index, feed["changes"])
+            seq, has_more = feed["seq"], feed["has_more"]
+        index.warm()
+        with _INDEX_LOCK.write():
+            # Changes after seq are picked up by the next poll
+            index, _INDEX = _INDEX, index
+            _FEED_STATE["seq"] = seq
+        return jsonify({"count": len(_INDEX), "seq": seq}), 201
+    except requests.RequestException as e:
+        return jsonify({"error": f"Failed to fetch changes: {e}"}), 502
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    finally:
+        # The replaced index, or the half-built one after a failure
+        if isinstance(index, ShardedIndex):
+            index.close()
+
+@app.route("/index/status", methods=["GET"])
+def index_status():
+    """Index size and change feed position"""
+    polled_at = _FEED_STATE["polled_at"]
+    return jsonify({
+        "count": len(current_index()),
+        "seq": _FEED_STATE["seq"],
+        "applied": _FEED_STATE["applied"],
+        "errors": _FEED_STATE["errors"],
+        "last_poll_age_s": round(time.time() - polled_at, 1) if polled_at else None,
+        "snapshot_seq": max(_SNAPSHOT_STATE["seq"], 0),
+    }), 200
+
+@app.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    """Query result cache counters"""
+    with _QUERY_CACHE_LOCK:
+        stats = dict(_CACHE_STATS, size=len(_QUERY_CACHE), capacity=QUERY_CACHE_SIZE)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return jsonify(stats), 200
 
 @app.route("/search", methods=["GET"])
 def search():
-    q = request.args.get("q", "").lower().strip()
-    city = request.args.get("city", "").lower().strip()
-    property_type = request.args.get("property_type", "").lower().strip()
+    q = request.args.get("q", "").strip()
+    city = request.args.get("city", "").strip()
+    property_type = request.args.get("property_type", "").strip()
 
-    # If index empty, try to fetch
-    global _INDEX
-    if not _INDEX:
-        try:
-            r = requests.get(f"{PROPERTY_SERVICE_URL}/properties", timeout=5)
-            if r.status_code == 200:
-                _INDEX = r.json()
-        except:
-            pass
-
-    results = []
-    for p in _INDEX:
-        text = " ".join([str(p.get(k, "")).lower() for k in ("title", "description", "city", "address")])
-        if q and q not in text:
-            continue
-        if city and city not in (p.get("city", "").lower()):
-            continue
-        if property_type and property_type != (p.get("property_type", "").lower()):
-            continue
-        results.append(p)
-
-    return jsonify(results), 200
+    # Range filters: ?min_price=&max_price=, ?min_area=&max_area=, ?rooms= or ?min_rooms=&max_rooms=
+    ranges = {}
+    for field, param in RANGE_PARAMS.items():
+        exact = request.args.get(param, type=float)
+        low = request.args.get(f"min_{param}", exact, type=float)
+        high = request.args.get(f"max_{param}", exact, type=float)
+        if low is not None or high is not None:
+            ranges[field] = (low, high)
+    with_facets = request.args.get("facets", "").lower() in ("1", "true", "yes")
+
+    limit = min(max(request.args.get("limit", DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    # Concurrent searches share the read side; only a feed update or swap waits for them
+    with _INDEX_LOCK.read():
+        index = current_index()
+        key = query_key(index.generation, q, city, property_type, ranges, limit, offset, with_facets)
+        entry = cached_query(key)
+        if entry is None:
+            total, hits, facets = index.query(q, city, property_type, ranges, limit, offset, with_facets)
+            entry = (total, [doc for _, _, doc in hits], facets)
+            cache_query(key, entry)
+    total, results, facets = entry
+
+    # Plain list unless facets are requested, for existing clients
+    if with_facets:
+        response = jsonify({"results": results, "total": total, "facets": facets})
+    else:
+        response = jsonify(results)
+    response.headers["X-Total-Count"] = str(total)
+    return response, 200
+
+@app.route("/autocomplete", methods=["GET"])
+def autocomplete():
+    """Suggestions for the word being typed: cities and catalog words"""
+    q = request.args.get("q", "").strip()
+    limit = min(max(request.args.get("limit", 10, type=int), 1), MAX_SUGGESTIONS)
+    with _INDEX_LOCK.read():
+        suggestions = current_index().autocomplete(q, limit)
+    return jsonify(suggestions), 200
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5005))
@@ -0,0 +1,106 @@
+"""
+Benchmark: inverted index vs. the old linear scan on synthetic listings,
+plus the cost of BM25 top-20 ranking and facet counts on top of the match
+and of autocomplete lookups
+
+Usage:
+    python benchmark_search.py                 # 10k, 100k and 1M listings
+    python benchmark_search.py 10000 50000     # custom sizes
+"""
+import random
+import sys
+import time
+
+from search_index import SearchIndex
+
+CITIES = ["Кишинёв", "Бельцы", "Тирасполь", "Бендеры", "Кагул", "Унгены", "Сороки", "Орхей", "Комрат", "Chișinău"]
+STREETS = ["Штефан чел Маре", "Пушкина", "Дачия", "Траян", "Мира", "Измаил", "Bulevardul Dacia", "Strada Columna"]
+TYPES = ["apartment", "house", "land", "commercial"]
+TITLE_WORDS = ["Квартира", "Дом", "Участок", "Офис", "Студия", "Пентхаус", "Коттедж", "Склад", "Магазин"]
+DESCRIPTION_WORDS = [
+    "уютная", "светлая", "ремонт", "центр", "парк", "школа", "балкон", "паркинг", "новострой",
+    "вид", "тихий", "двор", "метро", "рынок", "lift", "renovated", "garden", "terrace",
+]
+
+QUERIES = [
+    {"q": "пентхаус паркинг"},
+    {"q": "квартира", "city": "Кишинёв"},
+    {"city": "Бельцы", "property_type": "house"},
+    {"q": "garden"},
+    {"property_type": "apartment", "ranges": {"price_eur": (50_000, 150_000)}},
+]
+
+
+def make_listings(count: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    listings = []
+    for i in range(1, count + 1):
+        listings.append({
+            "id": i,
+            "title": f"{rnd.choice(TITLE_WORDS)} {rnd.randint(20, 300)} м²",
+            "description": " ".join(rnd.sample(DESCRIPTION_WORDS, 5)),
+            "city": rnd.choice(CITIES),
+            "address": f"ул. {rnd.choice(STREETS)}, {rnd.randint(1, 200)}",
+            "property_type": rnd.choice(TYPES),
+            "price_eur": rnd.randint(10, 500) * 1000,
+        })
+    return listings
+
+
+def linear_search(index: list, q: str = "", city: str = "", property_type: str = "", ranges: dict = None) -> list:
+    """The scan search-service used before the inverted index"""
+    q, city, property_type = q.lower(), city.lower(), property_type.lower()
+    results = []
+    for p in index:
+        text = " ".join([str(p.get(k, "")).lower() for k in ("title", "description", "city", "address")])
+        if q and q not in text:
+            continue
+        if city and city not in (p.get("city", "").lower()):
+            continue
+        if property_type and property_type != (p.get("property_type", "").lower()):
+            continue
+        if any(not (low <= p.get(field, 0) <= high) for field, (low, high) in (ranges or {}).items()):
+            continue
+        results.append(p)
+    return results
+
+
+def timed(fn, repeat: int) -> float:
+    """Average milliseconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def run(size: int):
+    listings = make_listings(size)
+    start = time.perf_counter()
+    index = SearchIndex()
+    index.build(listings)
+    build_s = time.perf_counter() - start
+    print(f"\n{size:,} listings (index build {build_s:.1f}s)")
+    print(f"{'query':<55}{'hits':>8}{'scan ms':>12}{'index ms':>12}{'speedup':>10}{'top-20 ms':>12}{'facets ms':>12}")
+
+    repeat = max(1, 200_000 // size)
+    for query in QUERIES:
+        hits = len(index.match(**query))
+        scan_ms = timed(lambda: linear_search(listings, **query), repeat)
+        index_ms = timed(lambda: index.match(**query), repeat * 10)
+        rank_ms = timed(lambda: index.rank(limit=20, **query), repeat)
+        facets_ms = timed(lambda: index.facet_counts(index.match(**query)), repeat)
+        label = ", ".join(f"{k}={v}" for k, v in query.items())
+        print(f"{label:<55}{hits:>8}{scan_ms:>12.2f}{index_ms:>12.3f}{scan_ms / index_ms:>9.0f}x{rank_ms:>12.2f}{facets_ms:>12.2f}")
+
+    start = time.perf_counter()
+    index.warm()
+    warm_ms = (time.perf_counter() - start) * 1000
+    prefixes = ["к", "киш", "chis", "бел", "str"]
+    autocomplete_ms = timed(lambda: [index.autocomplete(prefix) for prefix in prefixes], 100) / len(prefixes)
+    print(f"autocomplete: {autocomplete_ms:.3f} ms per prefix (trie build {warm_ms:.0f} ms)")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        run(size)
@@ -0,0 +1,69 @@
+"""
+Benchmark: query throughput of the sharded index against the shard count.
+
+Every client thread sends the benchmark queries in a loop for a fixed time;
+with one shard all scoring runs on one core, with N shards each query is
+split across N worker processes.
+
+Usage:
+    python benchmark_shards.py                   # 1M listings, 1..cpu_count shards
+    python benchmark_shards.py 100000 1 2 4      # custom size and shard counts
+"""
+import os
+import sys
+import threading
+import time
+
+from benchmark_search import QUERIES, make_listings
+from search_index import SearchIndex
+from sharded import ShardedIndex
+
+DURATION_S = 5
+CLIENTS = 4
+TOP_K = 20
+
+
+def throughput(index, duration: float = DURATION_S, clients: int = CLIENTS):
+    """Queries per second with concurrent clients, and the mean latency in ms"""
+    counts = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(slot):
+        i = slot
+        while time.perf_counter() < deadline:
+            index.query(limit=TOP_K, **QUERIES[i % len(QUERIES)])
+            i += 1
+            counts[slot] += 1
+
+    threads = [threading.Thread(target=client, args=(slot,)) for slot in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done = sum(counts)
+    return done / duration, duration * 1000 * clients / max(done, 1)
+
+
+def run(size: int, shard_counts: list):
+    listings = make_listings(size)
+    print(f"\n{size:,} listings, {CLIENTS} clients, {os.cpu_count()} CPUs")
+    print(f"{'shards':>8}{'build s':>10}{'qps':>10}{'ms/query':>10}{'scaling':>10}")
+    baseline = None
+    for shards in shard_counts:
+        start = time.perf_counter()
+        index = ShardedIndex(shards) if shards > 1 else SearchIndex()
+        index.build(listings)
+        build_s = time.perf_counter() - start
+        try:
+            qps, latency_ms = throughput(index)
+        finally:
+            if shards > 1:
+                index.close()
+        baseline = baseline or qps
+        print(f"{shards:>8}{build_s:>10.1f}{qps:>10.1f}{latency_ms:>10.2f}{qps / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    shard_counts = [int(arg) for arg in sys.argv[2:]] or list(range(1, (os.cpu_count() or 1) + 1))
+    run(size, shard_counts)
@@ -0,0 +1,181 @@
+"""Transliteration folding, trigram fuzzy matching and the autocomplete trie"""
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+import heapq
+
+# Russian -> Latin, applied after normalize() (so ё is already е)
+_CYRILLIC = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "j", "з": "z", "и": "i",
+    "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s",
+    "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "iu", "я": "ia",
+}
+_TRANSLIT = str.maketrans(_CYRILLIC)
+# Spelling variants folded together: Romanian ch/gh = k/g, c = k, sh = s, ts = t ...
+_FOLDS = (("sh", "s"), ("ch", "k"), ("gh", "g"), ("ts", "t"), ("ph", "f"), ("c", "k"),
+          ("q", "k"), ("x", "ks"), ("w", "v"), ("y", "i"))
+# Place names whose Romanian and Russian forms differ beyond transliteration
+ALIASES = {"kisinau": "kisinev", "balti": "belti", "kahul": "kagul", "tighina": "bender", "benderi": "bender"}
+
+FUZZY_THRESHOLD = 0.55  # minimum Dice similarity of padded trigrams
+FUZZY_EXPANSIONS = 5  # most similar vocabulary keys a misspelled token expands to
+SUGGESTIONS_PER_NODE = 10
+
+
+def fold(token: str) -> str:
+    """Latin spelling key of a normalized token, shared by Cyrillic and Romanian forms"""
+    key = token.translate(_TRANSLIT)
+    for variant, replacement in _FOLDS:
+        key = key.replace(variant, replacement)
+    # Collapse doubled letters: "Bendery"/"Бендеры", "Кишинэв"/"Kishinnev"
+    key = "".join(ch for i, ch in enumerate(key) if i == 0 or ch != key[i - 1])
+    return ALIASES.get(key, key)
+
+
+def trigrams(key: str) -> set:
+    padded = f"${key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyVocabulary:
+    """Folded view of the token vocabulary: folded-prefix lookups and trigram similarity"""
+
+    def __init__(self):
+        self.keys = []  # sorted (folded key, token)
+        self.tokens = defaultdict(set)  # folded key -> tokens
+        self.trigrams = defaultdict(set)  # trigram -> folded keys
+
+    @classmethod
+    def from_tokens(cls, tokens) -> "FuzzyVocabulary":
+        """Bulk build, sorting once instead of inserting token by token"""
+        vocabulary = cls()
+        for token in tokens:
+            key = fold(token)
+            if not vocabulary.tokens[key]:
+                for gram in trigrams(key):
+                    vocabulary.trigrams[gram].add(key)
+            vocabulary.tokens[key].add(token)
+        vocabulary.keys = sorted((key, token) for key, tokens in vocabulary.tokens.items() for token in tokens)
+        return vocabulary
+
+    def add(self, token: str):
+        key = fold(token)
+        tokens = self.tokens[key]
+        if token in tokens:
+            return
+        if not tokens:
+            for gram in trigrams(key):
+                self.trigrams[gram].add(key)
+        tokens.add(token)
+        insort(self.keys, (key, token))
+
+    def discard(self, token: str):
+        key = fold(token)
+        tokens = self.tokens.get(key)
+        if not tokens or token not in tokens:
+            return
+        tokens.discard(token)
+        pos = bisect_left(self.keys, (key, token))
+        del self.keys[pos]
+        if not tokens:
+            del self.tokens[key]
+            for gram in trigrams(key):
+                keys = self.trigrams[gram]
+                keys.discard(key)
+                if not keys:
+                    del self.trigrams[gram]
+
+    def exact(self, token: str) -> list:
+        """Tokens with the same folded form as the query token ("kishinev" -> "кишинев")"""
+        return list(self.tokens.get(fold(token), ()))
+
+    def prefix(self, token: str) -> list:
+        """Tokens whose folded form starts with the folded query token"""
+        key = fold(token)
+        matched = []
+        pos = bisect_left(self.keys, (key, ""))
+        while pos < len(self.keys) and self.keys[pos][0].startswith(key):
+            matched.append(self.keys[pos][1])
+            pos += 1
+        return matched
+
+    def similar(self, token: str) -> dict:
+        """Tokens spelled like the query token, with their trigram similarity"""
+        key = fold(token)
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.trigrams.get(gram, ()))
+        scored = []
+        for candidate, common in shared.items():
+            similarity = 2 * common / (len(grams) + len(trigrams(candidate)))
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((similarity, candidate))
+        matched = {}
+        for similarity, candidate in heapq.nlargest(FUZZY_EXPANSIONS, scored):
+            for match in self.tokens[candidate]:
+                matched[match] = similarity
+        return matched
+
+
+class _Node:
+    __slots__ = ("children", "entries", "best")
+
+    def __init__(self):
+        self.children = {}
+        self.entries = {}  # (text, kind) -> weight of suggestions ending here
+        self.best = None  # cached top suggestions of the subtree, None when stale
+
+
+class SuggestionTrie:
+    """Prefix trie of weighted suggestions; every node caches its subtree's top entries.
+
+    An update only invalidates the nodes on its own path, so after the first
+    lookup a prefix is answered from the cache of a single node.
+    """
+
+    def __init__(self, size: int = SUGGESTIONS_PER_NODE):
+        self.root = _Node()
+        self.size = size
+
+    def set(self, key: str, text: str, kind: str, weight: int):
+        """Insert, reweight or (weight 0) remove a suggestion under key"""
+        path = [self.root]
+        node = self.root
+        for ch in key:
+            child = node.children.get(ch)
+            if child is None:
+                if weight <= 0:
+                    return
+                child = node.children[ch] = _Node()
+            node = child
+            path.append(node)
+        if weight > 0:
+            node.entries[(text, kind)] = weight
+        else:
+            node.entries.pop((text, kind), None)
+        for node in path:
+            node.best = None
+        # Drop branches left without suggestions
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.entries or node.children:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+
+    def _best(self, node: _Node) -> list:
+        if node.best is None:
+            candidates = [(weight, text, kind) for (text, kind), weight in node.entries.items()]
+            for child in node.children.values():
+                candidates.extend(self._best(child))
+            node.best = heapq.nlargest(self.size, candidates)
+        return node.best
+
+    def top(self, prefix: str) -> list:
+        """(weight, text, kind) of the best suggestions under prefix"""
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return self._best(node)
@@ -0,0 +1,344 @@
+"""On-disk snapshots of SearchIndex that workers memory-map read-only.
+
+Layout (native byte order, every section 8-byte aligned)::
+
+    header     magic, version, feed seq, counts, field length totals,
+               offsets of the sections below
+    docs       sorted doc ids (u32), JSON offsets (u64), field lengths (3 x u32),
+               JSON blob
+    terms      "field\\0token" keys: offsets (u64) + blob,
+               postings offsets (u64) + doc ids (u32)
+    tokens     ranked-field tokens: offsets (u64) + blob,
+               postings offsets (u64) + doc ids (u32) + per-field counts (3 x u32)
+    facets     "facet\0value" keys: offsets (u64) + blob, bitset offsets (u64) + bitsets
+    columns    per range field: sorted values (f64) + doc ids (u32)
+
+A loaded index reads documents and postings straight from the mapping and
+only copies what a query or a feed update touches, so every worker shares
+the same page cache instead of holding its own copy of the catalog.
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+import json
+import mmap
+import os
+import struct
+
+from search_index import FIELD_WEIGHTS, RANGE_FIELDS, Bitset, SearchIndex
+
+MAGIC = b"PSIX"
+VERSION = 2
+FIELDS = len(FIELD_WEIGHTS)
+SECTIONS = (
+    "doc_ids", "doc_offsets", "doc_lengths", "doc_blob",
+    "term_key_offsets", "term_key_blob", "term_offsets", "term_ids",
+    "token_key_offsets", "token_key_blob", "token_offsets", "token_ids", "token_counts",
+    "facet_key_offsets", "facet_key_blob", "facet_offsets", "facet_bits",
+) + tuple(f"{field}_{part}" for field in RANGE_FIELDS for part in ("values", "ids"))
+HEADER = struct.Struct(f"=4sIQIII{FIELDS}Q{len(SECTIONS) * 2}Q")
+
+
+def term_key(term: tuple) -> bytes:
+    """Encode a (field, token) term; byte order matches tuple order"""
+    return f"{term[0]}\0{term[1]}".encode()
+
+
+def token_key(token: str) -> bytes:
+    return token.encode()
+
+
+class _Blobs:
+    """Sequence view of variable-length byte strings, usable with bisect"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+
+class MappedPostings(dict):
+    """Postings table that loads entries from the snapshot on first access.
+
+    Loaded or newly added entries live in the dict itself; deleted keys are
+    remembered so they are not read back from the snapshot.
+    """
+
+    def __init__(self, keys: _Blobs, encode, load, size, factory):
+        super().__init__()
+        self._keys = keys
+        self._encode = encode
+        self._load = load
+        self._size = size
+        self._factory = factory
+        self._dropped = set()
+
+    def _position(self, key):
+        if key in self._dropped:
+            return None
+        raw = self._encode(key)
+        i = bisect_left(self._keys, raw)
+        if i < len(self._keys) and self._keys[i] == raw:
+            return i
+        return None
+
+    def _lookup(self, key):
+        i = self._position(key)
+        if i is None:
+            return None
+        value = self._load(i)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __missing__(self, key):
+        value = self._lookup(key)
+        if value is None:
+            value = self._factory()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        value = self._lookup(key)
+        return default if value is None else value
+
+    def peek(self, key, default=None):
+        """Like get, but an entry read from the snapshot is not kept in memory"""
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        i = self._position(key)
+        return default if i is None else self._load(i)
+
+    def __delitem__(self, key):
+        dict.pop(self, key, None)
+        self._dropped.add(key)
+
+    def size(self, key) -> int:
+        """Entry length, read from the offsets when it was not loaded yet"""
+        if dict.__contains__(self, key):
+            return len(dict.__getitem__(self, key))
+        i = self._position(key)
+        return 0 if i is None else self._size(i)
+
+
+class MappedMapping(MutableMapping):
+    """Doc id -> value mapping over the snapshot with an in-memory overlay"""
+
+    def __init__(self, ids, load):
+        self._ids = ids
+        self._load = load
+        self._overlay = {}
+        self._hidden = set()  # snapshot ids that were removed or replaced
+
+    def _position(self, key):
+        i = bisect_left(self._ids, key)
+        if i < len(self._ids) and self._ids[i] == key:
+            return i
+        return None
+
+    def __contains__(self, key):
+        if key in self._overlay:
+            return True
+        return key not in self._hidden and self._position(key) is not None
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        if key not in self._hidden:
+            i = self._position(key)
+            if i is not None:
+                return self._load(i)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if self._position(key) is not None:
+            self._hidden.add(key)
+        self._overlay[key] = value
+
+    def __delitem__(self, key):
+        if key in self._overlay:
+            del self._overlay[key]
+        elif key in self._hidden or self._position(key) is None:
+            raise KeyError(key)
+        else:
+            self._hidden.add(key)
+
+    def __iter__(self):
+        for key in self._ids:
+            if key not in self._hidden:
+                yield key
+        yield from self._overlay
+
+    def __len__(self):
+        return len(self._ids) - len(self._hidden) + len(self._overlay)
+
+
+def peek(table: dict, key, default=None):
+    """Read a postings entry; a mapped table does not copy it out of the snapshot"""
+    if isinstance(table, MappedPostings):
+        return table.peek(key, default)
+    return table.get(key, default)
+
+
+def write_snapshot(index: SearchIndex, path: str, seq: int):
+    """Serialize the index next to path and atomically rename it into place.
+
+    A memory-mapped index is read without loading its postings into the
+    process, so re-snapshotting does not undo the shared mapping.
+    """
+    doc_ids = array("I", sorted(index.docs))
+    doc_offsets = array("Q", [0])
+    doc_lengths = array("I")
+    doc_blob = bytearray()
+    for doc_id in doc_ids:
+        doc_blob += json.dumps(index.docs[doc_id], ensure_ascii=False, separators=(",", ":")).encode()
+        doc_offsets.append(len(doc_blob))
+        doc_lengths.extend(index.field_lengths[doc_id])
+
+    term_key_offsets, term_key_blob = array("Q", [0]), bytearray()
+    term_offsets, term_ids = array("Q", [0]), array("I")
+    token_key_offsets, token_key_blob = array("Q", [0]), bytearray()
+    token_offsets, token_ids, token_counts = array("Q", [0]), array("I"), array("I")
+    for term in index.terms:
+        term_key_blob += term_key(term)
+        term_key_offsets.append(len(term_key_blob))
+        term_ids.extend(sorted(peek(index.postings, term, ())))
+        term_offsets.append(len(term_ids))
+        # Ranked-field tokens are a subset of the free-text terms, already sorted
+        field, token = term
+        postings = peek(index.field_postings, token) if field == "text" else None
+        if postings:
+            token_key_blob += token_key(token)
+            token_key_offsets.append(len(token_key_blob))
+            for doc_id in sorted(postings):
+                token_ids.append(doc_id)
+                token_counts.extend(postings[doc_id])
+            token_offsets.append(len(token_ids))
+
+    facet_key_offsets, facet_key_blob = array("Q", [0]), bytearray()
+    facet_offsets, facet_bits = array("Q", [0]), bytearray()
+    for key in sorted(index.facets):
+        facet_key_blob += term_key(key)
+        facet_key_offsets.append(len(facet_key_blob))
+        facet_bits += index.facets[key].data
+        facet_offsets.append(len(facet_bits))
+
+    sections = dict(zip(SECTIONS, (
+        doc_ids, doc_offsets, doc_lengths, doc_blob,
+        term_key_offsets, term_key_blob, term_offsets, term_ids,
+        token_key_offsets, token_key_blob, token_offsets, token_ids, token_counts,
+        facet_key_offsets, facet_key_blob, facet_offsets, facet_bits,
+    )))
+    for field, (values, ids) in index.columns.items():
+        sections[f"{field}_values"] = values
+        sections[f"{field}_ids"] = ids
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        layout = []
+        for name in SECTIONS:
+            f.write(b"\0" * (-f.tell() % 8))
+            data = bytes(sections[name])
+            layout += [f.tell(), len(data)]
+            f.write(data)
+        f.seek(0)
+        f.write(HEADER.pack(
+            MAGIC, VERSION, seq, len(doc_ids), len(term_offsets) - 1, len(token_offsets) - 1,
+            *index.field_length_total, *layout,
+        ))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_header(path: str) -> dict:
+    """Snapshot header fields, ValueError for a foreign or outdated file"""
+    with open(path, "rb") as f:
+        raw = f.read(HEADER.size)
+    if len(raw) < HEADER.size:
+        raise ValueError("Truncated snapshot")
+    values = HEADER.unpack(raw)
+    magic, version, seq, n_docs, n_terms, n_tokens = values[:6]
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unsupported snapshot format")
+    layout = values[6 + FIELDS:]
+    return {
+        "seq": seq,
+        "docs": n_docs,
+        "terms": n_terms,
+        "tokens": n_tokens,
+        "field_length_total": list(values[6:6 + FIELDS]),
+        "sections": {name: (layout[2 * i], layout[2 * i + 1]) for i, name in enumerate(SECTIONS)},
+    }
+
+
+def load_snapshot(path: str):
+    """Memory-map a snapshot, returns (index, feed seq)"""
+    header = read_header(path)
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+
+    def section(name, fmt=None):
+        offset, length = header["sections"][name]
+        data = view[offset:offset + length]
+        return data.cast(fmt) if fmt else data
+
+    doc_ids = section("doc_ids", "I")
+    doc_offsets = section("doc_offsets", "Q")
+    doc_lengths = section("doc_lengths", "I")
+    doc_blob = section("doc_blob")
+    term_keys = _Blobs(section("term_key_offsets", "Q"), section("term_key_blob"))
+    term_offsets = section("term_offsets", "Q")
+    term_ids = section("term_ids", "I")
+    token_keys = _Blobs(section("token_key_offsets", "Q"), section("token_key_blob"))
+    token_offsets = section("token_offsets", "Q")
+    token_ids = section("token_ids", "I")
+    token_counts = section("token_counts", "I")
+
+    def load_doc(i):
+        return json.loads(bytes(doc_blob[doc_offsets[i]:doc_offsets[i + 1]]))
+
+    def load_lengths(i):
+        return tuple(doc_lengths[i * FIELDS:(i + 1) * FIELDS])
+
+    def load_term(i):
+        return set(term_ids[term_offsets[i]:term_offsets[i + 1]])
+
+    def load_token(i):
+        start, end = token_offsets[i], token_offsets[i + 1]
+        return {
+            token_ids[j]: tuple(token_counts[j * FIELDS:(j + 1) * FIELDS])
+            for j in range(start, end)
+        }
+
+    index = SearchIndex()
+    index.docs = MappedMapping(doc_ids, load_doc)
+    index.field_lengths = MappedMapping(doc_ids, load_lengths)
+    index.postings = MappedPostings(term_keys, term_key, load_term, lambda i: term_offsets[i + 1] - term_offsets[i], set)
+    index.field_postings = MappedPostings(token_keys, token_key, load_token,
+                                          lambda i: token_offsets[i + 1] - token_offsets[i], dict)
+    index.terms = [tuple(term_keys[i].decode().split("\0", 1)) for i in range(len(term_keys))]
+    index.field_length_total = header["field_length_total"]
+
+    # Facets and columns are small and mutated in place, so they are copied out
+    facet_keys = _Blobs(section("facet_key_offsets", "Q"), section("facet_key_blob"))
+    facet_offsets = section("facet_offsets", "Q")
+    facet_bits = section("facet_bits")
+    index.facets = {
+        tuple(facet_keys[i].decode().split("\0", 1)):
+            Bitset(bytearray(facet_bits[facet_offsets[i]:facet_offsets[i + 1]]))
+        for i in range(len(facet_keys))
+    }
+    for field in RANGE_FIELDS:
+        values, ids = array("d"), array("I")
+        values.frombytes(section(f"{field}_values"))
+        ids.frombytes(section(f"{field}_ids"))
+        index.columns[field] = (values, ids)
+    return index, header["seq"]
@@ -0,0 +1,48 @@
+"""Reader/writer lock guarding the live search index.
+
+Searches only read the index and run side by side; the change feed poller
+mutates it in place and swaps in snapshots or rebuilds, which needs it
+alone. A waiting writer holds back new readers, so a steady stream of
+searches cannot starve the poller.
+"""
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
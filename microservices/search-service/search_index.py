@@ -0,0 +1,505 @@
+"""In-memory inverted index over property documents"""
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict
+import heapq
+import itertools
+import math
+import re
+import unicodedata
+
+from fuzzy import FuzzyVocabulary, SuggestionTrie, fold
+
+# Fields whose text is searched by the free-text query
+TEXT_FIELDS = ("title", "description", "city", "address")
+
+# BM25F: per-field weights of ranked fields and the usual k1/b parameters
+FIELD_WEIGHTS = {"title": 3.0, "address": 1.5, "description": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Numeric fields that support range filters, each kept as a sorted column
+RANGE_FIELDS = ("price_eur", "area_m2", "rooms")
+# Lower bounds of the price facet buckets, EUR
+PRICE_BUCKETS = (0, 25000, 50000, 100000, 200000, 500000)
+
+# Shortest query token that falls back to fuzzy matching, and shortest word suggested
+FUZZY_MIN_LENGTH = 4
+SUGGEST_MIN_LENGTH = 3
+# Shortest last query token matched as a prefix; shorter ones would union most of the postings
+PREFIX_MIN_LENGTH = 3
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Generations are unique across index instances, so a swapped-in index never reuses one
+_GENERATIONS = itertools.count(1)
+
+
+def normalize(text: str) -> str:
+    """Lowercase and fold Cyrillic/Latin variants (ё -> е, ș -> s, ă -> a)"""
+    decomposed = unicodedata.normalize("NFKD", str(text or "").lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def number(value):
+    try:
+        return float(value) if value is not None and value != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def price_bucket(price) -> str:
+    """Facet label of the price bucket, e.g. 50000-100000 or 500000+"""
+    price = number(price)
+    if price is None:
+        return None
+    i = max(bisect_right(PRICE_BUCKETS, price) - 1, 0)
+    if i + 1 < len(PRICE_BUCKETS):
+        return f"{PRICE_BUCKETS[i]}-{PRICE_BUCKETS[i + 1]}"
+    return f"{PRICE_BUCKETS[i]}+"
+
+
+def facet_values(doc: dict) -> list:
+    """(facet, value) pairs a document is counted under"""
+    values = []
+    city = str(doc.get("city") or "").strip()
+    if city:
+        values.append(("city", city))
+    if doc.get("property_type"):
+        values.append(("property_type", doc["property_type"]))
+    bucket = price_bucket(doc.get("price_eur"))
+    if bucket:
+        values.append(("price", bucket))
+    return values
+
+
+class Bitset:
+    """Mutable bitset over doc ids; its int form is cached for fast AND + popcount"""
+
+    __slots__ = ("data", "count", "_value")
+
+    def __init__(self, data: bytearray = None):
+        self.data = data if data is not None else bytearray()
+        self.count = int.from_bytes(self.data, "little").bit_count() if self.data else 0
+        self._value = None
+
+    @classmethod
+    def from_ids(cls, ids) -> "Bitset":
+        bits = cls()
+        for doc_id in ids:
+            bits.add(doc_id)
+        return bits
+
+    def __len__(self):
+        return self.count
+
+    def add(self, i: int):
+        byte, bit = i >> 3, 1 << (i & 7)
+        if byte >= len(self.data):
+            self.data.extend(bytes(byte + 1 - len(self.data)))
+        if not self.data[byte] & bit:
+            self.data[byte] |= bit
+            self.count += 1
+            self._value = None
+
+    def discard(self, i: int):
+        byte, bit = i >> 3, 1 << (i & 7)
+        if byte < len(self.data) and self.data[byte] & bit:
+            self.data[byte] &= ~bit & 0xFF
+            self.count -= 1
+            self._value = None
+
+    def value(self) -> int:
+        if self._value is None:
+            self._value = int.from_bytes(self.data, "little")
+        return self._value
+
+
+class SearchIndex:
+    """Postings lists per term plus a document store keyed by property id.
+
+    Terms are ``(field, token)`` pairs: free text lives under ``"text"``,
+    while the city and property type also get their own fields so that
+    filters are answered from the index instead of scanning documents.
+    """
+
+    def __init__(self):
+        self.generation = next(_GENERATIONS)  # changes on every add/remove
+        self.docs = {}
+        self.postings = defaultdict(set)
+        self.terms = []  # sorted (field, token) vocabulary for prefix lookups
+        # Ranked fields: token -> {doc id: per-field counts} and per-doc field lengths,
+        # both ordered like FIELD_WEIGHTS
+        self.field_postings = defaultdict(dict)
+        self.field_lengths = {}
+        self.field_length_total = [0] * len(FIELD_WEIGHTS)
+        # Facet bitsets by (facet, value) and sorted (values, ids) columns for range filters
+        self.facets = {}
+        self.columns = {field: (array("d"), array("I")) for field in RANGE_FIELDS}
+        self._column_rows = None
+        # Folded vocabulary and autocomplete trie, built on first use and kept up to date after
+        self._vocabulary = None
+        self._suggestions = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _doc_terms(self, doc: dict) -> set:
+        terms = set()
+        for field in TEXT_FIELDS:
+            terms.update(("text", t) for t in tokenize(doc.get(field, "")))
+        terms.update(("city", t) for t in tokenize(doc.get("city", "")))
+        property_type = normalize(doc.get("property_type", ""))
+        if property_type:
+            terms.add(("type", property_type))
+        return terms
+
+    def add(self, doc: dict):
+        """Index a property document, replacing an older version with the same id"""
+        doc_id = doc["id"]
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        self.generation = next(_GENERATIONS)
+        terms = self._doc_terms(doc)
+        for term in terms:
+            postings = self.postings[term]
+            if not postings:
+                insort(self.terms, term)
+                if term[0] == "text" and self._vocabulary is not None:
+                    self._vocabulary.add(term[1])
+            postings.add(doc_id)
+        self.docs[doc_id] = doc
+        field_tf = [Counter(tokenize(doc.get(field, ""))) for field in FIELD_WEIGHTS]
+        for token in set().union(*field_tf):
+            self.field_postings[token][doc_id] = tuple(tf[token] for tf in field_tf)
+        lengths = tuple(sum(tf.values()) for tf in field_tf)
+        self.field_lengths[doc_id] = lengths
+        self.field_length_total = [a + b for a, b in zip(self.field_length_total, lengths)]
+        for key in facet_values(doc):
+            bits = self.facets.get(key)
+            if bits is None:
+                bits = self.facets[key] = Bitset()
+            bits.add(doc_id)
+        if self._suggestions is not None:
+            self._update_suggestions(doc)
+        if self._column_rows is not None:
+            self._column_rows.append(doc)
+            return
+        for field, (values, ids) in self.columns.items():
+            value = number(doc.get(field))
+            if value is not None:
+                pos = bisect_right(values, value)
+                values.insert(pos, value)
+                ids.insert(pos, doc_id)
+
+    def remove(self, doc_id: int):
+        doc = self.docs.get(doc_id)
+        if doc is None:
+            return
+        self.generation = next(_GENERATIONS)
+        terms = self._doc_terms(doc)
+        for term in terms:
+            postings = self.postings[term]
+            postings.discard(doc_id)
+            if not postings:
+                del self.postings[term]
+                pos = bisect_left(self.terms, term)
+                if pos < len(self.terms) and self.terms[pos] == term:
+                    del self.terms[pos]
+                if term[0] == "text" and self._vocabulary is not None:
+                    self._vocabulary.discard(term[1])
+        for _, token in terms:
+            postings = self.field_postings.get(token)
+            if postings is not None and postings.pop(doc_id, None) is not None and not postings:
+                del self.field_postings[token]
+        lengths = self.field_lengths.pop(doc_id)
+        self.field_length_total = [a - b for a, b in zip(self.field_length_total, lengths)]
+        for key in facet_values(doc):
+            bits = self.facets.get(key)
+            if bits is not None:
+                bits.discard(doc_id)
+                if not bits:
+                    del self.facets[key]
+        for field, (values, ids) in self.columns.items():
+            value = number(doc.get(field))
+            if value is None:
+                continue
+            for pos in range(bisect_left(values, value), bisect_right(values, value)):
+                if ids[pos] == doc_id:
+                    del values[pos]
+                    del ids[pos]
+                    break
+        del self.docs[doc_id]
+        if self._suggestions is not None:
+            self._update_suggestions(doc)
+
+    def build(self, docs: list):
+        """Replace the whole index with the given documents"""
+        self.__init__()
+        # Columns are sorted once at the end instead of inserting row by row
+        self._column_rows = []
+        for doc in docs:
+            self.add(doc)
+        for field in RANGE_FIELDS:
+            rows = sorted(
+                (value, doc["id"]) for doc in self._column_rows
+                if (value := number(doc.get(field))) is not None
+            )
+            self.columns[field] = (array("d", [r[0] for r in rows]), array("I", [r[1] for r in rows]))
+        self._column_rows = None
+
+    def prefix_terms(self, field: str, prefix: str) -> list:
+        """Every term of a field starting with prefix, from the sorted vocabulary"""
+        matched = []
+        pos = bisect_left(self.terms, (field, prefix))
+        while pos < len(self.terms):
+            term = self.terms[pos]
+            if term[0] != field or not term[1].startswith(prefix):
+                break
+            matched.append(term)
+            pos += 1
+        return matched
+
+    def df(self, term: tuple) -> int:
+        """Number of documents containing a term, without loading mapped postings"""
+        size = getattr(self.postings, "size", None)
+        return size(term) if size else len(self.postings.get(term, ()))
+
+    def vocabulary(self) -> FuzzyVocabulary:
+        if self._vocabulary is None:
+            self._vocabulary = FuzzyVocabulary.from_tokens(
+                token for field, token in self.terms if field == "text"
+            )
+        return self._vocabulary
+
+    def expand(self, query_token: str, prefix: bool = False) -> dict:
+        """Vocabulary tokens a query token stands for, with their weight in scoring.
+
+        The same word in any script ("kishinev" -> "кишинев") counts fully.
+        With prefix, used for the last token the user may still be typing,
+        so do words starting with it, once it has PREFIX_MIN_LENGTH
+        characters. Only when nothing matches, the closest spellings by
+        trigram similarity are used, weighted by that similarity.
+        """
+        vocabulary = self.vocabulary()
+        if prefix and len(query_token) >= PREFIX_MIN_LENGTH:
+            expanded = {token: 1.0 for _, token in self.prefix_terms("text", query_token)}
+            for token in vocabulary.prefix(query_token):
+                expanded.setdefault(token, 1.0)
+        else:
+            expanded = dict.fromkeys(vocabulary.exact(query_token), 1.0)
+        if not expanded and len(query_token) >= FUZZY_MIN_LENGTH:
+            expanded = vocabulary.similar(query_token)
+        return expanded
+
+    def expand_text(self, text: str) -> list:
+        """Expansion of every token of a typed query; only the last one is a prefix"""
+        tokens = tokenize(text)
+        return [self.expand(token, prefix=i == len(tokens) - 1) for i, token in enumerate(tokens)]
+
+    def expanded_postings(self, field: str, expanded: dict) -> set:
+        """Union of postings of a field for every token of one expansion"""
+        matched = set()
+        for token in expanded:
+            postings = self.postings.get((field, token))
+            if postings:
+                matched |= postings
+        return matched
+
+    def _suggest(self, trie: SuggestionTrie, text: str, kind: str, weight: int):
+        keys = {normalize(text), " ".join(fold(token) for token in tokenize(text))}
+        for key in keys:
+            trie.set(key, text, kind, weight)
+
+    def _update_suggestions(self, doc: dict):
+        """Refresh the weights of the words and city of a document that changed"""
+        for _, token in self._doc_terms(doc):
+            if len(token) >= SUGGEST_MIN_LENGTH and not token.isdigit():
+                self._suggest(self._suggestions, token, "word", self.df(("text", token)))
+        for facet, value in facet_values(doc):
+            if facet == "city":
+                bits = self.facets.get((facet, value))
+                self._suggest(self._suggestions, value, "city", bits.count if bits else 0)
+
+    def suggestion_trie(self) -> SuggestionTrie:
+        if self._suggestions is None:
+            trie = SuggestionTrie()
+            for field, token in self.terms:
+                if field == "text" and len(token) >= SUGGEST_MIN_LENGTH and not token.isdigit():
+                    self._suggest(trie, token, "word", self.df((field, token)))
+            for (facet, value), bits in self.facets.items():
+                if facet == "city":
+                    self._suggest(trie, value, "city", bits.count)
+            self._suggestions = trie
+        return self._suggestions
+
+    def autocomplete(self, text: str, limit: int = 10) -> list:
+        """Suggestions completing the last word typed: matches as typed first, then
+        transliterated ones, each group by document count"""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        trie = self.suggestion_trie()
+        # (suggestion, kind) -> (weight, 0 if it matched as typed, 1 if only transliterated)
+        found = {}
+        for weight, suggestion, kind in trie.top(fold(tokens[-1])):
+            found[(suggestion, kind)] = (weight, 1)
+        for weight, suggestion, kind in trie.top(tokens[-1]):
+            found[(suggestion, kind)] = (weight, 0)
+        # A city also shows up as its lowercase word, keep only the city
+        cities = {normalize(suggestion) for suggestion, kind in found if kind == "city"}
+        ranked = sorted(
+            ((weight, folded, suggestion, kind) for (suggestion, kind), (weight, folded) in found.items()
+             if kind == "city" or suggestion not in cities),
+            key=lambda item: (item[1], -item[0], item[2]),
+        )
+        return [{"text": suggestion, "type": kind, "count": weight} for weight, _, suggestion, kind in ranked[:limit]]
+
+    def warm(self):
+        """Build the lazily created structures ahead of the first query"""
+        self.vocabulary()
+        self.suggestion_trie().top("")
+
+    def range_ids(self, field: str, low: float = None, high: float = None) -> set:
+        """Ids whose field lies within [low, high], either bound optional"""
+        values, ids = self.columns[field]
+        start = 0 if low is None else bisect_left(values, low)
+        end = len(values) if high is None else bisect_right(values, high)
+        return set(ids[start:end])
+
+    def match(self, q: str = "", city: str = "", property_type: str = "", ranges: dict = None,
+              expansions: list = None):
+        """Ids of documents matching every query term and filter, None when unconstrained.
+
+        ranges maps a RANGE_FIELDS name to a (low, high) pair; expansions is
+        expand_text(q) when the caller already has it.
+        """
+        candidates = []
+        for field, (low, high) in (ranges or {}).items():
+            if low is not None or high is not None:
+                candidates.append(self.range_ids(field, low, high))
+        for expanded in self.expand_text(q) if expansions is None else expansions:
+            candidates.append(self.expanded_postings("text", expanded))
+        for expanded in self.expand_text(city):
+            candidates.append(self.expanded_postings("city", expanded))
+        if property_type:
+            candidates.append(self.postings.get(("type", normalize(property_type)), set()))
+        if not candidates:
+            return None
+        # Intersect starting from the shortest list so work follows the result size
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for postings in candidates[1:]:
+            if not result:
+                break
+            result &= postings
+        return result
+
+    def idf(self, token: str) -> float:
+        df = self.df(("text", token))
+        n = len(self.docs)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def scores(self, expansions: list, ids: set) -> dict:
+        """BM25F scores of the given documents, accumulated term at a time.
+
+        A query token scores every indexed token it expands to (expand_text),
+        so a trailing "кварт" ranks documents mentioning "квартира" or "квартал".
+        """
+        n = len(self.docs) or 1
+        avg_lengths = [(total / n) or 1 for total in self.field_length_total]
+        weights = list(FIELD_WEIGHTS.values())
+        scores = dict.fromkeys(ids, 0.0)
+        norms = {}
+        for expanded in expansions:
+            for token, weight in expanded.items():
+                postings = self.field_postings.get(token)
+                if not postings:
+                    continue
+                idf = weight * self.idf(token)
+                for doc_id, counts in postings.items():
+                    if doc_id not in scores:
+                        continue
+                    norm = norms.get(doc_id)
+                    if norm is None:
+                        norm = norms[doc_id] = [
+                            w / (1 - BM25_B + BM25_B * length / avg)
+                            for w, length, avg in zip(weights, self.field_lengths[doc_id], avg_lengths)
+                        ]
+                    wtf = sum(c * k for c, k in zip(counts, norm) if c)
+                    scores[doc_id] += idf * wtf / (BM25_K1 + wtf)
+        return scores
+
+    def facet_counts(self, matched) -> dict:
+        """Counts per facet value within the matched ids (None means every document)"""
+        counts = {"city": {}, "property_type": {}, "price": {}}
+        if matched is None:
+            for (facet, value), bits in self.facets.items():
+                counts[facet][value] = bits.count
+        elif matched:
+            matched_bits = Bitset.from_ids(matched).value()
+            for (facet, value), bits in self.facets.items():
+                count = (matched_bits & bits.value()).bit_count()
+                if count:
+                    counts[facet][value] = count
+        return {
+            facet: dict(sorted(values.items(), key=lambda item: (-item[1], item[0])))
+            for facet, values in counts.items()
+        }
+
+    def rank(self, q: str = "", city: str = "", property_type: str = "", limit: int = None, offset: int = 0,
+             ranges: dict = None):
+        """Return (total matches, ids of the requested page) ordered by relevance"""
+        expansions = self.expand_text(q)
+        matched = self.match(q, city, property_type, ranges, expansions)
+        total, hits = self.scored(matched, q, limit, offset, expansions)
+        return total, [doc_id for _, doc_id in hits]
+
+    def top(self, matched, q: str = "", limit: int = None, offset: int = 0):
+        """Rank already matched ids, returns (total, ids of the requested page)"""
+        total, hits = self.scored(matched, q, limit, offset)
+        return total, [doc_id for _, doc_id in hits]
+
+    def scored(self, matched, q: str = "", limit: int = None, offset: int = 0, expansions: list = None):
+        """Returns (total, [(score, id)] of the requested page), best first.
+
+        Only offset + limit entries are kept in a heap, so a broad query
+        does not sort every match. Without free text every score is 0 and
+        newest ids come first.
+        """
+        ids = self.docs.keys() if matched is None else matched
+        total = len(ids)
+        wanted = total if limit is None else min(total, offset + limit)
+        if expansions is None:
+            expansions = self.expand_text(q)
+        if expansions:
+            scores = self.scores(expansions, ids)
+            hits = heapq.nlargest(wanted, ((score, doc_id) for doc_id, score in scores.items()))
+        else:
+            hits = [(0.0, doc_id) for doc_id in heapq.nlargest(wanted, ids)]
+        return total, hits[offset:]
+
+    def query(self, q: str = "", city: str = "", property_type: str = "", ranges: dict = None,
+              limit: int = None, offset: int = 0, with_facets: bool = False):
+        """Everything /search needs in one call: (total, [(score, id, doc)], facets or None)"""
+        expansions = self.expand_text(q)
+        matched = self.match(q, city, property_type, ranges, expansions)
+        total, hits = self.scored(matched, q, limit, offset, expansions)
+        facets = self.facet_counts(matched) if with_facets else None
+        return total, [(score, doc_id, self.docs[doc_id]) for score, doc_id in hits], facets
+
+    def apply_changes(self, changes: list):
+        """Apply a batch of property change feed entries"""
+        for change in changes:
+            if change["op"] == "delete":
+                self.remove(change["id"])
+            else:
+                self.add(change["property"])
+
+    def search(self, q: str = "", city: str = "", property_type: str = "", limit: int = None, offset: int = 0,
+               ranges: dict = None) -> list:
+        _, ids = self.rank(q, city, property_type, limit, offset, ranges)
+        return [self.docs[doc_id] for doc_id in ids]
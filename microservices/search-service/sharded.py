@@ -0,0 +1,160 @@
+"""Search index partitioned across worker processes.
+
+Documents are assigned to shards by ``id % shards``. Every shard is a
+SearchIndex living in its own process, so a query is scattered to all of
+them, scored on all cores at once and the per-shard top-k lists are merged.
+BM25 statistics (idf, average field lengths) are per shard, which with
+id-based partitioning differs from the global numbers only by sampling noise.
+"""
+from collections import Counter
+import heapq
+import multiprocessing
+import threading
+
+from search_index import _GENERATIONS, SearchIndex
+
+
+def _serve_shard(conn):
+    """Shard process loop: run SearchIndex methods sent over the pipe"""
+    index = SearchIndex()
+    while True:
+        method, args = conn.recv()
+        if method == "close":
+            break
+        try:
+            if method == "size":
+                result = len(index)
+            else:
+                result = getattr(index, method)(*args)
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+class ShardedIndex:
+    """Scatter/gather front for SearchIndex shards, one process per shard"""
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self.generation = next(_GENERATIONS)
+        self._locks = [threading.Lock() for _ in range(shards)]  # one request in flight per pipe
+        self._conns = []
+        self._processes = []
+        for i in range(shards):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_serve_shard, args=(child,), name=f"search-shard-{i}", daemon=True,
+            )
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+
+    def _scatter(self, calls: dict) -> dict:
+        """Send {shard: (method, args)} to every shard first, then collect the replies.
+
+        Each pipe is locked from its send to its reply only, so the next query
+        starts on a shard as soon as this one has answered there instead of
+        waiting for the slowest shard. Locks are taken in shard order, which
+        keeps concurrent scatters from deadlocking.
+        """
+        shards = sorted(calls)
+        sent = []
+        replies = {}
+        try:
+            for shard in shards:
+                self._locks[shard].acquire()
+                sent.append(shard)
+                self._conns[shard].send(calls[shard])
+            while sent:
+                shard = sent.pop(0)
+                try:
+                    replies[shard] = self._conns[shard].recv()
+                finally:
+                    self._locks[shard].release()
+        finally:
+            for shard in sent:
+                self._locks[shard].release()
+        for ok, result in replies.values():
+            if not ok:
+                raise ShardError(result)
+        return {shard: result for shard, (_, result) in replies.items()}
+
+    def _broadcast(self, method: str, *args) -> list:
+        return list(self._scatter({shard: (method, args) for shard in range(self.shards)}).values())
+
+    def shard_of(self, doc_id: int) -> int:
+        return doc_id % self.shards
+
+    def __len__(self):
+        return sum(self._broadcast("size"))
+
+    def build(self, docs: list):
+        parts = [[] for _ in range(self.shards)]
+        for doc in docs:
+            parts[self.shard_of(doc["id"])].append(doc)
+        self._scatter({shard: ("build", (part,)) for shard, part in enumerate(parts)})
+        self.generation = next(_GENERATIONS)
+
+    def apply_changes(self, changes: list):
+        parts = {}
+        for change in changes:
+            parts.setdefault(self.shard_of(change["id"]), []).append(change)
+        if parts:
+            self._scatter({shard: ("apply_changes", (part,)) for shard, part in parts.items()})
+            self.generation = next(_GENERATIONS)
+
+    def add(self, doc: dict):
+        self.apply_changes([{"op": "upsert", "id": doc["id"], "property": doc}])
+
+    def remove(self, doc_id: int):
+        self.apply_changes([{"op": "delete", "id": doc_id, "property": None}])
+
+    def warm(self):
+        self._broadcast("warm")
+
+    def query(self, q: str = "", city: str = "", property_type: str = "", ranges: dict = None,
+              limit: int = None, offset: int = 0, with_facets: bool = False):
+        """Same contract as SearchIndex.query; each shard returns its own top offset+limit"""
+        wanted = None if limit is None else offset + limit
+        replies = self._broadcast("query", q, city, property_type, ranges, wanted, 0, with_facets)
+        total = sum(reply[0] for reply in replies)
+        merged = heapq.merge(*(reply[1] for reply in replies), key=lambda hit: (hit[0], hit[1]), reverse=True)
+        hits = list(merged)[offset:None if wanted is None else wanted]
+        facets = None
+        if with_facets:
+            sums = {}
+            for _, _, shard_facets in replies:
+                for facet, counts in shard_facets.items():
+                    sums.setdefault(facet, Counter()).update(counts)
+            facets = {
+                facet: dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+                for facet, counts in sums.items()
+            }
+        return total, hits, facets
+
+    def autocomplete(self, text: str, limit: int = 10) -> list:
+        """Shard suggestions with their document counts summed"""
+        counts = Counter()
+        order = {}
+        for suggestions in self._broadcast("autocomplete", text, limit):
+            for position, suggestion in enumerate(suggestions):
+                key = (suggestion["text"], suggestion["type"])
+                counts[key] += suggestion["count"]
+                order[key] = min(order.get(key, position), position)
+        ranked = sorted(counts, key=lambda key: (-counts[key], order[key]))
+        return [{"text": text, "type": kind, "count": counts[(text, kind)]} for text, kind in ranked[:limit]]
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(("close", ()))
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
@@ -1,6 +1,24 @@
 import unittest
 import json
+import os
+import tempfile
+import threading
+from unittest import mock
+import app as search_app
 from app import app
+from index_snapshot import load_snapshot, write_snapshot
+from rwlock import ReadWriteLock
+from search_index import SearchIndex, normalize
+from sharded import ShardedIndex
+
+SAMPLE_PROPERTIES = [
+    {"id": 1, "title": "Квартира в центре", "description": "Уютная квартира", "city": "Кишинёв",
+     "address": "ул. Пушкина, 10", "property_type": "apartment", "price_eur": 50000, "rooms": 2, "area_m2": 48},
+    {"id": 2, "title": "Дом с садом", "description": "Большой дом", "city": "Бельцы",
+     "address": "ул. Мира, 5", "property_type": "house", "price_eur": 80000, "rooms": 4, "area_m2": 120},
+    {"id": 3, "title": "Apartament nou", "description": "Renovated flat", "city": "Chișinău",
+     "address": "Strada Columna 12", "property_type": "apartment", "price_eur": 65000, "rooms": 2},
+]
 
 class TestSearchService(unittest.TestCase):
     def setUp(self):
@@ -43,6 +61,295 @@ class TestSearchService(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertIsInstance(data, list)
+    
+    def test_change_feed_updates_index(self):
+        """Тест применения изменений из ленты property-service"""
+        pages = [
+            {"seq": 2, "has_more": True, "changes": [
+                {"seq": 1, "op": "upsert", "id": 1, "property": SAMPLE_PROPERTIES[0]},
+                {"seq": 2, "op": "upsert", "id": 2, "property": SAMPLE_PROPERTIES[1]},
+            ]},
+            {"seq": 3, "has_more": False, "changes": [
+                {"seq": 3, "op": "delete", "id": 1, "property": None},
+            ]},
+        ]
+        responses = [mock.Mock(status_code=200, **{"json.return_value": page}) for page in pages]
+        with mock.patch.object(search_app, "_INDEX", SearchIndex()), \
+                mock.patch.dict(search_app._FEED_STATE, {"seq": 0}), \
+                mock.patch("app.requests.get", side_effect=responses) as get:
+            self.assertEqual(search_app.poll_changes(), 3)
+            self.assertEqual(get.call_args.kwargs["params"]["since"], 2)
+            data = json.loads(self.client.get('/search?q=дом').data)
+            self.assertEqual([p["id"] for p in data], [2])
+            self.assertEqual(self.client.get('/search?q=квартира').headers["X-Total-Count"], "0")
+            self.assertEqual(json.loads(self.client.get('/index/status').data)["seq"], 3)
+    
+    def test_index_built_on_first_use(self):
+        """Тест ленивого создания индекса: импорт приложения не запускает процессы шардов"""
+        with mock.patch.object(search_app, "_INDEX", None), \
+                mock.patch.object(search_app, "make_index", return_value=SearchIndex()) as make_index:
+            make_index.assert_not_called()
+            self.client.get('/search?q=дом')
+            self.client.get('/autocomplete?q=до')
+            make_index.assert_called_once()
+    
+    def test_poller_started_by_first_request(self):
+        """Тест запуска опроса ленты первым запросом под любым сервером: сначала снимок, затем поток, один раз"""
+        app.config['TESTING'] = False
+        try:
+            with mock.patch.object(search_app, "reload_snapshot") as reload_snapshot, \
+                    mock.patch('threading.Thread') as thread:
+                self.client.get('/health')
+                self.client.get('/health')
+        finally:
+            app.config['TESTING'] = True
+        reload_snapshot.assert_called_once()
+        self.assertEqual(thread.call_args.kwargs['name'], 'change-feed-poller')
+        thread.return_value.start.assert_called_once()
+    
+    def test_searches_do_not_block_each_other(self):
+        """Тест параллельных поисков: блокировка индекса общая для чтения, исключительная для записи"""
+        lock = ReadWriteLock()
+        both_reading = threading.Barrier(2, timeout=2)
+        
+        def search():
+            with lock.read():
+                both_reading.wait()
+        
+        readers = [threading.Thread(target=search) for _ in range(2)]
+        with lock.read():
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+        self.assertFalse(both_reading.broken)
+        
+        read_done = threading.Event()
+        
+        def read_after_update():
+            with lock.read():
+                read_done.set()
+        
+        with lock.write():
+            threading.Thread(target=read_after_update).start()
+            self.assertFalse(read_done.wait(0.1))
+        self.assertTrue(read_done.wait(2))
+    
+    def test_reload_newer_snapshot(self):
+        """Тест загрузки снимка индекса с диска и пропуска уже загруженного"""
+        index = SearchIndex()
+        index.build(SAMPLE_PROPERTIES)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.snap")
+            write_snapshot(index, path, seq=5)
+            with mock.patch.object(search_app, "SNAPSHOT_PATH", path), \
+                    mock.patch.object(search_app, "_INDEX", SearchIndex()), \
+                    mock.patch.dict(search_app._FEED_STATE, {"seq": 0}), \
+                    mock.patch.dict(search_app._SNAPSHOT_STATE, {"seq": -1, "mtime": 0.0}):
+                self.assertTrue(search_app.reload_snapshot())
+                self.assertFalse(search_app.reload_snapshot())
+                self.assertEqual(search_app._FEED_STATE["seq"], 5)
+                data = json.loads(self.client.get('/search?q=дом').data)
+                self.assertEqual([p["id"] for p in data], [2])
+                
+                data = json.loads(self.client.get('/search?property_type=apartment&max_price=60000&facets=1').data)
+                self.assertEqual(data["total"], 1)
+                self.assertEqual(data["facets"]["city"], {"Кишинёв": 1})
+    
+    def test_autocomplete_endpoint(self):
+        """Тест endpoint подсказок"""
+        index = SearchIndex()
+        index.build(SAMPLE_PROPERTIES)
+        with mock.patch.object(search_app, "_INDEX", index):
+            response = self.client.get('/autocomplete?q=бел')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)[0]["text"], "Бельцы")
+            self.assertEqual(json.loads(self.client.get('/autocomplete').data), [])
+    
+    def test_query_cache_invalidated_by_index_update(self):
+        """Тест кэша запросов: попадание, инвалидация по поколению индекса и вытеснение"""
+        index = SearchIndex()
+        index.build(SAMPLE_PROPERTIES)
+        with mock.patch.object(search_app, "_INDEX", index), \
+                mock.patch.object(search_app, "_QUERY_CACHE", search_app.OrderedDict()), \
+                mock.patch.object(search_app, "QUERY_CACHE_SIZE", 2), \
+                mock.patch.dict(search_app._CACHE_STATS, {"hits": 0, "misses": 0, "evictions": 0}):
+            self.client.get('/search?city=Кишинёв')
+            data = json.loads(self.client.get('/search?city=  кишинев').data)
+            self.assertEqual(len(data), 2)
+            
+            index.add(dict(SAMPLE_PROPERTIES[1], id=4, city="Кишинёв"))
+            data = json.loads(self.client.get('/search?city=Кишинёв').data)
+            self.assertEqual(len(data), 3)
+            self.client.get('/search?q=дом')
+            
+            stats = json.loads(self.client.get('/metrics/cache').data)
+            self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 1))
+            self.assertEqual(stats['size'], 2)
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        """Индекс с тестовыми объектами"""
+        self.index = SearchIndex()
+        self.index.build(SAMPLE_PROPERTIES)
+    
+    def ids(self, **query):
+        return sorted(doc["id"] for doc in self.index.search(**query))
+    
+    def test_normalize(self):
+        """Тест нормализации кириллицы и латиницы"""
+        self.assertEqual(normalize("Кишинёв"), "кишинев")
+        self.assertEqual(normalize("Chișinău"), "chisinau")
+    
+    def test_multi_term_intersection(self):
+        """Тест пересечения списков для нескольких слов"""
+        self.assertEqual(self.ids(q="квартира центре"), [1])
+        self.assertEqual(self.ids(q="квартира сад"), [])
+        self.assertEqual(self.ids(q="кварт"), [1])
+    
+    def test_filters(self):
+        """Тест фильтров по городу и типу"""
+        self.assertEqual(self.ids(city="Бельцы"), [2])
+        self.assertEqual(self.ids(city="chisinau", property_type="apartment"), [1, 3])
+        self.assertEqual(self.ids(property_type="apartment"), [1, 3])
+        self.assertEqual(self.ids(q="renovated", property_type="house"), [])
+    
+    def test_update_and_remove(self):
+        """Тест обновления и удаления документа"""
+        updated = dict(SAMPLE_PROPERTIES[1], title="Коттедж")
+        self.index.add(updated)
+        self.assertEqual(self.ids(q="коттедж"), [2])
+        self.assertEqual(self.ids(q="садом"), [])
+        self.index.remove(2)
+        self.assertEqual(self.ids(), [1, 3])
+        self.assertEqual(self.ids(q="коттедж"), [])
+    
+    def test_bm25_ranking(self):
+        """Тест ранжирования: совпадение в заголовке выше, чем в описании"""
+        self.index.add({"id": 4, "title": "Дом у озера", "description": "Квартира рядом с озером",
+                        "city": "Кагул", "address": "ул. Лесная, 1", "property_type": "house"})
+        ranked = [doc["id"] for doc in self.index.search(q="квартира")]
+        self.assertEqual(ranked, [1, 4])
+    
+    def test_limit_and_offset(self):
+        """Тест постраничной выдачи top-k"""
+        total, page = self.index.rank(limit=2)
+        self.assertEqual((total, page), (3, [3, 2]))
+        total, page = self.index.rank(limit=2, offset=2)
+        self.assertEqual((total, page), (3, [1]))
+    
+    def test_snapshot_round_trip(self):
+        """Тест снимка: поиск по отображённому индексу и обновления поверх него"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.snap")
+            write_snapshot(self.index, path, seq=3)
+            mapped, seq = load_snapshot(path)
+            self.assertEqual(seq, 3)
+            self.assertEqual(len(mapped), 3)
+            for query in ({"q": "квартира"}, {"city": "chisinau"}, {"property_type": "apartment"}):
+                self.assertEqual(mapped.rank(**query), self.index.rank(**query))
+            
+            mapped.add(dict(SAMPLE_PROPERTIES[1], title="Коттедж"))
+            mapped.remove(1)
+            self.assertEqual([d["id"] for d in mapped.search(q="коттедж")], [2])
+            self.assertEqual([d["id"] for d in mapped.search(q="квартира")], [])
+            self.assertEqual(sorted(mapped.docs), [2, 3])
+            self.assertEqual(mapped.facet_counts(None)["property_type"], {"apartment": 1, "house": 1})
+            self.assertEqual(mapped.match(ranges={"rooms": (2, 2)}), {3})
+    
+    def test_snapshot_of_mapped_index_stays_mapped(self):
+        """Тест повторного снимка: постинги отображённого индекса не копируются в память"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.snap")
+            write_snapshot(self.index, path, seq=3)
+            mapped, _ = load_snapshot(path)
+            write_snapshot(mapped, os.path.join(tmp, "again.snap"), seq=4)
+            self.assertEqual(dict.__len__(mapped.postings), 0)
+            self.assertEqual(dict.__len__(mapped.field_postings), 0)
+            again, seq = load_snapshot(os.path.join(tmp, "again.snap"))
+            self.assertEqual(seq, 4)
+            self.assertEqual(again.rank(q="квартира"), self.index.rank(q="квартира"))
+    
+    def test_range_filters(self):
+        """Тест фильтров по диапазонам цены, площади и комнат"""
+        self.assertEqual(self.ids(ranges={"price_eur": (60000, None)}), [2, 3])
+        self.assertEqual(self.ids(ranges={"price_eur": (None, 65000), "rooms": (2, 2)}), [1, 3])
+        self.assertEqual(self.ids(ranges={"area_m2": (50, 200)}), [2])
+        self.assertEqual(self.ids(q="квартира", ranges={"price_eur": (60000, 90000)}), [])
+    
+    def test_facet_counts(self):
+        """Тест подсчёта фасетов по найденному множеству"""
+        facets = self.index.facet_counts(self.index.match(property_type="apartment"))
+        self.assertEqual(facets["city"], {"Chișinău": 1, "Кишинёв": 1})
+        self.assertEqual(facets["property_type"], {"apartment": 2})
+        self.assertEqual(facets["price"], {"50000-100000": 2})
+        self.index.remove(1)
+        self.assertEqual(self.index.facet_counts(None)["city"], {"Chișinău": 1, "Бельцы": 1})
+    
+    def test_transliteration_and_typos(self):
+        """Тест транслитерации, префиксов и опечаток в названиях"""
+        self.assertEqual(self.ids(q="Кишин"), [1, 3])
+        self.assertEqual(self.ids(q="Kishinev"), [1, 3])
+        self.assertEqual(self.ids(q="Пушкна"), [1])
+        self.assertEqual(self.ids(q="Кишенёв"), [1, 3])
+        self.assertEqual(self.ids(q="Колумна"), [3])
+    
+    def test_prefix_only_for_last_token(self):
+        """Тест префиксного поиска только по последнему слову от трёх букв"""
+        self.assertEqual(self.ids(q="центре ква"), [1])
+        self.assertEqual(self.ids(q="центре кв"), [])
+        self.assertEqual(self.ids(q="кв центре"), [])
+        self.assertEqual(self.index.expand("кв", prefix=True), {})
+        with mock.patch.object(self.index, "expand", wraps=self.index.expand) as expand:
+            self.index.query(q="квартира центре", limit=10)
+        self.assertEqual(expand.call_count, 2)
+    
+    def test_autocomplete(self):
+        """Тест подсказок по префиксу, включая латиницу"""
+        suggestions = self.index.autocomplete("Киш")
+        self.assertEqual(suggestions[0], {"text": "Кишинёв", "type": "city", "count": 1})
+        texts = [s["text"] for s in self.index.autocomplete("chis")]
+        self.assertIn("Кишинёв", texts)
+        self.assertIn("Chișinău", texts)
+        self.assertNotIn("кишинев", texts)
+        
+        self.index.add({"id": 4, "title": "Квартира", "city": "Кишинёв", "address": "ул. Пушкина, 1"})
+        self.assertEqual(self.index.autocomplete("киш")[0]["count"], 2)
+        self.index.remove(1)
+        self.index.remove(4)
+        self.assertEqual([s["text"] for s in self.index.autocomplete("пуш")], [])
+    
+    def test_sharded_index(self):
+        """Тест шардированного индекса: слияние top-k, фасетов и подсказок"""
+        sharded = ShardedIndex(2)
+        self.addCleanup(sharded.close)
+        sharded.build(SAMPLE_PROPERTIES)
+        self.assertEqual(len(sharded), 3)
+        total, hits, facets = sharded.query(property_type="apartment", limit=1, with_facets=True)
+        self.assertEqual((total, [doc_id for _, doc_id, _ in hits]), (2, [3]))
+        self.assertEqual(facets, self.index.query(property_type="apartment", with_facets=True)[2])
+        total, hits, _ = sharded.query(limit=2, offset=1)
+        self.assertEqual((total, [doc_id for _, doc_id, _ in hits]), (3, [2, 1]))
+        _, hits, _ = sharded.query(q="квартира")
+        self.assertEqual([doc["id"] for _, _, doc in hits], [1])
+        
+        sharded.apply_changes([
+            {"op": "upsert", "id": 4, "property": dict(SAMPLE_PROPERTIES[0], id=4)},
+            {"op": "delete", "id": 2, "property": None},
+        ])
+        self.assertEqual(sharded.query()[0], 3)
+        self.assertEqual(sharded.autocomplete("Киш")[0], {"text": "Кишинёв", "type": "city", "count": 2})
+        
+        # Concurrent queries share the shard pipes without mixing up replies
+        results = []
+        threads = [threading.Thread(target=lambda q=q: results.append((q, sharded.query(q=q)[0])))
+                   for q in ("квартира", "дом", "apartament", "сад") * 5]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 20)
+        self.assertEqual(set(results), {("квартира", 2), ("apartament", 1), ("дом", 0), ("сад", 0)})
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,122 @@
+"""In-memory cache of small, frequently read files.
+
+A few cover photos and thumbnails get most of the reads; serving them from
+memory skips the existence checks, the open and the read. The cache is an LRU
+bounded by total bytes. A file is admitted only once it has been asked for
+``admit_after`` times, so one pass over the catalogue (a crawler, a backfill)
+does not flush the files that are actually hot. Access counts are halved when
+too many keys are tracked, which lets old popularity fade. Files above
+``max_file_size`` bypass the cache.
+
+Only files whose name fixes their content are offered, so entries never go
+stale; callers drop entries for files they delete.
+
+Used by property-service and media-service; edit this source in
+``microservices/shared`` and copy it with sync_shared.py.
+"""
+from collections import Counter, OrderedDict, namedtuple
+import mimetypes
+import os
+import threading
+
+CachedFile = namedtuple("CachedFile", "data mimetype etag last_modified")
+
+# Access counts kept for admission, per cache entry the cache could hold
+TRACKED_PER_ENTRY = 16
+
+
+class HotFileCache:
+    """Byte-bounded LRU of small files keyed by request identity (name, variant, ...)"""
+
+    def __init__(self, max_bytes: int, max_file_size: int, admit_after: int = 2):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.admit_after = admit_after
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._frequency = Counter()
+        self._max_tracked = max(1024, TRACKED_PER_ENTRY * max_bytes // max(max_file_size, 1))
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "admitted": 0, "rejected": 0, "bypassed": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """Cached file or None; a miss counts towards the key's admission"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+            self._stats["misses"] += 1
+            self._frequency[key] += 1
+            if len(self._frequency) > self._max_tracked:
+                self._frequency = Counter({k: n // 2 for k, n in self._frequency.items() if n > 1})
+            return None
+
+    def admit(self, key, path: str):
+        """Load path into the cache if the key is hot enough and the file small enough"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._frequency[key] < self.admit_after:
+                self._stats["rejected"] += 1
+                return None
+        try:
+            stat = os.stat(path)
+            if stat.st_size > self.max_file_size:
+                with self._lock:
+                    self._stats["bypassed"] += 1
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        entry = CachedFile(
+            data, mimetypes.guess_type(path)[0] or "application/octet-stream",
+            os.path.basename(path), stat.st_mtime,
+        )
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous.data)
+            self._entries[key] = entry
+            self.bytes += len(data)
+            self._frequency.pop(key, None)
+            self._stats["admitted"] += 1
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted.data)
+                self._stats["evictions"] += 1
+        return entry
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self.bytes -= len(entry.data)
+                self._frequency.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._frequency.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self.bytes,
+                max_bytes=self.max_bytes,
+                max_file_size=self.max_file_size,
+                hit_rate=round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            )
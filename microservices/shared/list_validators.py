@@ -0,0 +1,40 @@
+"""Conditional GET for list endpoints.
+
+A list is validated by an ETag over the matching rows' count, max(id) and
+max(version column), computed by one aggregate query before any row is
+loaded. A delete changes the count and an edit the max version (stored to
+the microsecond), so the ETag moves with every change; a 304 is answered
+from If-None-Match only. Lists carry no Last-Modified: max(version) does not
+move on a delete, and its one-second resolution misses a second edit within
+the same second.
+
+Shared by the services with conditional lists; the source lives in
+``microservices/shared`` and is copied into each service by sync_shared.py.
+"""
+import hashlib
+
+from flask import current_app, jsonify, request
+from sqlalchemy import func
+
+
+def list_etag(query, model, version_column, scope: str = "") -> str:
+    """ETag of the query's rows from count, max(id) and max(version) without loading them"""
+    count, max_id, version = query.order_by(None).with_entities(
+        func.count(model.id), func.max(model.id), func.max(version_column)
+    ).one()
+    return hashlib.sha1(f"{scope}:{count}:{max_id}:{version}".encode()).hexdigest()
+
+
+def is_not_modified(etag: str) -> bool:
+    return bool(request.if_none_match) and request.if_none_match.contains(etag)
+
+
+def conditional_list(query, model, version_column, scope: str = ""):
+    """JSON list of the query rows with an ETag, or 304 without loading them"""
+    etag = list_etag(query, model, version_column, scope)
+    if is_not_modified(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify([row.to_dict() for row in query.all()])
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,125 @@
+"""Transactional outbox for notifications.
+
+A service writes the notification as an OutboxMessage row in the same
+transaction as the change it announces, so it is sent only if that change
+commits and is not lost if notification-service is down. A dispatcher thread
+delivers due rows in batches to notification-service /notifications/batch;
+a failed batch is retried with exponential backoff. Every row carries an
+idempotency key, so a batch delivered twice is stored once.
+
+Used by auth, inquiry, payment and property; edit this source in
+``microservices/shared`` and copy it with sync_shared.py.
+"""
+from datetime import datetime, timedelta
+import threading
+import uuid
+
+from flask import jsonify
+import requests
+from sqlalchemy import Column, DateTime, Integer, String, Text, event, func
+
+
+class OutboxMessageMixin:
+    """Columns of the outbox table; each service declares ``OutboxMessage(OutboxMessageMixin, db.Model)``"""
+    id = Column(Integer, primary_key=True)
+    # Idempotency key: notification-service stores a batch delivered twice only once
+    key = Column(String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
+    recipient = Column(String(255), nullable=False)
+    channel = Column(String(50), nullable=False)
+    message = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    last_error = Column(String(255))
+
+
+class Outbox:
+    """Queue and dispatcher of one service's outbox; serves its counters on /metrics/outbox"""
+
+    def __init__(self, app, db, model, notification_url: str, poll_interval: float,
+                 batch_size: int, timeout: float, max_backoff: float):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.url = f"{notification_url}/notifications/batch"
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self._stats = {"sent": 0, "rejected": 0, "batches": 0, "failed_batches": 0}
+        self._stats_lock = threading.Lock()
+        # Set by a commit that queued notifications, so they go out without waiting for the next poll
+        self._wake = threading.Event()
+        event.listen(db.session, "after_commit", self._wake_after_commit)
+        event.listen(db.session, "after_rollback", self._forget_wakeup)
+        app.add_url_rule("/metrics/outbox", "outbox_metrics", self.metrics, methods=["GET"])
+
+    def enqueue(self, recipient: str, channel: str, message: str):
+        """Queue a notification in the current transaction; it is delivered only if that commits"""
+        self.db.session.add(self.model(recipient=recipient, channel=channel, message=message))
+        self.db.session.info["outbox_queued"] = True
+
+    def _wake_after_commit(self, session):
+        if session.info.pop("outbox_queued", False):
+            self._wake.set()
+
+    def _forget_wakeup(self, session):
+        session.info.pop("outbox_queued", None)
+
+    def dispatch(self) -> int:
+        """Deliver one batch of due notifications, returns how many rows left the outbox"""
+        Message = self.model
+        now = datetime.utcnow()
+        batch = (Message.query.filter(Message.next_attempt_at <= now)
+                 .order_by(Message.id).limit(self.batch_size).all())
+        if not batch:
+            return 0
+        payload = [{"key": m.key, "recipient": m.recipient, "channel": m.channel, "message": m.message}
+                   for m in batch]
+        try:
+            response = requests.post(self.url, json={"notifications": payload}, timeout=self.timeout)
+            response.raise_for_status()
+            rejected = len(response.json().get("rejected", []))
+        except (requests.RequestException, ValueError) as e:
+            for m in batch:
+                m.attempts += 1
+                m.next_attempt_at = now + timedelta(seconds=min(2 ** m.attempts, self.max_backoff))
+                m.last_error = str(e)[:255]
+            self.db.session.commit()
+            with self._stats_lock:
+                self._stats["failed_batches"] += 1
+            print(f"Outbox delivery of {len(batch)} notifications failed: {e}")
+            return 0
+        for m in batch:
+            self.db.session.delete(m)
+        self.db.session.commit()
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["sent"] += len(batch) - rejected
+            self._stats["rejected"] += rejected
+        return len(batch)
+
+    def run(self):
+        while True:
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    # Drain the backlog, then sleep until a commit queues more or the poll interval passes
+                    while self.dispatch() == self.batch_size:
+                        pass
+            except Exception as e:
+                print(f"Outbox dispatch failed: {e}")
+            self._wake.wait(self.poll_interval)
+
+    def start(self):
+        if self.poll_interval > 0:
+            threading.Thread(target=self.run, name="outbox-dispatcher", daemon=True).start()
+
+    def metrics(self):
+        """Notification outbox backlog and dispatcher counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self.model.query.count()
+        oldest = self.db.session.query(func.min(self.model.created_at)).scalar()
+        stats["oldest_pending"] = oldest.isoformat() if oldest else None
+        return jsonify(stats), 200
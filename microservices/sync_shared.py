@@ -0,0 +1,53 @@
+"""Copy the modules in shared/ into the services that use them.
+
+Every service is built from its own directory (see docker-compose.yml), so a
+module shared by several services has to sit in each build context. The
+source of truth is shared/<module>; edit it there and run this script, never
+the copies.
+
+Usage:
+    python sync_shared.py          # copy shared modules into the services
+    python sync_shared.py --check  # exit 1 if a copy differs from shared/
+"""
+import filecmp
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# shared module -> services that import it
+SHARED_MODULES = {
+    "background.py": ("auth-service", "inquiry-service", "notification-service", "payment-service",
+                      "project-service", "property-service", "reporting-service", "search-service"),
+    "hot_cache.py": ("media-service", "property-service"),
+    "outbox.py": ("auth-service", "inquiry-service", "payment-service", "property-service"),
+    "list_validators.py": ("inquiry-service", "notification-service", "payment-service", "property-service"),
+}
+
+
+def copies():
+    for module, services in SHARED_MODULES.items():
+        for service in services:
+            yield os.path.join(ROOT, "shared", module), os.path.join(ROOT, service, module)
+
+
+def main(argv):
+    check = "--check" in argv
+    stale = []
+    for source, target in copies():
+        if os.path.exists(target) and filecmp.cmp(source, target, shallow=False):
+            continue
+        if check:
+            stale.append(os.path.relpath(target, ROOT))
+        else:
+            shutil.copyfile(source, target)
+            print(f"updated {os.path.relpath(target, ROOT)}")
+    if stale:
+        print("out of sync with shared/: " + ", ".join(stale))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))